@@ -0,0 +1,125 @@
+"""Position analysis for hints and post-game reviews.
+
+Scoring every column of a position takes a search per column, so `PositionAnalyzer` runs the searches as jobs in
+worker processes (see `jobs.py`). Results are cached by the board's canonical hash, so a position and its mirror image
+share an entry, and requests for a position that's already being searched wait for that search instead of starting
+another one.
+"""
+from collections import OrderedDict
+
+from gevent.event import AsyncResult
+
+from opening_book import open_default_book
+from solver import (
+    Solver,
+    board_position,
+)
+
+
+# Time a worker spends analyzing a position
+ANALYSIS_TIME_BUDGET = 0.5
+
+# Time an analysis may take, waiting for a worker included
+ANALYSIS_TIMEOUT = 5.0
+
+# Analyses kept per app process
+ANALYSIS_CACHE_SIZE = 4096
+
+# The solver of a worker process, created on its first analysis and kept so its transposition table stays warm
+_worker_solver = None
+
+
+def _analyze_position(position, mask, time_budget):
+    # Runs in a worker process
+    global _worker_solver
+    if _worker_solver is None:
+        _worker_solver = Solver(book=open_default_book())
+
+    return _worker_solver.analyze_position(position, mask, time_budget=time_budget)
+
+
+class PositionAnalyzer(object):
+    """Analyzes positions in worker processes, caching the results.
+
+    Only the standard board can be analyzed. Meant to be used from greenlets of a single thread.
+    """
+
+    def __init__(self, dispatcher, cache_size=ANALYSIS_CACHE_SIZE, time_budget=ANALYSIS_TIME_BUDGET,
+                 timeout=ANALYSIS_TIMEOUT):
+        self.dispatcher = dispatcher
+        self.cache_size = cache_size
+        self.time_budget = time_budget
+        self.timeout = timeout
+        # Canonical hash => analysis of the position with that hash, least recently used first
+        self._analyses = OrderedDict()
+        # Canonical hash => AsyncResult of the search running for it
+        self._searches = {}
+        self.hits = 0
+        self.merged = 0
+        self.searches = 0
+        self.evictions = 0
+
+    def analyze(self, board):
+        """Score every legal move of the player to move.
+
+        Args:
+            board (Board): a standard board
+
+        Returns:
+            a `solver.AnalysisResult`
+
+        Raises:
+            jobs.JobError: if the search couldn't be queued or didn't finish in time
+        """
+        key = board.canonical_hash
+        # Analyses are stored for the position with the canonical hash, so a mirror image needs its columns flipped
+        mirrored = key != board.position_hash
+
+        analysis = self._analyses.pop(key, None)
+        if analysis is not None:
+            self._analyses[key] = analysis
+            self.hits += 1
+        elif key in self._searches:
+            self.merged += 1
+            analysis = self._searches[key].get()
+        else:
+            position, mask = board_position(board)
+            analysis = self._search(key, position, mask, mirrored)
+
+        return analysis.mirrored() if mirrored else analysis
+
+    def stats(self):
+        return dict(
+            size=len(self._analyses),
+            hits=self.hits,
+            merged=self.merged,
+            searches=self.searches,
+            evictions=self.evictions,
+        )
+
+    def _search(self, key, position, mask, mirrored):
+        self.searches += 1
+        search = self._searches[key] = AsyncResult()
+        try:
+            # Not owned by whoever asked first: requests merged into the search need it just as much
+            job = self.dispatcher.submit(
+                'analysis', _analyze_position, (position, mask, self.time_budget), timeout=self.timeout,
+            )
+            analysis = job.get()
+        except BaseException as e:
+            # Requests merged into this search fail with it
+            search.set_exception(e)
+            raise
+        finally:
+            del self._searches[key]
+
+        if mirrored:
+            analysis = analysis.mirrored()
+        search.set(analysis)
+
+        self._analyses[key] = analysis
+        while len(self._analyses) > self.cache_size:
+            self._analyses.popitem(last=False)
+            self.evictions += 1
+
+        return analysis
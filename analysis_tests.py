@@ -0,0 +1,57 @@
+import unittest
+
+import gevent
+
+from analysis import PositionAnalyzer
+from board_model import Board, DiscType
+from jobs import JobDispatcher
+from solver import WIN_THRESHOLD
+
+
+def _board(moves):
+    board = Board()
+    for index, column_index in enumerate(moves):
+        board.drop_disc(column_index, DiscType.PLAYER_1 if index % 2 == 0 else DiscType.PLAYER_2)
+    return board
+
+
+class PositionAnalyzerTests(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PositionAnalyzer(JobDispatcher(workers=1), time_budget=0.05)
+
+    def tearDown(self):
+        self.analyzer.dispatcher.close()
+
+    def test_analyze(self):
+        # Player 1 wins by completing the bottom row
+        moves = [0, 0, 1, 1, 2, 2]
+        analysis = self.analyzer.analyze(_board(moves))
+        self.assertEqual(sorted(analysis.scores), range(Board.WIDTH))
+        self.assertEqual(analysis.best_column_index, 3)
+        self.assertGreater(analysis.scores[3], WIN_THRESHOLD)
+        self.assertEqual(self.analyzer.analyze(_board(moves)), analysis)
+        self.assertEqual(self.analyzer.stats()["hits"], 1)
+
+        # The mirror image comes from the cache, with its columns flipped
+        mirrored = self.analyzer.analyze(_board([Board.WIDTH - 1 - column_index for column_index in moves]))
+        self.assertEqual(mirrored.best_column_index, 3)
+        self.assertEqual(mirrored.scores[6], analysis.scores[0])
+        self.assertEqual(self.analyzer.stats()["searches"], 1)
+
+    def test_merges_concurrent_requests(self):
+        greenlets = [gevent.spawn(self.analyzer.analyze, Board()) for _ in xrange(5)]
+        gevent.joinall(greenlets, raise_error=True)
+        self.assertTrue(all(greenlet.value == greenlets[0].value for greenlet in greenlets))
+        self.assertEqual(self.analyzer.stats()["searches"], 1)
+        self.assertEqual(self.analyzer.stats()["merged"], 4)
+
+    def test_cache_is_bounded(self):
+        self.analyzer.cache_size = 2
+        for column_index in (0, 1, 2):
+            board = Board()
+            board.drop_disc(column_index, DiscType.PLAYER_1)
+            self.analyzer.analyze(board)
+
+        self.assertEqual(self.analyzer.stats()["size"], 2)
+        self.assertEqual(self.analyzer.stats()["evictions"], 1)
+
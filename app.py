@@ -1,3 +1,5 @@
+import os
+
 import simplejson as json
 
 from flask import (
@@ -5,6 +7,8 @@ from flask import (
     Flask,
     redirect,
     render_template,
+    request,
+    Response,
     session,
     url_for,
 )
@@ -18,15 +22,59 @@ from flask.ext.socketio import (
 )
 from shortuuid import ShortUUID
 
-from board_model import GridColumnFullError
+from analysis import PositionAnalyzer
+from board_model import (
+    STANDARD_VARIANT,
+    Board,
+    BoardVariant,
+    GridColumnFullError,
+)
+from broadcast import fan_out_manager
 from game_store import (
+    ConcurrentUpdateError,
     GameOverError,
     GameStore,
     OutOfTurnError,
+    StaleMoveError,
+    start_cache_invalidation_listener,
 )
 from helpers import (
+    AI_JOB_TIMEOUT,
+    ai_position_to_play,
     authenticate,
+    create_pending_game,
+    game_states,
+    json_analysis,
     json_game_state,
+    json_match_found,
+    json_move_delta,
+    load_match_token,
+    load_new_game_token,
+    new_game_token,
+    play_ai_move,
+    search_ai_move,
+    unit_of_work,
+)
+from jobs import (
+    DeadlineExceededError,
+    JobDispatcher,
+    JobError,
+    QueueFullError,
+)
+from matchmaking import (
+    MATCH_TICKET_TTL,
+    Matchmaker,
+    create_match_game,
+    match_bucket,
+)
+from metrics import (
+    CONTENT_TYPE,
+    registry,
+    socket_event_seconds,
+)
+from sweeper import (
+    GameSweeper,
+    start_sweeper,
 )
 
 
@@ -37,70 +85,324 @@ app.config.update(
     DEBUG=True,
     SECRET_KEY='secret!'
 )
-socketio = SocketIO(app)
+# When the app runs as several processes (see gunicorn_config.py), room broadcasts go through this Redis pub/sub
+# URL so they reach clients connected to any process
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+# Whether this process sweeps abandoned games in the background. Processes that do take turns through a Redis lease
+# (see sweeper.py); set to 0 in processes that shouldn't take part, e.g. when `python sweeper.py` runs on its own.
+RUN_SWEEPER = os.environ.get('RUN_SWEEPER', '1') == '1'
+
+# Board variants players can pick with `/?variant=<name>`. The AI only plays the standard board.
+VARIANTS = {
+    'standard': STANDARD_VARIANT,
+    '8x7': BoardVariant(8, 7, 4),
+    '9x7': BoardVariant(9, 7, 4),
+    'connect5': BoardVariant(9, 6, 5),
+}
+
+# Skill levels players can pick with `/match?skill=<level>` to be paired with players of the same level. Without one,
+# they're paired with anyone else who didn't pick a level.
+SKILL_LEVELS = ('beginner', 'intermediate', 'expert')
+
+# Socket.IO namespace of the matchmaking page
+MATCH_NAMESPACE = '/match'
+
+# Socket.IO namespace of spectators, who get a game's broadcasts but have no handlers that change anything
+WATCH_NAMESPACE = '/watch'
+
+# Player position that game.js shows a game to spectators with
+SPECTATOR_POSITION = 0
+
+socketio = SocketIO(app, client_manager=fan_out_manager(SOCKETIO_MESSAGE_QUEUE))
+start_cache_invalidation_listener()
+game_sweeper = start_sweeper() if RUN_SWEEPER else GameSweeper()
+# AI replies, hints and game reviews are searched in worker processes, so they never hold up the event loop
+job_dispatcher = JobDispatcher()
+position_analyzer = PositionAnalyzer(job_dispatcher)
+
+# Socket connections to this process, by session id, and the game each one is playing
+connected_games = {}
+
+# Spectator connections to this process, by session id, and the game each one is watching
+watched_games = {}
+
+registry.callback(
+    'connectfour_active_connections', "Socket connections to this process.", lambda: len(connected_games),
+)
+registry.callback(
+    'connectfour_spectators', "Spectator socket connections to this process.", lambda: len(watched_games),
+)
+registry.callback(
+    'connectfour_active_games', "Games with a socket connected to this process.",
+    lambda: len(set(connected_games.values())),
+)
+registry.callback(
+    'connectfour_sweeper_total', "Games scanned and deleted, keys deleted and bytes reclaimed by the sweeper.",
+    lambda: dict(((name,), count) for name, count in game_sweeper.stats().iteritems()),
+    type_name='counter', label_names=['stat'],
+)
+registry.callback(
+    'connectfour_analysis_cache_entries', "Position analyses in this process's cache.",
+    lambda: position_analyzer.stats()["size"],
+)
+registry.callback(
+    'connectfour_analysis_events_total', "Analyses served from the cache, merged into a running search or searched, "
+    "and cache evictions.",
+    lambda: dict(((event,), count) for event, count in position_analyzer.stats().iteritems() if event != 'size'),
+    type_name='counter', label_names=['event'],
+)
+registry.callback(
+    'connectfour_game_state_cache_entries', "Encoded game states in this process's cache.",
+    lambda: game_states.stats()["size"],
+)
+registry.callback(
+    'connectfour_game_state_cache_events_total', "Encoded game states served from the cache, encoded, or read for "
+    "spectators merged into a read already running.",
+    lambda: dict(((event,), count) for event, count in game_states.stats().iteritems() if event != 'size'),
+    type_name='counter', label_names=['event'],
+)
+registry.callback(
+    'connectfour_jobs', "Jobs waiting for a worker process and running in one.",
+    lambda: dict(((state,), count) for state, count in job_dispatcher.stats().iteritems()),
+    label_names=['state'],
+)
 
 
 ### Routes ###
 
 # TODO(nikrad): Add docstrings for routes
 
+# New games are only written to Redis once their first player's socket connects, so bots and prefetches that load
+# `/` cost nothing. Until then the game only exists as the signed token in its URL.
+
 @app.route('/')
 def index():
-    new_game_id = GameStore.create()
-    return redirect(url_for('game_page', game_id=new_game_id))
+    variant = VARIANTS.get(request.args.get('variant', 'standard'))
+    if variant is None:
+        abort(404)
+
+    new_game_id = GameStore.new_game_id()
+    return redirect(url_for('game_page', game_id=new_game_id, new=new_game_token(new_game_id, variant=variant)))
+
+
+@app.route('/ai')
+def ai_game():
+    new_game_id = GameStore.new_game_id()
+    return redirect(url_for('game_page', game_id=new_game_id, new=new_game_token(new_game_id, ai_opponent=True)))
+
+
+@app.route('/match')
+def match():
+    # Wait for an opponent; the game is created once one turns up (see `handle_match_connect()`)
+    variant_name = request.args.get('variant', 'standard')
+    skill = request.args.get('skill')
+    if variant_name not in VARIANTS or (skill is not None and skill not in SKILL_LEVELS):
+        abort(404)
+
+    # Every visit queues as a new player, who gets their seat in the game from the match token
+    session['match_player_id'] = ShortUUID().random(length=16)
+    session['match_variant'] = variant_name
+    session['match_bucket'] = match_bucket(variant_name, skill)
+
+    return render_template("matchmaking.html", max_wait=MATCH_TICKET_TTL)
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/<game_id>/analysis')
+def game_analysis(game_id):
+    # Scores of each column for the board after board change `seq` (default: the current board), for reviews
+    game = unit_of_work(game_id).game
+    if not game or game["variant"] != STANDARD_VARIANT:
+        abort(404)
+
+    seq = request.args.get('seq', game["seq"], type=int)
+    if seq == game["seq"]:
+        board = Board.from_trusted(game["grid"])
+    elif 0 <= seq < game["seq"]:
+        board = GameStore.replay(game_id, upto=seq)
+    else:
+        abort(404)
+
+    try:
+        analysis = position_analyzer.analyze(board)
+    except JobError:
+        # Too busy, or the search didn't finish in time
+        abort(503)
+
+    return Response(json_analysis(analysis, seq), content_type='application/json')
+
+
+@app.route('/<game_id>/watch')
+def watch_game(game_id):
+    # Spectators only read the game: from this process's caches, or once from Redis if it has no current copy
+    if game_states.current(game_id) is None:
+        abort(404)
+
+    return render_template(
+        "game.html",
+        game_id=game_id,
+        position=SPECTATOR_POSITION,
+    )
 
 
 @app.route('/<game_id>')
 def game_page(game_id):
     # Validate game id
-    game = GameStore.get(game_id)
+    work = unit_of_work(game_id)
+    game = work.game
     if not game:
-        abort(404)
+        token = request.args.get('new')
+        if load_new_game_token(token, game_id) is None:
+            abort(404)
+
+        # The game is created with this player in it when the page connects
+        if session.get('game_id') != game_id:
+            session['game_id'] = game_id
+            session['player_id'] = ShortUUID().random(length=16)
+        session['new_game_token'] = token
+
+        return render_template(
+            "game.html",
+            game_id=game_id,
+            player_id=session['player_id'],
+            position=1,
+            game_url=url_for('game_page', game_id=game_id),
+        )
+
+    game_url = None
+    match_player_id = load_match_token(request.args.get('match'), game_id)
+    if match_player_id in game["player_positions"]:
+        # A matched player opening their game
+        session['game_id'] = game_id
+        session['player_id'] = match_player_id
+        game_url = url_for('game_page', game_id=game_id)
 
     session_game_id = session.get('game_id')
     session_player_id = session.get('player_id')
-    players = GameStore.get_players(game_id)
-    if session_game_id != game.get('game_id') or session_player_id not in players:
+    players = game["player_positions"]
+    if session_game_id != game_id or session_player_id not in players:
         if len(players) == 2:
             # The game is full
             return render_template('game_is_full.html')
 
         # New player
         new_player_id = ShortUUID().random(length=16)
-        position = GameStore.add_player(game_id, new_player_id)
+        work.add_player(new_player_id)
+        position, = work.execute()
 
         session['game_id'] = game_id
         session['player_id'] = new_player_id
     else:
-        GameStore.add_player_connection(game_id, session_player_id)
-        position = game["player_positions"][session_player_id]
+        work.add_player_connection(session_player_id)
+        work.execute()
+        position = players[session_player_id]
 
     return render_template(
         "game.html",
         game_id=game_id,
         player_id=session['player_id'],
         position=position,
+        game_url=game_url,
     )
 
 
+def broadcast(event, json_data, game_id):
+    """Send an event to everyone in a game's room: its players and its spectators.
+
+    The event is encoded once for each namespace, however many connections it goes to (see `broadcast.py`).
+    """
+    socketio.emit(event, json_data, room=game_id)
+    socketio.emit(event, json_data, room=game_id, namespace=WATCH_NAMESPACE)
+
+
+def is_spectator():
+    """Whether the socket is a spectator's, which game.js opens with the watched game's id in its query string.
+
+    Every Socket.IO client connects to the default namespace, spectators included; they just never use it.
+    """
+    return 'game_id' in request.args
+
+
+### AI replies ###
+
+def schedule_ai_turn(game):
+    """Start searching for the AI's reply if it's the AI's move, to be played and sent to the game's room when found.
+
+    Args:
+        game (dict): the game data dictionary
+    """
+    ai_position = ai_position_to_play(game)
+    if ai_position is None or job_dispatcher.pending(game["game_id"]):
+        return
+
+    sid = request.sid
+    try:
+        job_dispatcher.submit(
+            'ai_move', search_ai_move, (game["grid"], ai_position), owner=game["game_id"], timeout=AI_JOB_TIMEOUT,
+            callback=lambda job: finish_ai_turn(game, sid, job),
+        )
+    except QueueFullError:
+        print("Too many jobs queued for the AI to reply in game %s" % game["game_id"])
+        data = dict(message="The server is too busy for the AI to reply. Please reload the page in a moment.")
+        emit("alert", json.dumps(data))
+
+
+def finish_ai_turn(game, sid, job):
+    # Job callback: runs in a greenlet of its own, outside any socket event, so events go out through `socketio`
+    game_id = game["game_id"]
+    try:
+        ai_game = play_ai_move(game, job.get())
+    except (StaleMoveError, GameOverError, OutOfTurnError):
+        # The game moved on without the AI, e.g. it was restarted
+        return
+    except DeadlineExceededError:
+        print("The AI ran out of time in game %s" % game_id)
+        data = dict(message="The AI couldn't find a move in time. Please reload the page to let it try again.")
+        socketio.emit("alert", json.dumps(data), room=sid)
+        return
+    except (JobError, ConcurrentUpdateError) as e:
+        print("The AI couldn't play in game %s: %r" % (game_id, e))
+        data = dict(message="The AI couldn't play its move. Please reload the page to let it try again.")
+        socketio.emit("alert", json.dumps(data), room=sid)
+        return
+
+    json_data = json_move_delta(ai_game)
+    broadcast('move', json_data, game_id)
+
+
 @socketio.on('connect')
+@socket_event_seconds.timed('connect')
 def handle_connect():
+    if is_spectator():
+        return
+
     game, player_id = authenticate(session)
-    players = game["player_positions"]
+    if not game:
+        game, player_id = create_pending_game(session)
     if not game:
         print('Invalid connection. Disconnecting!')
         return disconnect()
 
     game_id = game["game_id"]
-    print("Player %d connected to game %s" % (players[player_id], game_id))
+    connected_games[request.sid] = game_id
+    print("Player %d connected to game %s" % (game["player_positions"][player_id], game_id))
     if game_id not in rooms():
         join_room(game_id)
 
     json_data = json_game_state(game)
-    emit('game_state', json_data, room=game_id)
+    broadcast('game_state', json_data, game_id)
+
+    # The AI's reply may have been cancelled when everyone left the game
+    schedule_ai_turn(game)
 
 
 @socketio.on('drop_disc')
+@socket_event_seconds.timed('drop_disc')
 def handle_drop_disc(json_data):
     game, player_id = authenticate(session)
     if not game:
@@ -112,9 +414,12 @@ def handle_drop_disc(json_data):
     column_index = data.get('column_index')
     game_id = game["game_id"]
     try:
-        game = GameStore.play_turn(game_id, player_id, column_index)
-        json_data = json_game_state(game)
-        emit('game_state', json_data, room=game_id)
+        game = GameStore.play_turn(game_id, player_id, column_index, game=game)
+        json_data = json_move_delta(game)
+        broadcast('move', json_data, game_id)
+
+        # The AI replies once its search is done
+        schedule_ai_turn(game)
     except OutOfTurnError:
         print("Player %d out of turn" % game["player_positions"][player_id])
         data = dict(message="It's not your turn!")
@@ -127,40 +432,155 @@ def handle_drop_disc(json_data):
         print("The game has ended")
         data = dict(message="The game is over!")
         emit("alert", json.dumps(data))
+    except ConcurrentUpdateError:
+        print("Game %s is too busy to play a disc" % game_id)
+        data = dict(message="Your move couldn't be saved. Please try again.")
+        emit("alert", json.dumps(data))
+
+
+@socketio.on('analyze')
+@socket_event_seconds.timed('analyze')
+def handle_analyze():
+    # A hint for the current board, sent only to the player who asked
+    game, player_id = authenticate(session)
+    if not game:
+        print('Invalid connection. Disconnecting!')
+        return disconnect()
+
+    if game["variant"] != STANDARD_VARIANT:
+        data = dict(message="Hints are only available on the standard board.")
+        emit("alert", json.dumps(data))
+        return
+
+    try:
+        analysis = position_analyzer.analyze(Board.from_trusted(game["grid"]))
+    except QueueFullError:
+        data = dict(message="The server is too busy for hints right now. Please try again in a moment.")
+        emit("alert", json.dumps(data))
+        return
+    except JobError:
+        data = dict(message="No hint could be found in time. Please try again.")
+        emit("alert", json.dumps(data))
+        return
+
+    emit('analysis', json_analysis(analysis, game["seq"]))
+
+
+@socketio.on('sync')
+@socket_event_seconds.timed('sync')
+def handle_sync():
+    # The client missed a move, so it gets a fresh snapshot
+    game, player_id = authenticate(session)
+    if not game:
+        print('Invalid connection. Disconnecting!')
+        return disconnect()
+
+    json_data = json_game_state(game)
+    emit('game_state', json_data)
 
 
 @socketio.on('restart')
+@socket_event_seconds.timed('restart')
 def handle_restart():
     game, player_id = authenticate(session)
     if not game:
         print('Invalid connection. Disconnecting!')
         return disconnect()
 
-    game_id = game["game_id"]
-    game = GameStore.restart(game_id)
+    work = unit_of_work(game["game_id"])
+    work.restart()
+    game, = work.execute()
     json_data = json_game_state(game)
-    emit('game_state', json_data, room=game_id)
+    broadcast('game_state', json_data, game["game_id"])
+
+
+@socketio.on('connect', namespace=MATCH_NAMESPACE)
+@socket_event_seconds.timed('match_connect')
+def handle_match_connect():
+    player_id = session.get('match_player_id')
+    bucket = session.get('match_bucket')
+    if not player_id or not bucket:
+        print('Invalid matchmaking connection. Disconnecting!')
+        return disconnect()
+
+    # Whichever process pairs this player up announces the match to this room
+    join_room(player_id)
+    opponent_id = Matchmaker.join(player_id, bucket)
+    if opponent_id is None:
+        print("Player waiting for an opponent in bucket %s" % bucket)
+        return
+
+    # The player who waited moves first
+    game_id = create_match_game(opponent_id, player_id, VARIANTS[session['match_variant']])
+    print("Matched two players in bucket %s for game %s" % (bucket, game_id))
+    socketio.emit('match_found', json_match_found(game_id, opponent_id), room=opponent_id, namespace=MATCH_NAMESPACE)
+    emit('match_found', json_match_found(game_id, player_id))
+
+
+@socketio.on('disconnect', namespace=MATCH_NAMESPACE)
+@socket_event_seconds.timed('match_disconnect')
+def handle_match_disconnect():
+    player_id = session.get('match_player_id')
+    if player_id:
+        Matchmaker.leave(player_id)
+
+
+@socketio.on('connect', namespace=WATCH_NAMESPACE)
+@socket_event_seconds.timed('watch_connect')
+def handle_watch_connect():
+    game_id = request.args.get('game_id')
+    json_data = game_states.current(game_id)
+    if json_data is None:
+        print('Invalid spectator connection. Disconnecting!')
+        return disconnect()
+
+    watched_games[request.sid] = game_id
+    join_room(game_id)
+    emit('game_state', json_data)
+
+
+@socketio.on('sync', namespace=WATCH_NAMESPACE)
+@socket_event_seconds.timed('watch_sync')
+def handle_watch_sync():
+    # Spectators who missed a move get the state every other spectator of this process is served
+    json_data = game_states.current(watched_games.get(request.sid))
+    if json_data is not None:
+        emit('game_state', json_data)
+
+
+@socketio.on('disconnect', namespace=WATCH_NAMESPACE)
+@socket_event_seconds.timed('watch_disconnect')
+def handle_watch_disconnect():
+    watched_games.pop(request.sid, None)
 
 
 @socketio.on('disconnect')
+@socket_event_seconds.timed('disconnect')
 def handle_disconnect():
+    if is_spectator():
+        return
+
+    connected_games.pop(request.sid, None)
     game, player_id = authenticate(session)
+    if not game:
+        return
+
     game_id = game["game_id"]
-    players = game["player_positions"]
+    position = game["player_positions"][player_id]
+    work = unit_of_work(game_id)
+    work.disconnect_player(player_id)
+    connections, = work.execute(reload=True)
+    if connections:
+        print("Player %d closed a window for game %s. %d windows left." % (position, game_id, connections))
+    else:
+        leave_room(room=game_id)
+        print("Player %s left game %s" % (position, game_id))
+        # Nobody is left to see the AI's reply; it's searched again when the player reconnects
+        job_dispatcher.cancel(game_id)
 
-    if game and player_id in players:
-        connections = GameStore.get_open_connections(game_id, player_id)
-        position = game["player_positions"][player_id]
-        if connections > 1:
-            connections = GameStore.remove_player_connection(game_id, player_id)
-            print("Player %d closed a window for game %s. %d windows left." % (position, game_id, connections)
-            )
-        else:
-            GameStore.remove_player(game_id, player_id)
-            leave_room(room=game_id)
-            print("Player %s left game %s" % (position, game_id))
-
-        emit('game_state', json.dumps(game), room=game_id)
+    if work.game:
+        json_data = json_game_state(work.game)
+        broadcast('game_state', json_data, game_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+import json
+import os
+import unittest
+from urlparse import urlparse
+
+import redis
+from flask_socketio.test_client import SocketIOTestClient
+from socketio import packet
+from werkzeug.test import EnvironBuilder
+
+# Importing the app starts its background threads; these tests don't need the sweeper's
+os.environ.setdefault('RUN_SWEEPER', '0')
+
+from app import (
+    WATCH_NAMESPACE,
+    app,
+    socketio,
+)
+from game_store import (
+    GameStore,
+    game_key,
+    move_log_key,
+    new_game_used_key,
+    redis_client,
+    snapshots_key,
+)
+
+
+class _SocketClient(SocketIOTestClient):
+    # Flask-SocketIO's test client handshakes with an empty request; browsers send their session cookie, and
+    # spectators the id of the game they watch
+    def __init__(self, cookie=None, query_string=None, namespace=None):
+        self.cookie = cookie
+        self.query_string = query_string
+        self.namespace = namespace
+        super(_SocketClient, self).__init__(app, socketio, namespace=namespace)
+
+    def connect(self, namespace=None):
+        self.queue.setdefault(self.sid, [])
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        environ = EnvironBuilder('/socket.io', query_string=self.query_string, headers=headers).get_environ()
+        environ['flask.app'] = self.app
+        self.socketio.server._handle_eio_connect(self.sid, environ)
+        if namespace is not None and namespace != '/':
+            with self.app.app_context():
+                self.socketio.server._handle_eio_message(
+                    self.sid, packet.Packet(packet.CONNECT, namespace=namespace).encode(),
+                )
+
+    def received(self, name, namespace=None):
+        return [json.loads(event["args"][0]) for event in self.get_received(namespace) if event["name"] == name]
+
+
+def _load_page(http, path):
+    # Returns the session cookie the page set
+    response = http.get(path)
+    assert response.status_code == 200, response.status
+    return response.headers["Set-Cookie"].split(';')[0]
+
+
+class SpectatorTests(unittest.TestCase):
+    # These tests need the Redis server from `REDIS_CONNECTION_SETTINGS`
+    def setUp(self):
+        try:
+            redis_client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis isn't running")
+
+        http = app.test_client()
+        new_game_url = urlparse(http.get('/').headers["Location"])
+        self.game_id = new_game_url.path.strip('/')
+        self.clients = []
+        self.player_one = self.connect(cookie=_load_page(http, '%s?%s' % (new_game_url.path, new_game_url.query)))
+        self.player_two = self.connect(cookie=_load_page(app.test_client(), '/' + self.game_id))
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect(client.namespace)
+        redis_client.delete(
+            game_key(self.game_id), move_log_key(self.game_id), snapshots_key(self.game_id),
+            new_game_used_key(self.game_id),
+        )
+
+    def connect(self, cookie=None, query_string=None, namespace=None):
+        client = _SocketClient(cookie=cookie, query_string=query_string, namespace=namespace)
+        self.clients.append(client)
+        return client
+
+    def watch(self):
+        return self.connect(query_string='game_id=' + self.game_id, namespace=WATCH_NAMESPACE)
+
+    def test_watch_connect(self):
+        revision = GameStore.get(self.game_id)["revision"]
+        spectator = self.watch()
+
+        state, = spectator.received('game_state', WATCH_NAMESPACE)
+        self.assertEqual(state["player_count"], 2)
+        self.assertEqual(state["seq"], 0)
+        # Spectators don't count as players' connections or change anything else
+        self.assertEqual(spectator.get_received(), [])
+        self.assertEqual(GameStore.get(self.game_id)["revision"], revision)
+
+        self.assertEqual(app.test_client().get('/%s/watch' % self.game_id).status_code, 200)
+        self.assertEqual(app.test_client().get('/no-such-game/watch').status_code, 404)
+
+    def test_spectator_gets_moves(self):
+        spectator = self.watch()
+        spectator.get_received(WATCH_NAMESPACE)
+
+        self.player_one.emit('drop_disc', json.dumps(dict(column_index=3)))
+        move, = spectator.received('move', WATCH_NAMESPACE)
+        self.assertEqual((move["row"], move["col"], move["disc"], move["seq"]), (5, 3, 1, 1))
+        self.assertEqual(self.player_two.received('move')[-1], move)
+
+        # The state spectators resync to is the one after the move
+        spectator.emit('sync', namespace=WATCH_NAMESPACE)
+        state, = spectator.received('game_state', WATCH_NAMESPACE)
+        self.assertEqual(state["grid"][5][3], 1)
+        self.assertEqual(state["seq"], 1)
+
+    def test_spectators_cannot_play(self):
+        spectator = self.watch()
+        spectator.get_received(WATCH_NAMESPACE)
+        game = GameStore.get(self.game_id)
+
+        for namespace in (WATCH_NAMESPACE, None):
+            spectator.emit('drop_disc', json.dumps(dict(column_index=3)), namespace=namespace)
+            spectator.emit('restart', namespace=namespace)
+
+        self.assertEqual(GameStore.get(self.game_id)["revision"], game["revision"])
+        self.assertEqual(spectator.received('move', WATCH_NAMESPACE), [])
+        self.assertEqual(self.player_one.received('move'), [])
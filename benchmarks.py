@@ -0,0 +1,447 @@
+"""Microbenchmarks for `board_model` and `game_store`.
+
+Every run plays the same seeded random games to build its position corpora, so results from different runs (and
+different commits) measure the same work:
+
+    empty      the empty board
+    midgame    boards with 14 to 24 discs and no winner
+    near_full  boards with 36 to 41 discs and no winner
+    winning    boards whose last disc just won the game
+
+Board operations run on every corpus. `GameStore` methods run against the Redis server from
+`REDIS_CONNECTION_SETTINGS` and are skipped when it isn't running. Run the suite, save the results and compare a
+later run against them:
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --compare before.json
+
+A comparison exits with status 1 if any benchmark got slower than `--threshold` allows.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+
+from board_model import (
+    Board,
+    DiscType,
+)
+
+
+CORPORA = ('empty', 'midgame', 'near_full', 'winning')
+
+# Disc count ranges for the corpora that are built by random play
+_DISC_COUNT_RANGES = {
+    'empty': (0, 0),
+    'midgame': (14, 24),
+    'near_full': (36, 41),
+}
+
+DEFAULT_SEED = 42
+DEFAULT_POSITIONS = 500
+
+# Fast operations are timed this many calls at a time, so the timer's own overhead doesn't swamp them
+BOARD_BATCH_SIZE = 50
+
+# Every benchmark runs this many rounds and reports the fastest one, which is the least disturbed by whatever else
+# the machine was doing
+DEFAULT_ROUNDS = 3
+
+# Slowdown, as a fraction of the baseline time per operation, that counts as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+PERCENTILES = (50, 90, 99)
+
+
+### Corpora ###
+
+class Position(object):
+    """A corpus entry: a board, the columns played to reach it, its last move and the disc type to play next."""
+
+    def __init__(self, grid, columns, last_move, disc_type):
+        self.grid = grid
+        self.columns = columns
+        self.last_move = last_move
+        self.disc_type = disc_type
+
+    def board(self):
+        return Board(self.grid)
+
+    def open_column(self):
+        """First column that still has room, or None if the board is full."""
+        for column_index in xrange(Board.WIDTH):
+            if self.grid[0][column_index] == DiscType.NONE.value:
+                return column_index
+
+        return None
+
+
+def _random_game(rng, disc_count=None):
+    """Play random moves.
+
+    Args:
+        rng (Random): source of the moves
+        disc_count (int): stop after this many discs, avoiding winning moves on the way. By default the game is
+            played until it ends.
+
+    Returns:
+        `Position` and the winner, which is 0 if nobody won. The position has fewer discs than asked for if every
+        move would have won.
+    """
+    board = Board()
+    disc_type = DiscType.PLAYER_1
+    columns = []
+    last_move = None
+    winner = 0
+    while len(columns) != disc_count and not winner and not board.is_full():
+        open_columns = [column_index for column_index in xrange(Board.WIDTH) if board.grid[0][column_index] == 0]
+        rng.shuffle(open_columns)
+        for column_index in open_columns:
+            candidate = Board.from_bitboards(*board.bitboards)
+            move = candidate.drop_disc(column_index, disc_type)
+            move_winner = candidate.is_winning_disc(*move)
+            if disc_count is None or not move_winner:
+                break
+        else:
+            break
+
+        board, last_move, winner = candidate, move, move_winner
+        columns.append(column_index)
+        disc_type = DiscType.PLAYER_2 if disc_type == DiscType.PLAYER_1 else DiscType.PLAYER_1
+
+    return Position(board.grid, columns, last_move, disc_type), winner
+
+
+def build_corpus(name, count, seed=DEFAULT_SEED):
+    """Build a reproducible list of `count` positions.
+
+    Args:
+        name (str): one of `CORPORA`
+        count (int): number of positions
+        seed (int): random seed; the same seed always gives the same positions
+
+    Returns:
+        list of `Position`
+    """
+    rng = random.Random('%s-%d' % (name, seed))
+    positions = []
+    while len(positions) < count:
+        if name == 'winning':
+            position, winner = _random_game(rng)
+            if not winner:
+                continue
+        else:
+            low, high = _DISC_COUNT_RANGES[name]
+            target = rng.randint(low, high)
+            position, winner = _random_game(rng, disc_count=target)
+            if len(position.columns) != target:
+                # Every move would have won before reaching the target; try another game
+                continue
+
+        positions.append(position)
+
+    return positions
+
+
+def corpus_fingerprint(positions):
+    """Short hash of a corpus, saved with the results so comparisons can tell they measured the same positions."""
+    digest = hashlib.sha1()
+    for position in positions:
+        digest.update(json.dumps(position.grid))
+
+    return digest.hexdigest()[:12]
+
+
+### Measurement ###
+
+def percentile(sorted_samples, percent):
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    index = max(0, int(round(percent / 100.0 * len(sorted_samples))) - 1)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+
+def measure(operation, inputs, batch_size=1, rounds=1):
+    """Time `operation` on every input.
+
+    Args:
+        operation (function): called with one input at a time
+        inputs (list, or function returning a list): inputs to call it with. Pass a function to get fresh inputs for
+            every round, e.g. when the operation changes them.
+        batch_size (int): number of calls to time together. Each batch counts as `batch_size` samples of its
+            average time.
+        rounds (int): time every input this many times and report the fastest round
+
+    Returns:
+        dict with the number of operations, ops/sec and the mean, percentile and max time per operation in
+        microseconds
+    """
+    best = None
+    for _ in xrange(rounds):
+        samples, total = _time_round(operation, inputs() if callable(inputs) else inputs, batch_size)
+        if best is None or total < best[1]:
+            best = samples, total
+
+    samples, total = best
+    samples.sort()
+    result = dict(
+        ops=len(samples),
+        ops_per_sec=len(samples) / total if total else float('inf'),
+        mean_us=total / len(samples) * 1e6,
+        max_us=samples[-1] * 1e6,
+    )
+    for percent in PERCENTILES:
+        result['p%d_us' % percent] = percentile(samples, percent) * 1e6
+
+    return result
+
+
+def _time_round(operation, inputs, batch_size):
+    samples = []
+    total = 0.0
+    timer = timeit.default_timer
+    # Like timeit, keep garbage collection pauses out of the measurements
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for start_index in xrange(0, len(inputs), batch_size):
+            batch = inputs[start_index:start_index + batch_size]
+            start = timer()
+            for value in batch:
+                operation(value)
+            elapsed = timer() - start
+            total += elapsed
+            samples.extend([elapsed / len(batch)] * len(batch))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return samples, total
+
+
+### Benchmarks ###
+
+def board_benchmarks(corpora, rounds=DEFAULT_ROUNDS):
+    """Benchmark `Board` operations on every corpus.
+
+    Args:
+        corpora (dict): corpus name to list of `Position`
+        rounds (int): rounds per benchmark
+
+    Returns:
+        list of result dicts
+    """
+    results = []
+    for corpus_name in CORPORA:
+        positions = corpora[corpus_name]
+        boards = [position.board() for position in positions]
+
+        def droppable():
+            # Dropping changes the boards, so every round gets new copies
+            return [
+                (Board.from_bitboards(*board.bitboards), position.open_column(), position.disc_type)
+                for board, position in zip(boards, positions) if position.open_column() is not None
+            ]
+        with_moves = [(board, position.last_move) for board, position in zip(boards, positions) if position.last_move]
+
+        operations = [
+            ('Board(grid)', lambda grid: Board(grid), [position.grid for position in positions]),
+            ('Board.from_trusted', lambda grid: Board.from_trusted(grid), [position.grid for position in positions]),
+            ('Board.grid', lambda board: board.grid, boards),
+            ('Board.bitboards', lambda board: board.bitboards, boards),
+            ('Board.from_bitboards', lambda bitboards: Board.from_bitboards(*bitboards),
+             [board.bitboards for board in boards]),
+            ('Board.drop_disc', lambda args: args[0].drop_disc(args[1], args[2]), droppable),
+            ('Board.is_winning_disc', lambda args: args[0].is_winning_disc(*args[1]), with_moves),
+            ('Board.is_full', lambda board: board.is_full(), boards),
+        ]
+        for name, operation, inputs in operations:
+            if not (inputs() if callable(inputs) else inputs):
+                continue
+
+            result = measure(operation, inputs, batch_size=BOARD_BATCH_SIZE, rounds=rounds)
+            result.update(name=name, corpus=corpus_name)
+            results.append(result)
+
+    return results
+
+
+def store_benchmarks(corpora, count):
+    """Benchmark `GameStore` methods against Redis.
+
+    Every benchmark game is deleted afterwards.
+
+    Args:
+        corpora (dict): corpus name to list of `Position`
+        count (int): number of games to run each method on
+
+    Returns:
+        list of result dicts, or None if Redis isn't running
+    """
+    import redis
+    from game_store import (
+        GameStore,
+        game_keys,
+        redis_client,
+    )
+
+    try:
+        redis_client.ping()
+    except redis.ConnectionError:
+        return None
+
+    game_ids = []
+
+    def create(_):
+        game_ids.append(GameStore.create())
+
+    results = []
+
+    def run(name, operation, inputs, corpus=None):
+        result = measure(operation, inputs)
+        result.update(name=name, corpus=corpus)
+        results.append(result)
+
+    try:
+        run('GameStore.create', create, range(count))
+        run('GameStore.get', GameStore.get, game_ids)
+        run('GameStore.add_player', lambda game_id: GameStore.add_player(game_id, 'player-one'), game_ids)
+        run('GameStore.add_player_connection',
+            lambda game_id: GameStore.add_player_connection(game_id, 'player-one'), game_ids)
+        run('GameStore.remove_player_connection',
+            lambda game_id: GameStore.remove_player_connection(game_id, 'player-one'), game_ids)
+        for game_id in game_ids:
+            GameStore.add_player(game_id, 'player-two')
+
+        # Play each midgame position's moves into a game, one `play_turn` per disc
+        moves = []
+        for game_id, position in zip(game_ids, corpora['midgame']):
+            for index, column_index in enumerate(position.columns):
+                moves.append((game_id, 'player-one' if index % 2 == 0 else 'player-two', column_index))
+        run('GameStore.play_turn', lambda move: GameStore.play_turn(*move), moves, corpus='midgame')
+        run('GameStore.replay', GameStore.replay, game_ids, corpus='midgame')
+        run('GameStore.disconnect_player', lambda game_id: GameStore.disconnect_player(game_id, 'player-two'),
+            game_ids)
+    finally:
+        for game_id in game_ids:
+            redis_client.delete(*game_keys(game_id))
+
+    return results
+
+
+def run_benchmarks(suites=('board', 'store'), seed=DEFAULT_SEED, positions=DEFAULT_POSITIONS, rounds=DEFAULT_ROUNDS):
+    """Run the benchmark suites.
+
+    Returns:
+        dict with the run's metadata under "meta" and the result dicts under "results"
+    """
+    corpora = dict((name, build_corpus(name, positions, seed=seed)) for name in CORPORA)
+    results = []
+    skipped = []
+    if 'board' in suites:
+        results.extend(board_benchmarks(corpora, rounds=rounds))
+    if 'store' in suites:
+        store_results = store_benchmarks(corpora, min(positions, 200))
+        if store_results is None:
+            skipped.append('store')
+        else:
+            results.extend(store_results)
+
+    return dict(
+        meta=dict(
+            timestamp=time.time(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            seed=seed,
+            positions=positions,
+            rounds=rounds,
+            corpora=dict((name, corpus_fingerprint(corpus)) for name, corpus in corpora.iteritems()),
+            skipped=skipped,
+        ),
+        results=results,
+    )
+
+
+def compare(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Compare two runs benchmark by benchmark.
+
+    Returns:
+        list of (name, corpus, baseline mean, current mean, change) tuples, where change is the fractional change in
+        time per operation, and the list of those that regressed by more than `threshold`
+    """
+    baseline_results = dict(((result["name"], result["corpus"]), result) for result in baseline["results"])
+    rows = []
+    regressions = []
+    for result in current["results"]:
+        key = (result["name"], result["corpus"])
+        if key not in baseline_results:
+            continue
+
+        baseline_mean = baseline_results[key]["mean_us"]
+        change = result["mean_us"] / baseline_mean - 1 if baseline_mean else 0.0
+        row = (result["name"], result["corpus"], baseline_mean, result["mean_us"], change)
+        rows.append(row)
+        if change > threshold:
+            regressions.append(row)
+
+    return rows, regressions
+
+
+def _format_results(results):
+    lines = ['%-36s %-10s %12s %10s %10s %10s %10s' % ('benchmark', 'corpus', 'ops/sec', 'mean us', 'p50 us',
+                                                      'p90 us', 'p99 us')]
+    for result in results:
+        lines.append('%-36s %-10s %12.0f %10.2f %10.2f %10.2f %10.2f' % (
+            result["name"], result["corpus"] or '-', result["ops_per_sec"], result["mean_us"], result["p50_us"],
+            result["p90_us"], result["p99_us"],
+        ))
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the board model and game store.")
+    parser.add_argument('--suite', choices=('all', 'board', 'store'), default='all', help="benchmarks to run")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="seed for the position corpora")
+    parser.add_argument('--positions', type=int, default=DEFAULT_POSITIONS, help="positions per corpus")
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help="rounds per board benchmark")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare against results saved with --output")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="slowdown that counts as a regression, as a fraction (default 0.10)")
+    args = parser.parse_args(argv)
+
+    suites = ('board', 'store') if args.suite == 'all' else (args.suite,)
+    run = run_benchmarks(suites, seed=args.seed, positions=args.positions, rounds=args.rounds)
+    print(_format_results(run["results"]))
+    for suite in run["meta"]["skipped"]:
+        sys.stderr.write("Skipped the %s benchmarks: Redis isn't running\n" % suite)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(run, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["meta"]["corpora"] != run["meta"]["corpora"]:
+            sys.stderr.write("Warning: the baseline was measured on different positions\n")
+
+        rows, regressions = compare(baseline, run, threshold=args.threshold)
+        print('')
+        for name, corpus, baseline_mean, mean, change in rows:
+            flag = '  REGRESSION' if (name, corpus, baseline_mean, mean, change) in regressions else ''
+            print('%-36s %-10s %10.2f -> %10.2f us %+7.1f%%%s' % (
+                name, corpus or '-', baseline_mean, mean, change * 100, flag))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
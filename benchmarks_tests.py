@@ -0,0 +1,56 @@
+import unittest
+
+from benchmarks import (
+    CORPORA,
+    build_corpus,
+    compare,
+    corpus_fingerprint,
+    measure,
+)
+from board_model import Board
+
+
+class BenchmarksTests(unittest.TestCase):
+    def test_corpora(self):
+        for name in CORPORA:
+            corpus = build_corpus(name, 20, seed=7)
+            self.assertEqual(len(corpus), 20)
+            # The same seed gives the same positions
+            self.assertEqual(corpus_fingerprint(corpus), corpus_fingerprint(build_corpus(name, 20, seed=7)))
+
+            for position in corpus:
+                disc_count = sum(1 for row in position.grid for value in row if value)
+                self.assertEqual(disc_count, len(position.columns))
+                board = position.board()
+                winner = board.is_winning_disc(*position.last_move) if position.last_move else 0
+                if name == 'winning':
+                    self.assertTrue(winner)
+                else:
+                    self.assertFalse(winner)
+                if name == 'empty':
+                    self.assertEqual(disc_count, 0)
+                elif name == 'near_full':
+                    self.assertGreaterEqual(disc_count, 36)
+
+        self.assertNotEqual(
+            corpus_fingerprint(build_corpus('midgame', 20, seed=7)),
+            corpus_fingerprint(build_corpus('midgame', 20, seed=8)),
+        )
+
+    def test_measure(self):
+        result = measure(lambda grid: Board(grid), [Board().grid] * 10, batch_size=4, rounds=2)
+        self.assertEqual(result["ops"], 10)
+        self.assertGreater(result["ops_per_sec"], 0)
+        self.assertLessEqual(result["p50_us"], result["p99_us"])
+        self.assertLessEqual(result["p99_us"], result["max_us"])
+
+    def test_compare(self):
+        def run(*means):
+            return dict(results=[
+                dict(name=name, corpus='empty', mean_us=mean) for name, mean in zip(('a', 'b', 'c'), means)
+            ])
+
+        rows, regressions = compare(run(1.0, 2.0), run(1.05, 3.0, 1.0), threshold=0.1)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([row[0] for row in regressions], ['b'])
+        self.assertAlmostEqual(regressions[0][4], 0.5)
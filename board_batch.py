@@ -0,0 +1,127 @@
+import numpy as np
+
+from board_model import (
+    Board,
+    DiscType,
+    InvalidGridError,
+)
+
+
+class BoardBatch(object):
+    """A batch of boards stored as one (N, HEIGHT, WIDTH) int8 array.
+
+    Every operation works on all boards at once with NumPy array operations, so checking hundreds of thousands of
+    grids costs a handful of vectorized passes instead of a Python loop over `Board` instances. Grids use the same
+    layout as `Board.grid`: row 0 is the top row and 0/1/2 are the `DiscType` values.
+    """
+    WIDTH = Board.WIDTH
+    HEIGHT = Board.HEIGHT
+
+    def __init__(self, grids, validate=True):
+        """Create a batch from a stack of grids.
+
+        Args:
+            grids (array-like): (N, HEIGHT, WIDTH) disc values
+            validate (bool): check the disc values and that no column has gaps. Skip this for grids we produced.
+        """
+        self.grids = np.array(grids, dtype=np.int8)
+        if validate:
+            self._validate_grids()
+
+    @classmethod
+    def empty(cls, count):
+        """Create a batch of `count` empty boards."""
+        return cls(np.zeros((count, cls.HEIGHT, cls.WIDTH), dtype=np.int8), validate=False)
+
+    @classmethod
+    def from_boards(cls, boards):
+        """Create a batch from `Board` instances."""
+        return cls([board.grid for board in boards], validate=False)
+
+    def __len__(self):
+        return len(self.grids)
+
+    def board(self, index):
+        """Get one board of the batch as a `Board`."""
+        return Board(self.grids[index].tolist())
+
+    def heights(self):
+        """Number of discs in each column, as an (N, WIDTH) array."""
+        return np.count_nonzero(self.grids, axis=1)
+
+    def drop_disc(self, column_indices, disc_types):
+        """Drop one disc in every board of the batch.
+
+        Args:
+            column_indices (array-like): (N,) column index to play in each board
+            disc_types (array-like): (N,) disc values to drop, or a single `DiscType`/value for every board
+
+        Returns:
+            An (N,) array with the row index each disc landed in. Boards whose column was already full are left
+            unchanged and get -1.
+        """
+        column_indices = np.asarray(column_indices, dtype=np.intp)
+        if isinstance(disc_types, DiscType):
+            disc_types = disc_types.value
+        disc_types = np.broadcast_to(np.asarray(disc_types, dtype=np.int8), column_indices.shape)
+        assert column_indices.shape == (len(self),), "Expected one column index per board"
+        assert ((column_indices > -1) & (column_indices < self.WIDTH)).all(), "Column indices must be between 0 and 6"
+        assert np.isin(disc_types, [DiscType.PLAYER_1.value, DiscType.PLAYER_2.value]).all(), \
+            "Only player disc types can be dropped"
+
+        board_indices = np.arange(len(self))
+        row_indices = self.HEIGHT - 1 - self.heights()[board_indices, column_indices]
+        playable = row_indices > -1
+        self.grids[board_indices[playable], row_indices[playable], column_indices[playable]] = disc_types[playable]
+
+        return row_indices
+
+    def winner(self):
+        """Find the winner of every board.
+
+        Returns:
+            An (N,) array with the position of the player who has four in a row, or 0 if nobody does
+        """
+        winners = np.zeros(len(self), dtype=np.int8)
+        for disc_type in (DiscType.PLAYER_2, DiscType.PLAYER_1):
+            discs = self.grids == disc_type.value
+            # Compare every slot with its three neighbours along each direction by slicing shifted views of the grid
+            horizontal = discs[:, :, :-3] & discs[:, :, 1:-2] & discs[:, :, 2:-1] & discs[:, :, 3:]
+            vertical = discs[:, :-3, :] & discs[:, 1:-2, :] & discs[:, 2:-1, :] & discs[:, 3:, :]
+            diagonal = discs[:, :-3, :-3] & discs[:, 1:-2, 1:-2] & discs[:, 2:-1, 2:-1] & discs[:, 3:, 3:]
+            anti_diagonal = discs[:, 3:, :-3] & discs[:, 2:-1, 1:-2] & discs[:, 1:-2, 2:-1] & discs[:, :-3, 3:]
+            has_won = (
+                horizontal.any(axis=(1, 2)) |
+                vertical.any(axis=(1, 2)) |
+                diagonal.any(axis=(1, 2)) |
+                anti_diagonal.any(axis=(1, 2))
+            )
+            winners[has_won] = disc_type.value
+
+        return winners
+
+    def is_full(self):
+        """Check which boards are full.
+
+        Returns:
+            An (N,) boolean array
+        """
+        # Columns fill from the bottom, so a board is full when its top row is
+        return (self.grids[:, 0, :] != DiscType.NONE.value).all(axis=1)
+
+    def _validate_grids(self):
+        if self.grids.ndim != 3 or self.grids.shape[1:] != (self.HEIGHT, self.WIDTH):
+            raise InvalidGridError("Grids must have shape (N, %d, %d)" % (self.HEIGHT, self.WIDTH))
+
+        if not np.isin(self.grids, [disc_type.value for disc_type in DiscType]).all():
+            raise InvalidGridError("Grids contain invalid disc values")
+
+        # A gap is an empty slot directly below a disc
+        occupied = self.grids != DiscType.NONE.value
+        if (occupied[:, :-1, :] & ~occupied[:, 1:, :]).any():
+            raise InvalidGridError("Gap found in a grid column")
+
+        disc_count_difference = (self.grids == DiscType.PLAYER_1.value).sum(axis=(1, 2)) - \
+            (self.grids == DiscType.PLAYER_2.value).sum(axis=(1, 2))
+        if (np.abs(disc_count_difference) > 1).any():
+            raise InvalidGridError("Player 1 and Player 2 disc counts vary by more than 1")
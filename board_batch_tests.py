@@ -0,0 +1,106 @@
+import random
+import unittest
+
+import numpy as np
+
+from board_batch import BoardBatch
+from board_model import (
+    Board,
+    DiscType,
+    GridColumnFullError,
+    InvalidGridError,
+)
+
+
+def random_boards(count, seed):
+    """Play random games and keep a snapshot after a random number of moves."""
+    rng = random.Random(seed)
+    boards = []
+    for _ in xrange(count):
+        board = Board()
+        disc_type = DiscType.PLAYER_1
+        for _ in xrange(rng.randint(0, Board.WIDTH * Board.HEIGHT)):
+            columns = [column_index for column_index in xrange(Board.WIDTH) if board.grid[0][column_index] == 0]
+            if not columns:
+                break
+            row_index, column_index = board.drop_disc(rng.choice(columns), disc_type)
+            if board.is_winning_disc(row_index, column_index):
+                break
+            disc_type = DiscType.PLAYER_2 if disc_type == DiscType.PLAYER_1 else DiscType.PLAYER_1
+        boards.append(board)
+
+    return boards
+
+
+class BoardBatchTests(unittest.TestCase):
+    def test_matches_board(self):
+        boards = random_boards(300, seed=7)
+        batch = BoardBatch.from_boards(boards)
+        winners = batch.winner()
+        is_full = batch.is_full()
+
+        for index, board in enumerate(boards):
+            expected_winner = 0
+            grid = board.grid
+            for row_index in xrange(Board.HEIGHT):
+                for column_index in xrange(Board.WIDTH):
+                    expected_winner = board.is_winning_disc(row_index, column_index) or expected_winner
+            self.assertEqual(winners[index], expected_winner, grid)
+            self.assertEqual(is_full[index], board.is_full())
+            self.assertEqual(batch.board(index).grid, grid)
+
+    def test_drop_disc(self):
+        boards = random_boards(200, seed=11)
+        batch = BoardBatch.from_boards(boards)
+        rng = random.Random(3)
+        column_indices = [rng.randrange(Board.WIDTH) for _ in boards]
+        disc_types = [rng.choice([1, 2]) for _ in boards]
+
+        row_indices = batch.drop_disc(column_indices, disc_types)
+        for index, board in enumerate(boards):
+            try:
+                expected_row_index, _ = board.drop_disc(column_indices[index], DiscType(disc_types[index]))
+            except GridColumnFullError:
+                expected_row_index = -1
+            self.assertEqual(row_indices[index], expected_row_index)
+            self.assertEqual(batch.grids[index].tolist(), board.grid)
+
+        # A single disc type for every board
+        batch = BoardBatch.empty(3)
+        self.assertEqual(batch.drop_disc([0, 3, 3], DiscType.PLAYER_2).tolist(), [5, 5, 5])
+        self.assertEqual(batch.heights()[:, 3].tolist(), [0, 1, 1])
+
+        # Invalid column indices and disc types
+        with self.assertRaises(AssertionError):
+            batch.drop_disc([0, 7, 1], DiscType.PLAYER_1)
+        with self.assertRaises(AssertionError):
+            batch.drop_disc([0, 1, 1], 0)
+
+    def test_validation(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 2, 1, 0, 0, 0, 0],
+        ]
+        self.assertEqual(len(BoardBatch([grid, grid])), 2)
+
+        with self.assertRaises(InvalidGridError):
+            BoardBatch(np.zeros((2, 7, 6)))
+
+        bad_value = [list(row) for row in grid]
+        bad_value[5][0] = 3
+        with self.assertRaises(InvalidGridError):
+            BoardBatch([grid, bad_value])
+
+        gap = [list(row) for row in grid]
+        gap[3][1] = 1
+        with self.assertRaises(InvalidGridError):
+            BoardBatch([gap])
+
+        uneven = [list(row) for row in grid]
+        uneven[5][5] = uneven[5][6] = 1
+        with self.assertRaises(InvalidGridError):
+            BoardBatch([uneven])
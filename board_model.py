@@ -1,3 +1,6 @@
+import random
+from collections import namedtuple
+
 from enum import Enum
 
 
@@ -26,30 +29,215 @@ PLAYABLE_DISK_TYPES = frozenset([
 ])
 
 
+# Seeds the Zobrist keys, so position hashes are the same in every process and on every run
+ZOBRIST_SEED = 0x6334
+
+
+class BoardVariant(namedtuple('BoardVariant', ['width', 'height', 'connect'])):
+    """Board dimensions and the number of discs in a row that wins."""
+    __slots__ = ()
+
+
+class _Geometry(object):
+    """Bit layout, win lines and Zobrist keys of one board variant.
+
+    Built once and shared by every board of that variant.
+    """
+
+    # Steps between neighbouring slots of a line, as (columns, rows up): vertical, horizontal and both diagonals
+    _DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+    _geometries = {}
+
+    def __init__(self, width, height, connect):
+        assert width > 0 and height > 0, "Board dimensions must be positive. Got: %dx%d" % (width, height)
+        assert 1 < connect <= max(width, height), "Can't connect %d on a %dx%d board" % (connect, width, height)
+
+        self.variant = BoardVariant(width, height, connect)
+        self.width = width
+        self.height = height
+        self.connect = connect
+        self.column_bits = height + 1
+        self.slot_count = width * height
+
+        # Every line of `connect` slots as a bitmask, listed under each slot it passes through. However large the
+        # board, a win check only tests the few lines through the last disc.
+        lines_through = [[] for _ in xrange(width * self.column_bits)]
+        for column_index in xrange(width):
+            for row in xrange(height):
+                for column_step, row_step in self._DIRECTIONS:
+                    slots = [
+                        (column_index + step * column_step, row + step * row_step) for step in xrange(connect)
+                    ]
+                    if not all(0 <= slot_column < width and 0 <= slot_row < height for slot_column, slot_row in slots):
+                        continue
+
+                    bits = [slot_column * self.column_bits + slot_row for slot_column, slot_row in slots]
+                    line = sum(1 << bit for bit in bits)
+                    for bit in bits:
+                        lines_through[bit].append(line)
+
+        self.lines_through = [tuple(lines) for lines in lines_through]
+
+        # A random 64-bit key per player and slot; a position's hash is the XOR of the keys of its discs. The mirror
+        # keys are the keys of the slot in the mirrored column, so a board can keep its mirror image's hash too.
+        generator = random.Random(ZOBRIST_SEED + width * 1000 + height)
+        self.zobrist_keys = tuple(
+            tuple(generator.getrandbits(64) for _ in xrange(width * self.column_bits))
+            for _ in (DiscType.PLAYER_1, DiscType.PLAYER_2)
+        )
+        self.mirror_zobrist_keys = tuple(
+            tuple(
+                keys[(width - 1 - bit // self.column_bits) * self.column_bits + bit % self.column_bits]
+                for bit in xrange(width * self.column_bits)
+            )
+            for keys in self.zobrist_keys
+        )
+
+    @classmethod
+    def get(cls, width, height, connect):
+        key = (width, height, connect)
+        geometry = cls._geometries.get(key)
+        if geometry is None:
+            geometry = cls._geometries.setdefault(key, cls(width, height, connect))
+
+        return geometry
+
+
 # TODO(nikrad): add docstrings to `Board` methods
-# TODO(nikrad): add tests for `is_winning_disc()` and `is_full()`
 
 class Board(object):
+    """Connect Four board backed by bitboards.
+
+    Each player's discs are stored as an integer bitmask. Columns are laid out bottom-up, `height + 1` bits per
+    column, with the extra bit acting as a sentinel so that shifted alignments never wrap from the top of one column
+    into the bottom of the next. For the standard 7x6 board, bit 0 is the bottom slot of column 0, bit 5 is its top
+    slot and bit 7 is the bottom slot of column 1:
+
+         5 12 19 26 33 40 47
+         4 11 18 25 32 39 46
+         3 10 17 24 31 38 45
+         2  9 16 23 30 37 44
+         1  8 15 22 29 36 43
+         0  7 14 21 28 35 42
+
+    The list-of-lists `grid` (row 0 at the top) is still accepted and produced for the game store and the client.
+
+    Every board also has a 64-bit Zobrist hash of its discs, `position_hash`, which `drop_disc()` updates in constant
+    time, and a `canonical_hash` shared with its left-right mirror image, to key caches and deduplicate positions.
+
+    Boards default to the standard game; pass `width`, `height` and `connect` for variants like connect five on a
+    9x6 board.
+    """
     WIDTH = 7
     HEIGHT = 6
+    CONNECT = 4
 
-    def __init__(self, grid=None):
+    def __init__(self, grid=None, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        self._geometry = _Geometry.get(width, height, connect)
         if grid is None:
-            self.grid = self._new_grid()
+            self._reset()
         else:
             self.grid = grid
 
+    @classmethod
+    def from_bitboards(cls, player_1_bitboard, player_2_bitboard, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        """Build a board from a pair of player bitboards (see `bitboards`).
+
+        Args:
+            player_1_bitboard (int): bitmask of player 1's discs
+            player_2_bitboard (int): bitmask of player 2's discs
+            width (int): number of columns
+            height (int): number of rows
+            connect (int): discs in a row that win
+
+        Returns:
+            A new `Board` instance
+        """
+        board = cls(None, width, height, connect)
+        board._load_bitboards(player_1_bitboard, player_2_bitboard)
+        return board
+
+    @classmethod
+    def from_trusted(cls, grid, width=WIDTH, height=HEIGHT, connect=CONNECT):
+        """Build a board from a grid that's known to be valid, skipping the checks `Board(grid)` makes.
+
+        Validating a grid costs several times more than loading it, so the game store uses this for grids it
+        produced itself. Grids from anywhere else must go through `Board(grid)`.
+
+        Args:
+            grid (list): list of rows, as produced by `grid`
+            width (int): number of columns
+            height (int): number of rows
+            connect (int): discs in a row that win
+
+        Returns:
+            A new `Board` instance
+        """
+        board = cls(None, width, height, connect)
+        board._load_grid(grid)
+        return board
+
+    @property
+    def width(self):
+        return self._geometry.width
+
+    @property
+    def height(self):
+        return self._geometry.height
+
+    @property
+    def connect(self):
+        return self._geometry.connect
+
+    @property
+    def variant(self):
+        """The board's `BoardVariant`."""
+        return self._geometry.variant
+
+    @property
+    def bitboards(self):
+        """Tuple of (player 1 bitboard, player 2 bitboard)."""
+        return tuple(self._bitboards)
+
+    @property
+    def position_hash(self):
+        """64-bit Zobrist hash of the discs on the board, the same for equal positions of the same variant."""
+        if self._hashes is None:
+            self._hashes = self._compute_hashes()
+
+        return self._hashes[0]
+
+    @property
+    def canonical_hash(self):
+        """Position hash shared by the board and its left-right mirror image: the smaller of their two hashes."""
+        if self._hashes is None:
+            self._hashes = self._compute_hashes()
+
+        return min(self._hashes)
+
     @property
     def grid(self):
-        return self._grid
+        geometry = self._geometry
+        grid = self._new_grid()
+        for row_index, row in enumerate(grid):
+            height = geometry.height - 1 - row_index
+            for column_index in xrange(geometry.width):
+                bit = 1 << (column_index * geometry.column_bits + height)
+                if self._bitboards[0] & bit:
+                    row[column_index] = DiscType.PLAYER_1.value
+                elif self._bitboards[1] & bit:
+                    row[column_index] = DiscType.PLAYER_2.value
+
+        return grid
 
     @grid.setter
     def grid(self, value):
-        if hasattr(self, '_grid'):
+        if hasattr(self, '_bitboards'):
             assert False, "Don't update the board grid directly; instead use the instance method `drop_disc()`"
         else:
             self._validate_grid(value)
-            self._grid = value
+            self._load_grid(value)
 
     def drop_disc(self, column_index, disc_type):
         """Drop a disc in a column slot.
@@ -59,24 +247,35 @@ class Board(object):
             disc_type (DiscType): disc type that should be dropped
 
         Returns:
+            The (row_index, column_index) tuple of the slot the disc landed in
 
+        Raises:
+            GridColumnFullError: if the column is already full
         """
+        geometry = self._geometry
         column_index = int(column_index)
-        assert column_index > -1, "Column index must be between 0 and 6. Got: %d" % column_index
-        assert column_index < self.WIDTH, "Column index must be between 0 and 6. Got: %d" % column_index
+        assert -1 < column_index < geometry.width, \
+            "Column index must be between 0 and %d. Got: %d" % (geometry.width - 1, column_index)
         assert disc_type in PLAYABLE_DISK_TYPES, "Only disc types in %s can be dropped" % PLAYABLE_DISK_TYPES
 
-        # Walk upward from the bottom position in the column and find the first empty spot. If we walk past top row,
-        # the column is full.
-        row_index = self.HEIGHT - 1
-        while row_index > -1:
-            if self.grid[row_index][column_index] == DiscType.NONE.value:
-                self.grid[row_index][column_index] = disc_type.value
-                return (row_index, column_index)
-
-            row_index -= 1
-
-        raise GridColumnFullError()
+        # The column height is the index of the first empty slot counting from the bottom
+        height = self._heights[column_index]
+        if height == geometry.height:
+            raise GridColumnFullError()
+
+        disc_index = column_index * geometry.column_bits + height
+        self._bitboards[disc_type.value - 1] |= 1 << disc_index
+        self._heights[column_index] = height + 1
+        self._disc_count += 1
+        # Hashes are computed on first use, then kept up to date a disc at a time
+        if self._hashes is not None:
+            position_hash, mirror_hash = self._hashes
+            self._hashes = (
+                position_hash ^ geometry.zobrist_keys[disc_type.value - 1][disc_index],
+                mirror_hash ^ geometry.mirror_zobrist_keys[disc_type.value - 1][disc_index],
+            )
+
+        return (geometry.height - 1 - height, column_index)
 
     def is_winning_disc(self, last_disc_row_index, last_disc_column_index):
         """Check if this disc leads to a victory.
@@ -89,76 +288,122 @@ class Board(object):
             If the disc leads to a victory for player in position X, it returns the player's position
             integer (i.e. X). If this disc doesn't lead to a victory, it returns None.
         """
-        def four_in_a_row(values):
-            if len(set(values)) == 1 and values[0] > 0:
-                return values[0]
-
+        geometry = self._geometry
+        disc_index = last_disc_column_index * geometry.column_bits + geometry.height - 1 - last_disc_row_index
+        disc_bit = 1 << disc_index
+        if self._bitboards[0] & disc_bit:
+            position = DiscType.PLAYER_1.value
+        elif self._bitboards[1] & disc_bit:
+            position = DiscType.PLAYER_2.value
+        else:
             return None
 
-        # TODO(nikrad): Add explanations of the win-checking logic
-
-        # Check for horizontal win
-        leftmost_win_start_index = max(0, last_disc_column_index - 3)
-        rightmost_win_start_index = min(3, last_disc_column_index)
-        for left_index in xrange(leftmost_win_start_index, rightmost_win_start_index + 1):
-            right_index = left_index + 4
-            values = self.grid[last_disc_row_index][left_index:right_index]
-            winner = four_in_a_row(values)
-            if winner:
-                return winner
-
-        # Check for vertical win if the last disc was in rows 0 - 2
-        if last_disc_row_index < 3:
-            bottom_index = last_disc_row_index + 4
-            values = [self.grid[i][last_disc_column_index] for i in xrange(last_disc_row_index, bottom_index)]
-            winner = four_in_a_row(values)
-            if winner:
-                return winner
-
-        # Check for diagonal \ win
-        if ((last_disc_column_index - last_disc_row_index) < 4 and last_disc_row_index - last_disc_column_index < 3):
-            # It's possible this disc creates a win if we check from a start position higher along the disc's diagonal
-            furthest_possible_diagonal_win = min(3, last_disc_row_index, last_disc_column_index)
-            nearest_possible_diagonal_win = max(0, last_disc_column_index - 3, last_disc_row_index - 2)
-            # Double check if we can include the last move's disc position as a start position
-            for distance in xrange(nearest_possible_diagonal_win, furthest_possible_diagonal_win + 1):
-                row_index = last_disc_row_index - distance
-                column_index = last_disc_column_index - distance
-                values = [self.grid[row_index + i][column_index + i] for i in xrange(4)]
-                winner = four_in_a_row(values)
-                if winner:
-                    return winner
-
-        # Check for diagonal / win
-        sum_of_last_move_indices = (last_disc_row_index + last_disc_column_index)
-        if sum_of_last_move_indices > 2 and sum_of_last_move_indices < 9:
-            # It's possible this disc creates a win if we check from a start position higher along the disc's diagonal
-            furthest_possible_diagonal_win = min(3, last_disc_row_index, self.WIDTH - last_disc_column_index - 1)
-            nearest_possible_diagonal_win = max(0, last_disc_row_index - 2, 3 - last_disc_column_index)
-            for distance in xrange(nearest_possible_diagonal_win, furthest_possible_diagonal_win + 1):
-                row_index = last_disc_row_index - distance
-                column_index = last_disc_column_index + distance
-                values = [self.grid[row_index + i][column_index - i] for i in xrange(4)]
-                winner = four_in_a_row(values)
-                if winner:
-                    return winner
+        bitboard = self._bitboards[position - 1]
+        for line in geometry.lines_through[disc_index]:
+            if bitboard & line == line:
+                return position
 
         return None
 
+    def is_winning_move(self, column_index, disc_type):
+        """Check if dropping a disc in a column would win, without dropping it.
+
+        Args:
+            column_index (int): index of the column
+            disc_type (DiscType): disc type that would be dropped
+
+        Returns:
+            True if the disc would complete a line, False otherwise or if the column is full
+        """
+        geometry = self._geometry
+        height = self._heights[column_index]
+        if height == geometry.height:
+            return False
+
+        disc_index = column_index * geometry.column_bits + height
+        bitboard = self._bitboards[disc_type.value - 1] | (1 << disc_index)
+        for line in geometry.lines_through[disc_index]:
+            if bitboard & line == line:
+                return True
+
+        return False
+
     def is_full(self):
         """Check if a board is full.
 
         Returns:
             True if there are no empty spots on the board, otherwise False
         """
-        for row in self.grid:
-            if not all(row):
-                return False
+        return self._disc_count == self._geometry.slot_count
+
+    def playable_columns(self):
+        """List the indices of the columns that aren't full yet."""
+        height = self._geometry.height
+        return [column_index for column_index, column_height in enumerate(self._heights) if column_height < height]
 
-        return True
+    def copy(self):
+        """Copy the board, e.g. to try out a move without touching the original.
+
+        Returns:
+            A new `Board` instance with the same discs and variant
+        """
+        board = object.__new__(type(self))
+        board._geometry = self._geometry
+        board._bitboards = list(self._bitboards)
+        board._heights = list(self._heights)
+        board._disc_count = self._disc_count
+        board._hashes = self._hashes
+        return board
+
+    def _reset(self):
+        self._bitboards = [0, 0]
+        self._heights = [0] * self._geometry.width
+        self._disc_count = 0
+        # (position hash, hash of the mirror image), or None until they're needed
+        self._hashes = None
+
+    def _load_grid(self, grid):
+        self._reset()
+        geometry = self._geometry
+        empty = DiscType.NONE.value
+        for row_index, row in enumerate(grid):
+            height = geometry.height - 1 - row_index
+            for column_index, disc_value in enumerate(row):
+                if disc_value != empty:
+                    bit = 1 << (column_index * geometry.column_bits + height)
+                    self._bitboards[disc_value - 1] |= bit
+                    self._heights[column_index] += 1
+
+        self._disc_count = sum(self._heights)
+
+    def _load_bitboards(self, player_1_bitboard, player_2_bitboard):
+        geometry = self._geometry
+        self._bitboards = [player_1_bitboard, player_2_bitboard]
+        mask = player_1_bitboard | player_2_bitboard
+        column_mask = (1 << geometry.height) - 1
+        for column_index in xrange(geometry.width):
+            column_bits = (mask >> (column_index * geometry.column_bits)) & column_mask
+            # Columns fill from the bottom, so the occupied slots are a run of low bits
+            self._heights[column_index] = column_bits.bit_length()
+
+        self._disc_count = sum(self._heights)
+
+    def _compute_hashes(self):
+        geometry = self._geometry
+        position_hash = 0
+        mirror_hash = 0
+        for keys, mirror_keys, bitboard in zip(geometry.zobrist_keys, geometry.mirror_zobrist_keys, self._bitboards):
+            while bitboard:
+                low_bit = bitboard & -bitboard
+                disc_index = low_bit.bit_length() - 1
+                position_hash ^= keys[disc_index]
+                mirror_hash ^= mirror_keys[disc_index]
+                bitboard ^= low_bit
+
+        return position_hash, mirror_hash
 
     def _new_grid(self):
-        return [[DiscType.NONE.value for _ in xrange(self.WIDTH)] for _ in xrange(self.HEIGHT)]
+        return [[DiscType.NONE.value for _ in xrange(self._geometry.width)] for _ in xrange(self._geometry.height)]
 
     def _validate_column_values(self, transposed_grid):
         # Check every slot for gaps and validate each slot's values
@@ -201,8 +446,8 @@ class Board(object):
             raise InvalidGridError("Grid must be of type `list`")
 
         # Check grid height
-        if len(grid) != self.HEIGHT:
-            raise InvalidGridError("Grid height must be %d" % self.HEIGHT)
+        if len(grid) != self.height:
+            raise InvalidGridError("Grid height must be %d" % self.height)
 
         for row_index, row in enumerate(grid):
             # Check grid row type
@@ -210,8 +455,11 @@ class Board(object):
                 raise InvalidGridError("Grid rows must be of type `list`")
 
             # Check grid row width
-            if len(row) != self.WIDTH:
-                raise InvalidGridError("Grid width must be %d" % self.WIDTH)
+            if len(row) != self.width:
+                raise InvalidGridError("Grid width must be %d" % self.width)
 
         transposed_grid = [list(column) for column in zip(*grid)]
         self._validate_column_values(transposed_grid)
+
+
+STANDARD_VARIANT = BoardVariant(Board.WIDTH, Board.HEIGHT, Board.CONNECT)
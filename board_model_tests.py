@@ -1,10 +1,13 @@
+import random
 import unittest
 
 from board_model import (
     Board,
+    BoardVariant,
     DiscType,
     GridColumnFullError,
     InvalidGridError,
+    _Geometry,
 )
 
 
@@ -140,3 +143,288 @@ class BoardTests(unittest.TestCase):
         with self.assertRaises(AssertionError):
             board.grid = expected_grid
 
+
+    def test_is_winning_disc(self):
+        # Horizontal win
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 2, 2, 2, 0, 0, 0],
+            [0, 1, 1, 1, 1, 0, 0],
+        ]
+        board = Board(grid)
+        self.assertEqual(board.is_winning_disc(5, 4), 1)
+        self.assertEqual(board.is_winning_disc(5, 1), 1)
+        self.assertIsNone(board.is_winning_disc(4, 2))
+
+        # Vertical win
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 2],
+            [0, 0, 0, 0, 0, 1, 2],
+            [0, 0, 0, 0, 0, 1, 2],
+            [0, 0, 0, 0, 1, 1, 2],
+        ]
+        board = Board(grid)
+        self.assertEqual(board.is_winning_disc(2, 6), 2)
+        self.assertIsNone(board.is_winning_disc(3, 5))
+
+        # Diagonal \ win
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [1, 0, 0, 0, 0, 0, 0],
+            [2, 1, 0, 0, 0, 0, 0],
+            [2, 1, 1, 0, 0, 0, 0],
+            [1, 2, 2, 1, 2, 0, 0],
+        ]
+        board = Board(grid)
+        self.assertEqual(board.is_winning_disc(2, 0), 1)
+        self.assertEqual(board.is_winning_disc(5, 3), 1)
+
+        # Diagonal / win
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 2],
+            [0, 0, 0, 0, 0, 2, 1],
+            [0, 0, 0, 0, 2, 1, 1],
+            [0, 0, 1, 2, 1, 2, 1],
+        ]
+        board = Board(grid)
+        self.assertEqual(board.is_winning_disc(2, 6), 2)
+        self.assertEqual(board.is_winning_disc(5, 3), 2)
+
+        # Only lines through the disc count
+        self.assertIsNone(board.is_winning_disc(5, 5))
+
+        # Empty slots never win
+        self.assertIsNone(board.is_winning_disc(0, 0))
+
+        # Discs can't line up across columns
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [1, 0, 0, 0, 0, 0, 0],
+            [1, 0, 0, 0, 0, 0, 0],
+            [2, 1, 0, 0, 0, 0, 0],
+            [2, 1, 2, 0, 0, 0, 2],
+        ]
+        board = Board(grid)
+        self.assertIsNone(board.is_winning_disc(2, 0))
+        self.assertIsNone(board.is_winning_disc(4, 1))
+
+    def test_is_full(self):
+        board = Board()
+        self.assertFalse(board.is_full())
+
+        for column_index in xrange(Board.WIDTH):
+            for i in xrange(Board.HEIGHT):
+                disc_type = DiscType.PLAYER_1 if (column_index // 2 + i) % 2 == 0 else DiscType.PLAYER_2
+                self.assertFalse(board.is_full())
+                board.drop_disc(column_index, disc_type)
+
+        self.assertTrue(board.is_full())
+        self.assertTrue(Board(board.grid).is_full())
+
+    def test_bitboards(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 1, 0, 0, 2, 0, 0],
+            [0, 2, 0, 0, 1, 0, 0],
+            [0, 1, 0, 1, 2, 0, 1],
+            [2, 2, 1, 2, 1, 0, 2],
+        ]
+        board = Board(grid)
+        player_1_bitboard, player_2_bitboard = board.bitboards
+        self.assertEqual(player_1_bitboard & player_2_bitboard, 0)
+
+        # Bit 0 is the bottom slot of the leftmost column and each column uses `HEIGHT + 1` bits
+        self.assertTrue(player_2_bitboard & (1 << 0))
+        self.assertTrue(player_1_bitboard & (1 << (4 * (Board.HEIGHT + 1) + 2)))
+
+        # Round trip through bitboards
+        board = Board.from_bitboards(player_1_bitboard, player_2_bitboard)
+        self.assertEqual(board.grid, grid)
+
+        # Column heights are restored, so drops land on top of existing discs
+        self.assertEqual(board.drop_disc(4, DiscType.PLAYER_2), (1, 4))
+        self.assertEqual(board.drop_disc(5, DiscType.PLAYER_1), (5, 5))
+
+    def test_from_trusted(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 1, 0, 0, 2, 0, 0],
+            [0, 2, 0, 0, 1, 0, 0],
+            [0, 1, 0, 1, 2, 0, 1],
+            [2, 2, 1, 2, 1, 0, 2],
+        ]
+        board = Board.from_trusted(grid)
+        self.assertEqual(board.grid, grid)
+        self.assertEqual(board.bitboards, Board(grid).bitboards)
+        self.assertEqual(board.drop_disc(4, DiscType.PLAYER_2), (1, 4))
+        self.assertFalse(board.is_full())
+
+        # Only `Board(grid)` validates; the trusted path takes the grid as given
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [1, 1, 1, 0, 0, 0, 0],
+        ]
+        with self.assertRaises(InvalidGridError):
+            Board(grid)
+        self.assertEqual(Board.from_trusted(grid).grid, grid)
+
+    def test_copy(self):
+        board = Board()
+        for _ in xrange(Board.HEIGHT):
+            board.drop_disc(2, DiscType.PLAYER_1)
+        board.drop_disc(5, DiscType.PLAYER_2)
+        self.assertEqual(board.playable_columns(), [0, 1, 3, 4, 5, 6])
+
+        copy = board.copy()
+        self.assertEqual(copy.drop_disc(5, DiscType.PLAYER_1), (4, 5))
+        self.assertEqual(copy.grid[4][5], DiscType.PLAYER_1.value)
+        self.assertEqual(board.grid[4][5], DiscType.NONE.value)
+        self.assertFalse(copy.bitboards == board.bitboards)
+        self.assertEqual(copy.variant, board.variant)
+
+    def test_is_winning_move(self):
+        board = Board()
+        for column_index in (1, 2, 3):
+            board.drop_disc(column_index, DiscType.PLAYER_1)
+        for _ in xrange(Board.HEIGHT):
+            board.drop_disc(0, DiscType.PLAYER_2)
+
+        self.assertTrue(board.is_winning_move(4, DiscType.PLAYER_1))
+        self.assertFalse(board.is_winning_move(4, DiscType.PLAYER_2))
+        self.assertFalse(board.is_winning_move(5, DiscType.PLAYER_1))
+        # Column 0 is full
+        self.assertFalse(board.is_winning_move(0, DiscType.PLAYER_1))
+        self.assertEqual(board.playable_columns(), [1, 2, 3, 4, 5, 6])
+
+    def test_position_hash(self):
+        board = Board()
+        self.assertEqual(board.position_hash, 0)
+        for column_index, disc_type in ((3, DiscType.PLAYER_1), (1, DiscType.PLAYER_2), (3, DiscType.PLAYER_1)):
+            previous_hash = board.position_hash
+            board.drop_disc(column_index, disc_type)
+            self.assertNotEqual(board.position_hash, previous_hash)
+
+        # Updated a disc at a time, the hash matches one computed from scratch
+        self.assertEqual(board.position_hash, Board.from_bitboards(*board.bitboards).position_hash)
+        self.assertEqual(board.position_hash, Board.from_trusted(board.grid).position_hash)
+        self.assertEqual(board.copy().position_hash, board.position_hash)
+
+        # Move order doesn't matter, but who owns a disc does
+        other = Board()
+        for column_index, disc_type in ((3, DiscType.PLAYER_1), (3, DiscType.PLAYER_1), (1, DiscType.PLAYER_2)):
+            other.drop_disc(column_index, disc_type)
+        self.assertEqual(other.position_hash, board.position_hash)
+        other = Board()
+        for column_index, disc_type in ((3, DiscType.PLAYER_1), (1, DiscType.PLAYER_1), (3, DiscType.PLAYER_2)):
+            other.drop_disc(column_index, disc_type)
+        self.assertNotEqual(other.position_hash, board.position_hash)
+
+        # A position and its mirror image share a canonical hash
+        mirrored = Board()
+        mirrored.drop_disc(3, DiscType.PLAYER_1)
+        mirrored.drop_disc(5, DiscType.PLAYER_2)
+        mirrored.drop_disc(3, DiscType.PLAYER_1)
+        self.assertNotEqual(mirrored.position_hash, board.position_hash)
+        self.assertEqual(mirrored.canonical_hash, board.canonical_hash)
+        self.assertIn(board.canonical_hash, (board.position_hash, mirrored.position_hash))
+
+        # Symmetric positions are their own mirror image
+        symmetric = Board()
+        symmetric.drop_disc(3, DiscType.PLAYER_1)
+        self.assertEqual(symmetric.canonical_hash, symmetric.position_hash)
+
+        # The keys are seeded, so hashes are the same in every process
+        self.assertEqual(_Geometry(*Board().variant).zobrist_keys, Board()._geometry.zobrist_keys)
+
+        # Variants fold their mirror images too
+        board = Board(width=9, height=7, connect=5)
+        board.drop_disc(0, DiscType.PLAYER_1)
+        mirrored = Board(width=9, height=7, connect=5)
+        mirrored.drop_disc(8, DiscType.PLAYER_1)
+        self.assertEqual(mirrored.canonical_hash, board.canonical_hash)
+
+    def test_position_hash_collisions(self):
+        # Distinct positions from thousands of random games never share a hash
+        generator = random.Random(23)
+        for variant in (BoardVariant(7, 6, 4), BoardVariant(9, 7, 4)):
+            positions_by_hash = {}
+            canonical_positions_by_hash = {}
+            for _ in xrange(2000):
+                board = Board(None, *variant)
+                # Played move for move in the mirrored columns
+                mirrored = Board(None, *variant)
+                disc_type = DiscType.PLAYER_1
+                while True:
+                    row_index, column_index = board.drop_disc(generator.choice(board.playable_columns()), disc_type)
+                    mirrored.drop_disc(variant.width - 1 - column_index, disc_type)
+                    bitboards = board.bitboards
+                    self.assertEqual(positions_by_hash.setdefault(board.position_hash, bitboards), bitboards)
+
+                    canonical = min(bitboards, mirrored.bitboards)
+                    self.assertEqual(
+                        canonical_positions_by_hash.setdefault(board.canonical_hash, canonical), canonical,
+                    )
+
+                    if board.is_winning_disc(row_index, column_index) or board.is_full():
+                        break
+                    disc_type = DiscType.PLAYER_2 if disc_type == DiscType.PLAYER_1 else DiscType.PLAYER_1
+
+            self.assertGreater(len(positions_by_hash), 20000)
+
+    def test_variants(self):
+        board = Board(width=9, height=7, connect=5)
+        self.assertEqual(board.variant, BoardVariant(9, 7, 5))
+        self.assertEqual(len(board.grid), 7)
+        self.assertEqual(len(board.grid[0]), 9)
+
+        # Four in a row doesn't win connect five
+        for column_index in xrange(4):
+            row_index, _ = board.drop_disc(column_index, DiscType.PLAYER_1)
+            self.assertIsNone(board.is_winning_disc(row_index, column_index))
+        self.assertEqual(board.drop_disc(4, DiscType.PLAYER_1), (6, 4))
+        self.assertEqual(board.is_winning_disc(6, 4), DiscType.PLAYER_1.value)
+        self.assertEqual(board.is_winning_disc(6, 0), DiscType.PLAYER_1.value)
+
+        # Diagonal wins reach the far corner of a larger board
+        board = Board(width=8, height=7)
+        for column_index in xrange(4, 8):
+            for _ in xrange(column_index - 4):
+                board.drop_disc(column_index, DiscType.PLAYER_2)
+            row_index, _ = board.drop_disc(column_index, DiscType.PLAYER_1)
+        self.assertEqual(row_index, 3)
+        self.assertEqual(board.is_winning_disc(row_index, 7), DiscType.PLAYER_1.value)
+
+        # Columns fill up at the variant's height
+        board = Board(width=8, height=7)
+        for index in xrange(7):
+            board.drop_disc(0, DiscType.PLAYER_1 if index % 2 == 0 else DiscType.PLAYER_2)
+        with self.assertRaises(GridColumnFullError):
+            board.drop_disc(0, DiscType.PLAYER_2)
+
+        # Grids, bitboards and the trusted path all keep the variant
+        self.assertEqual(Board(board.grid, 8, 7).grid, board.grid)
+        self.assertEqual(Board.from_bitboards(*board.bitboards, width=8, height=7).grid, board.grid)
+        self.assertEqual(Board.from_trusted(board.grid, 8, 7).variant, board.variant)
+        with self.assertRaises(InvalidGridError):
+            Board(board.grid)
+
+        # Win lines are built once per variant and shared
+        self.assertIs(Board(width=8, height=7)._geometry, board._geometry)
+
+        with self.assertRaises(AssertionError):
+            Board(width=3, height=3)
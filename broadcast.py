@@ -0,0 +1,175 @@
+"""Sending game states to rooms full of players and spectators.
+
+A game's room can hold hundreds of spectators, so nothing sent to it should cost more per recipient than it has to:
+
+- `FanOutManager` is the Socket.IO client manager. python-socketio builds and JSON-encodes an event's packet once
+  per recipient; this manager builds it once per room and sends the same packet, encoded on first use, to every
+  connection in it.
+- `GameStateCache` keeps each game's encoded state by revision, so a version of a game is serialized once however
+  many clients it's sent to.
+
+Spectators are served from the game states this process has: the encoded state cache and the game cache, which
+player connections and broadcasts keep filled. They never write to the game store. A process that doesn't have the
+game, because it has never seen it or another process has written it since, reads it from Redis once, and every
+spectator who joins or resyncs during that read shares it.
+"""
+from collections import OrderedDict
+
+import socketio
+from gevent.event import AsyncResult
+from socketio import packet
+
+from game_store import GameStore
+
+
+# Encoded game states kept per app process
+GAME_STATE_CACHE_SIZE = 1024
+
+
+### Fan-out ###
+
+class _EncodedPacket(packet.Packet):
+    # A packet that's encoded the first time it's sent and reused for every other recipient
+    _encoded = None
+
+    def encode(self):
+        if self._encoded is None:
+            self._encoded = super(_EncodedPacket, self).encode()
+        return self._encoded
+
+
+class FanOutManager(socketio.BaseManager):
+    """Client manager that encodes each event once for all the connections it goes to."""
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None):
+        if callback is not None or namespace not in self.rooms or room not in self.rooms[namespace]:
+            # Every recipient of an event with a callback needs a packet with its own ack id
+            return super(FanOutManager, self).emit(event, data, namespace, room, skip_sid, callback)
+
+        event_packet = self._event_packet(event, data, namespace)
+        for sid in self.get_participants(namespace, room):
+            if sid != skip_sid:
+                self._send_encoded(sid, event_packet)
+
+    def _send_encoded(self, sid, pkt):
+        """Send a packet from `_event_packet()` to one connection.
+
+        Goes through `socketio.Server._send_packet()`, which every packet python-socketio sends passes through, so
+        anything hooked in there, like Flask-SocketIO's test client, sees broadcasts too.
+        """
+        self.server._send_packet(sid, pkt)
+
+    def _event_packet(self, event, data, namespace):
+        # Builds the same packet as `socketio.Server._emit_internal()` does on Python 2
+        binary = None if self.server.binary else False
+        data = list(data) if isinstance(data, tuple) else [data]
+        return _EncodedPacket(packet.EVENT, namespace=namespace, data=[event] + data, binary=binary)
+
+
+class FanOutRedisManager(socketio.RedisManager, FanOutManager):
+    """`FanOutManager` for processes that relay events to each other through Redis pub/sub."""
+
+
+class FanOutKombuManager(socketio.KombuManager, FanOutManager):
+    """`FanOutManager` for processes that relay events to each other through a Kombu message queue."""
+
+
+def fan_out_manager(message_queue=None, channel='flask-socketio'):
+    """Build the client manager for `SocketIO(client_manager=...)`.
+
+    Args:
+        message_queue (str): URL of the message queue processes relay events through, as Flask-SocketIO's
+            `message_queue` option, or None when the app runs as a single process
+        channel (str): the queue's channel
+
+    Returns:
+        A `FanOutManager`
+    """
+    if not message_queue:
+        return FanOutManager()
+
+    queue_class = FanOutRedisManager if message_queue.startswith('redis://') else FanOutKombuManager
+    return queue_class(message_queue, channel=channel)
+
+
+### Encoded game states ###
+
+class GameStateCache(object):
+    """Bounded LRU cache of encoded game states, one revision per game.
+
+    `encode` is the function that turns a game data dictionary into the JSON state sent to clients. Meant to be used
+    from greenlets of a single thread.
+    """
+
+    def __init__(self, encode, max_size=GAME_STATE_CACHE_SIZE):
+        self._encode = encode
+        self.max_size = max_size
+        # Game id => (revision, encoded state), least recently used first
+        self._states = OrderedDict()
+        # Game id => AsyncResult of the read running for it
+        self._reads = {}
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    def encode(self, game):
+        """Encode a game's state, or return the encoding of the same revision from the cache.
+
+        Args:
+            game (dict): the game data dictionary
+
+        Returns:
+            JSON object with the game state for clients
+        """
+        game_id = game["game_id"]
+        entry = self._states.pop(game_id, None)
+        if entry is not None and entry[0] == game["revision"]:
+            self._states[game_id] = entry
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        if entry is not None and entry[0] > game["revision"]:
+            # Someone is sending an older revision; keep the newer one cached
+            self._states[game_id] = entry
+            return self._encode(game)
+
+        state = self._encode(game)
+        self._states[game_id] = (game["revision"], state)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+        return state
+
+    def current(self, game_id):
+        """Get a game's current encoded state, for spectators.
+
+        The game comes from the game store's cache when it's there, and from Redis otherwise. Concurrent calls for the
+        same game share one read, and a game still in the legacy format isn't migrated: spectators never write.
+
+        Args:
+            game_id (str): uuid of the game
+
+        Returns:
+            JSON object with the game state for clients, or None if the game doesn't exist
+        """
+        read = self._reads.get(game_id)
+        if read is not None:
+            self.merged += 1
+            return read.get()
+
+        read = self._reads[game_id] = AsyncResult()
+        try:
+            game = GameStore.get(game_id, migrate=False)
+            state = None if game is None else self.encode(game)
+        except BaseException as e:
+            read.set_exception(e)
+            raise
+        finally:
+            del self._reads[game_id]
+
+        read.set(state)
+        return state
+
+    def stats(self):
+        return dict(size=len(self._states), hits=self.hits, misses=self.misses, merged=self.merged)
@@ -0,0 +1,134 @@
+import cPickle
+import unittest
+
+import redis
+import socketio
+
+from board_model import Board
+from broadcast import (
+    FanOutManager,
+    FanOutRedisManager,
+    GameStateCache,
+    fan_out_manager,
+)
+from game_store import (
+    GameStore,
+    game_key,
+    move_log_key,
+    redis_client,
+    snapshots_key,
+)
+
+
+class _SentPackets(object):
+    # Stands in for the engine.io server, keeping what would go out to each connection
+    def __init__(self):
+        self.packets = []
+
+    def send(self, sid, data, binary=False):
+        self.packets.append((sid, data))
+
+
+def _server(client_manager):
+    server = socketio.Server(client_manager=client_manager)
+    server.eio = _SentPackets()
+    for sid in ('player', 'spectator-1', 'spectator-2'):
+        server.manager.connect(sid, '/watch')
+        server.manager.enter_room(sid, '/watch', 'game')
+    server.manager.connect('elsewhere', '/watch')
+    return server
+
+
+class FanOutManagerTests(unittest.TestCase):
+    def test_emit(self):
+        server = _server(FanOutManager())
+        expected = _server(None)
+        for room in ('game', 'spectator-1', None):
+            server.emit('move', '{"seq": 1}', room=room, namespace='/watch')
+            expected.emit('move', '{"seq": 1}', room=room, namespace='/watch')
+        server.emit('move', ('{"seq": 1}', 2), room='game', skip_sid='player', namespace='/watch')
+        expected.emit('move', ('{"seq": 1}', 2), room='game', skip_sid='player', namespace='/watch')
+        # Nobody's in these
+        server.emit('move', '{"seq": 1}', room='other game', namespace='/watch')
+        server.emit('move', '{"seq": 1}', room='game')
+
+        # Every connection gets the packets python-socketio would have sent, all encoded once per emit
+        self.assertEqual(sorted(server.eio.packets), sorted(expected.eio.packets))
+        self.assertEqual(len(server.eio.packets), 3 + 1 + 4 + 2)
+        packets = [data for sid, data in server.eio.packets[:3]]
+        self.assertTrue(all(data is packets[0] for data in packets))
+
+        # Events with callbacks need an ack id per connection
+        callbacks = []
+        server.emit('move', 'data', room='spectator-1', namespace='/watch', callback=callbacks.append)
+        self.assertEqual(server.eio.packets[-1], ('spectator-1', u'2/watch,1["move","data"]'))
+
+    def test_fan_out_manager(self):
+        self.assertIs(type(fan_out_manager()), FanOutManager)
+        manager = fan_out_manager('redis://localhost:6379/0')
+        self.assertIsInstance(manager, FanOutRedisManager)
+        self.assertIsInstance(manager, socketio.RedisManager)
+
+
+class GameStateCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.encoded = []
+        self.cache = GameStateCache(self.encode, max_size=2)
+
+    def encode(self, game):
+        self.encoded.append((game["game_id"], game["revision"]))
+        return '%(game_id)s@%(revision)d' % game
+
+    def test_encode(self):
+        # Each revision of a game is encoded once
+        self.assertEqual(self.cache.encode(dict(game_id='one', revision=1)), 'one@1')
+        self.assertEqual(self.cache.encode(dict(game_id='one', revision=1)), 'one@1')
+        self.assertEqual(self.cache.encode(dict(game_id='one', revision=2)), 'one@2')
+        self.assertEqual(self.encoded, [('one', 1), ('one', 2)])
+
+        # An older revision doesn't replace the newer one
+        self.assertEqual(self.cache.encode(dict(game_id='one', revision=1)), 'one@1')
+        self.assertEqual(self.cache.encode(dict(game_id='one', revision=2)), 'one@2')
+        self.assertEqual(self.cache.stats(), dict(size=1, hits=2, misses=3, merged=0))
+
+        # The least recently used game goes first
+        self.cache.encode(dict(game_id='two', revision=1))
+        self.cache.encode(dict(game_id='one', revision=2))
+        self.cache.encode(dict(game_id='three', revision=1))
+        self.cache.encode(dict(game_id='one', revision=2))
+        self.assertEqual(self.cache.stats()["size"], 2)
+        self.cache.encode(dict(game_id='two', revision=1))
+        self.assertEqual(self.encoded[-1], ('two', 1))
+
+    def test_current(self):
+        # This test needs the Redis server from `REDIS_CONNECTION_SETTINGS`
+        try:
+            redis_client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis isn't running")
+
+        game_id = GameStore.create()
+        try:
+            game = GameStore.get(game_id)
+            self.assertEqual(self.cache.current(game_id), '%s@%d' % (game_id, game["revision"]))
+            self.assertEqual(self.cache.current(game_id), '%s@%d' % (game_id, game["revision"]))
+            self.assertEqual(self.encoded, [(game_id, game["revision"])])
+        finally:
+            redis_client.delete(game_key(game_id), move_log_key(game_id), snapshots_key(game_id))
+
+        self.assertIsNone(self.cache.current('no-such-game'))
+
+        # Spectators never write, so a game still in the legacy format isn't migrated for them
+        redis_client.set('legacygame02', cPickle.dumps(dict(
+            game_id='legacygame02',
+            player_positions={},
+            player_open_connections={},
+            grid=Board().grid,
+            position_with_turn=1,
+            winner=None,
+        )))
+        try:
+            self.assertIsNone(self.cache.current('legacygame02'))
+            self.assertFalse(redis_client.exists(game_key('legacygame02')))
+        finally:
+            redis_client.delete('legacygame02', game_key('legacygame02'), snapshots_key('legacygame02'))
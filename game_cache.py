@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import operation
+
+
+def copy_game(game):
+    """Copy a game data dictionary deeply enough that callers can't change the cached one."""
+    game = dict(game)
+    game["player_positions"] = dict(game["player_positions"])
+    game["player_open_connections"] = dict(game["player_open_connections"])
+    game["grid"] = [list(row) for row in game["grid"]]
+    return game
+
+
+class GameCache(object):
+    """Bounded LRU cache of decoded games, local to one worker process.
+
+    Entries are keyed by game id and remember the game's revision. Every write to a game publishes its new revision,
+    and `listen_for_invalidations()` drops cached entries older than that. Since we can't tell what we missed while
+    not subscribed, the cache only serves reads while `connected` is set.
+    """
+
+    def __init__(self, max_size=1024, enabled=True):
+        self.max_size = max_size
+        self.enabled = enabled
+        self.connected = False
+        self._games = OrderedDict()
+        # Latest announced revision of recently invalidated games, so a read that raced with a write can't cache the
+        # older state after the invalidation went by
+        self._latest_revisions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def active(self):
+        return self.enabled and self.connected
+
+    def get(self, game_id):
+        """Get a copy of a cached game, or None if it isn't cached."""
+        if not self.active:
+            return None
+
+        with self._lock:
+            game = self._games.pop(game_id, None)
+            if game is None:
+                self.misses += 1
+                return None
+
+            # Move the entry to the most recently used end
+            self._games[game_id] = game
+            self.hits += 1
+
+        return copy_game(game)
+
+    def put(self, game):
+        """Cache a game unless we already have the same or a newer revision of it."""
+        if not self.active:
+            return
+
+        game_id = game["game_id"]
+        with self._lock:
+            if game["revision"] < self._latest_revisions.get(game_id, 0):
+                return
+
+            cached_game = self._games.pop(game_id, None)
+            if cached_game is not None and cached_game["revision"] > game["revision"]:
+                game = cached_game
+            else:
+                game = copy_game(game)
+            self._games[game_id] = game
+
+            while len(self._games) > self.max_size:
+                self._games.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, game_id, revision=None):
+        """Drop a cached game if it's older than `revision`, or unconditionally if no revision is given."""
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is not None and (revision is None or game["revision"] < revision):
+                del self._games[game_id]
+                self.invalidations += 1
+
+            if revision is not None:
+                self._latest_revisions.pop(game_id, None)
+                self._latest_revisions[game_id] = revision
+                while len(self._latest_revisions) > self.max_size:
+                    self._latest_revisions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+            self._latest_revisions.clear()
+
+    def stats(self):
+        return dict(
+            size=len(self._games),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+        )
+
+
+def listen_for_invalidations(redis_client, channel, cache, key_prefix='', retry_delay=1.0):
+    """Apply the revision announcements published on `channel` to `cache`. Runs forever.
+
+    Messages are "<key> <revision>", where key is the game's Redis key (`key_prefix` + game id). The cache is only
+    connected between Redis confirming the subscription and the first error, after which we subscribe again.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            with operation('cache_invalidations'):
+                pubsub.subscribe(channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Anything cached before we (re)subscribed may have missed an invalidation
+                        cache.clear()
+                        cache.connected = True
+                    elif message['type'] == 'message':
+                        key, revision = message['data'].rsplit(' ', 1)
+                        cache.invalidate(key[len(key_prefix):], int(revision))
+        except Exception:
+            # Whether Redis went away or a message made no sense, we can't tell which invalidations we missed
+            pass
+        finally:
+            cache.connected = False
+            cache.clear()
+            pubsub.close()
+
+        time.sleep(retry_delay)
+
+
+def start_invalidation_listener(redis_client, channel, cache, key_prefix=''):
+    """Run `listen_for_invalidations()` in a daemon thread."""
+    thread = threading.Thread(
+        target=listen_for_invalidations,
+        args=(redis_client, channel, cache),
+        kwargs=dict(key_prefix=key_prefix),
+        name='game-cache-invalidations',
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
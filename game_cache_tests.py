@@ -0,0 +1,142 @@
+import unittest
+
+from board_model import Board
+from game_cache import (
+    GameCache,
+    listen_for_invalidations,
+)
+
+
+def make_game(game_id, revision):
+    return {
+        "game_id": game_id,
+        "revision": revision,
+        "player_positions": {'player-one': 1},
+        "player_open_connections": {'player-one': 1},
+        "grid": Board().grid,
+        "position_with_turn": 1,
+        "winner": None,
+    }
+
+
+class _StopListening(BaseException):
+    pass
+
+
+class _FakeRedis(object):
+    """Hands out one pubsub that yields `messages`, then stops the listener when it tries to subscribe again."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.pubsubs = 0
+
+    def pubsub(self):
+        self.pubsubs += 1
+        if self.pubsubs > 1:
+            raise _StopListening()
+        return _FakePubSub(self.messages)
+
+
+class _FakePubSub(object):
+    def __init__(self, messages):
+        self.messages = messages
+
+    def subscribe(self, channel):
+        pass
+
+    def listen(self):
+        for message in self.messages:
+            yield message() if callable(message) else message
+
+    def close(self):
+        pass
+
+
+class GameCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = GameCache(max_size=2)
+        self.cache.connected = True
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put(make_game('a', 1))
+
+        game = self.cache.get('a')
+        self.assertEqual(game["revision"], 1)
+
+        # Callers get copies
+        game["grid"][5][0] = 1
+        game["player_positions"]['player-two'] = 2
+        self.assertEqual(self.cache.get('a')["grid"], Board().grid)
+        self.assertEqual(self.cache.get('a')["player_positions"], {'player-one': 1})
+
+        # Older revisions don't replace newer ones
+        self.cache.put(make_game('a', 3))
+        self.cache.put(make_game('a', 2))
+        self.assertEqual(self.cache.get('a')["revision"], 3)
+
+        self.assertEqual(self.cache.stats()["hits"], 4)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        self.cache.put(make_game('a', 1))
+        self.cache.put(make_game('b', 1))
+        self.cache.get('a')
+        self.cache.put(make_game('c', 1))
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_invalidate(self):
+        self.cache.put(make_game('a', 2))
+
+        # Announcements of the cached revision or older keep the entry
+        self.cache.invalidate('a', 2)
+        self.assertIsNotNone(self.cache.get('a'))
+
+        self.cache.invalidate('a', 3)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+        # A read that raced with the write can't bring the old revision back
+        self.cache.put(make_game('a', 2))
+        self.assertIsNone(self.cache.get('a'))
+
+        self.cache.put(make_game('a', 3))
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_inactive(self):
+        self.cache.connected = False
+        self.cache.put(make_game('a', 1))
+        self.cache.connected = True
+        self.assertIsNone(self.cache.get('a'))
+
+        self.cache.put(make_game('a', 1))
+        self.cache.enabled = False
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_listen_for_invalidations(self):
+        self.cache.connected = False
+        states = []
+
+        def check_state():
+            states.append(self.cache.connected)
+            self.cache.put(make_game('a', 2))
+            return dict(type='message', data='game:a 3')
+
+        def check_invalidated():
+            states.append(self.cache.get('a'))
+            return dict(type='message', data='not an announcement')
+
+        messages = [check_state, dict(type='subscribe', data=1), check_state, check_invalidated]
+        with self.assertRaises(_StopListening):
+            listen_for_invalidations(_FakeRedis(messages), 'updates', self.cache, key_prefix='game:', retry_delay=0)
+
+        # Only connected once Redis confirmed the subscription, and invalidations apply
+        self.assertEqual(states, [False, True, None])
+        # Any error disconnects and empties the cache
+        self.assertFalse(self.cache.connected)
+        self.assertEqual(self.cache.stats()["size"], 0)
@@ -1,11 +1,30 @@
+import binascii
 import cPickle
+from collections import namedtuple
 
 import redis
 from shortuuid import ShortUUID
 from board_model import (
+    STANDARD_VARIANT,
     Board,
+    BoardVariant,
     DiscType,
 )
+from game_cache import (
+    GameCache,
+    copy_game,
+    start_invalidation_listener,
+)
+from metrics import (
+    current_operation,
+    operation,
+    redis_commands,
+    redis_received_bytes,
+    redis_round_trips,
+    redis_sent_bytes,
+    registry,
+    serialize_seconds,
+)
 
 REDIS_CONNECTION_SETTINGS = {
     'host': 'localhost',
@@ -13,19 +32,446 @@ REDIS_CONNECTION_SETTINGS = {
     'db': 0,
 }
 
-redis_client = redis.StrictRedis(**REDIS_CONNECTION_SETTINGS)
+# One pool per worker process, shared by every greenlet. Greenlets wait for a free connection once all of them are
+# in use, so this caps the worker's connections to Redis.
+REDIS_MAX_CONNECTIONS = 64
+REDIS_CONNECTION_TIMEOUT = 5
 
 
-def set_value(key, value):
-    redis_client.set(key, cPickle.dumps(value))
+class InstrumentedConnection(redis.Connection):
+    """Redis connection that counts its traffic in the metrics, by the operation that caused it."""
 
+    def send_packed_command(self, command):
+        if isinstance(command, str):
+            command = [command]
+        labels = (current_operation(),)
+        redis_round_trips.inc(labels=labels)
+        redis_sent_bytes.inc(sum(map(len, command)), labels=labels)
+        super(InstrumentedConnection, self).send_packed_command(command)
+
+    def read_response(self):
+        labels = (current_operation(),)
+        redis_commands.inc(labels=labels)
+        response = super(InstrumentedConnection, self).read_response()
+        redis_received_bytes.inc(_reply_size(response), labels=labels)
+        return response
+
+
+def _reply_size(reply):
+    if isinstance(reply, str):
+        return len(reply)
+    if isinstance(reply, list):
+        return sum([len(item) if isinstance(item, str) else _reply_size(item) for item in reply])
+    if reply is None:
+        return 0
+
+    return len(str(reply))
+
+
+redis_connection_pool = redis.BlockingConnectionPool(
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_CONNECTION_TIMEOUT,
+    connection_class=InstrumentedConnection,
+    **REDIS_CONNECTION_SETTINGS
+)
+redis_client = redis.StrictRedis(connection_pool=redis_connection_pool)
+
+# Reserved player id for the server-side AI opponent. Generated player ids are 16 characters long, so it can't clash.
+AI_PLAYER_ID = 'ai'
+
+# How many times `update_game()` re-reads and retries when another client changed the game under it
+MAX_UPDATE_ATTEMPTS = 32
+
+# Per-worker cache of decoded games. Writes announce new revisions on `GAME_UPDATES_CHANNEL` so every worker drops
+# stale entries; see `start_cache_invalidation_listener()`.
+GAME_CACHE_ENABLED = True
+GAME_CACHE_SIZE = 1024
+GAME_UPDATES_CHANNEL = 'game-updates'
+
+game_cache = GameCache(max_size=GAME_CACHE_SIZE, enabled=GAME_CACHE_ENABLED)
+registry.callback(
+    'connectfour_game_cache_entries', "Games in this worker's game cache.", lambda: game_cache.stats()["size"],
+)
+registry.callback(
+    'connectfour_game_cache_events_total', "Game cache lookups and removals.",
+    lambda: dict(((event,), count) for event, count in game_cache.stats().iteritems() if event != 'size'),
+    type_name='counter', label_names=['event'],
+)
+
+# Seconds a game's keys live after its last write. Every write pushes the expiry back, so only abandoned games expire;
+# `sweeper.py` reclaims games everyone left well before that.
+GAME_TTL = 24 * 60 * 60
+
+# Games written before the hash encoding were pickled under their bare game id. Reading those means unpickling data
+# from Redis, so turn this off once every game has been migrated.
+MIGRATE_LEGACY_GAMES = True
+
+
+### Encoding ###
+#
+# Each game is a Redis hash under `game:<game_id>` so single fields can change in place:
+#
+#   v                 encoding version
+#   rev               revision, incremented by every write
+#   board             both players' bitboards, packed big-endian (see `encode_board()`)
+#   turn              position of the player whose turn it is
+#   seq               number of board changes (moves and restarts) so far, for ordering move broadcasts
+#   last              column of the last disc played, empty before the first move
+#   winner            winning position, 0 for a draw or empty while the game is on
+#   width             board variant: number of columns, rows and discs in a row that win. Games from before
+#   height            variants don't have these fields and are standard 7x6 connect four games.
+#   connect
+#   pos:<player_id>   the player's position
+#   conn:<player_id>  the player's open socket connections
+
+ENCODING_VERSION = '1'
+GAME_KEY_PREFIX = 'game:'
+PLAYER_POSITION_PREFIX = 'pos:'
+OPEN_CONNECTIONS_PREFIX = 'conn:'
+
+# Every board change is also appended to the game's move log, a list whose entry n - 1 is the change with seq n:
+#   <position>:<column>  a disc played by the player in `position`
+#   restart              the board was cleared
+# The snapshots hash maps a seq to the packed board after that change. One is taken every `SNAPSHOT_INTERVAL`
+# changes, so replaying any point of a game reads at most that many log entries. Restarts leave an empty board and
+# aren't snapshotted. Games migrated from the legacy format start at seq 0 with a snapshot of their board.
+MOVE_LOG_PREFIX = 'moves:'
+SNAPSHOTS_PREFIX = 'snapshots:'
+SNAPSHOT_INTERVAL = 16
+RESTART_EVENT = 'restart'
+
+# Log entries fetched per round trip when streaming a game's history
+HISTORY_PAGE_SIZE = 256
+
+# Marks ids that a game was created under from a new game token, so the token can't create the game again once it's
+# deleted. The marker lives `GAME_TTL` from the creation, longer than the token is valid.
+NEW_GAME_USED_PREFIX = 'new-game-used:'
+
+
+def game_key(game_id):
+    return GAME_KEY_PREFIX + game_id
+
+
+def move_log_key(game_id):
+    return MOVE_LOG_PREFIX + game_id
+
+
+def snapshots_key(game_id):
+    return SNAPSHOTS_PREFIX + game_id
+
+
+def new_game_used_key(game_id):
+    return NEW_GAME_USED_PREFIX + game_id
+
+
+def game_keys(game_id):
+    """All of a game's keys, in the order scripts take them: game hash, move log, snapshots."""
+    return [game_key(game_id), move_log_key(game_id), snapshots_key(game_id)]
+
+
+def encode_board(board):
+    # Bytes needed for one player's bitboard
+    bitboard_size = (board.width * (board.height + 1) + 7) // 8
+    return ''.join(
+        binascii.unhexlify('%0*x' % (2 * bitboard_size, bitboard)) for bitboard in board.bitboards
+    )
+
+
+def decode_board(data, variant=STANDARD_VARIANT):
+    bitboard_size = len(data) // 2
+    player_1_bitboard = int(binascii.hexlify(data[:bitboard_size]), 16)
+    player_2_bitboard = int(binascii.hexlify(data[bitboard_size:]), 16)
+    return Board.from_bitboards(player_1_bitboard, player_2_bitboard, *variant)
+
+
+def _variant_from_fields(fields):
+    if fields.get('width') is None:
+        return STANDARD_VARIANT
+
+    return BoardVariant(int(fields['width']), int(fields['height']), int(fields['connect']))
+
+
+@serialize_seconds.timed('encode_game')
+def encode_game(game):
+    """Convert a game data dictionary to the fields of its Redis hash."""
+    variant = game.get("variant", STANDARD_VARIANT)
+    fields = {
+        'v': ENCODING_VERSION,
+        'rev': game.get("revision", 1),
+        'seq': game.get("seq", 0),
+        'last': '' if game.get("last_move") is None else game["last_move"][1],
+        'board': encode_board(Board.from_trusted(game["grid"], *variant)),
+        'turn': game["position_with_turn"],
+        'winner': '' if game["winner"] is None else game["winner"],
+        'width': variant.width,
+        'height': variant.height,
+        'connect': variant.connect,
+    }
+    for player_id, position in game["player_positions"].iteritems():
+        fields[PLAYER_POSITION_PREFIX + player_id] = position
+    for player_id, open_connections in game["player_open_connections"].iteritems():
+        fields[OPEN_CONNECTIONS_PREFIX + player_id] = open_connections
+
+    return fields
+
+
+@serialize_seconds.timed('decode_game')
+def decode_game(game_id, fields):
+    """Convert the fields of a game's Redis hash to the game data dictionary."""
+    variant = _variant_from_fields(fields)
+    grid = decode_board(fields['board'], variant).grid
+    last_move = None
+    if fields.get('last', '') != '':
+        # The last disc played is the top one in its column
+        column_index = int(fields['last'])
+        row_index = next(row_index for row_index, row in enumerate(grid) if row[column_index])
+        last_move = (row_index, column_index)
+
+    player_positions = {}
+    player_open_connections = {}
+    for field, value in fields.iteritems():
+        if field.startswith(PLAYER_POSITION_PREFIX):
+            player_positions[field[len(PLAYER_POSITION_PREFIX):]] = int(value)
+        elif field.startswith(OPEN_CONNECTIONS_PREFIX):
+            player_open_connections[field[len(OPEN_CONNECTIONS_PREFIX):]] = int(value)
+
+    return {
+        "game_id": game_id,
+        "revision": int(fields['rev']),
+        "variant": variant,
+        "seq": int(fields.get('seq', 0)),
+        "last_move": last_move,
+        "player_positions": player_positions,
+        "player_open_connections": player_open_connections,
+        "grid": grid,
+        "position_with_turn": int(fields['turn']),
+        "winner": int(fields['winner']) if fields['winner'] != '' else None,
+    }
+
+
+# One entry of a game's move log. `kind` is 'move' or `RESTART_EVENT`; restarts have no position or column.
+GameEvent = namedtuple('GameEvent', ['seq', 'kind', 'position', 'column_index'])
 
-def get_value(key):
-    pickled_value = redis_client.get(key)
-    if pickled_value is None:
-        return None
 
-    return cPickle.loads(pickled_value)
+def encode_move(position, column_index):
+    return '%d:%d' % (position, column_index)
+
+
+def decode_event(seq, entry):
+    """Convert a move log entry to a `GameEvent`."""
+    if entry == RESTART_EVENT:
+        return GameEvent(seq, RESTART_EVENT, None, None)
+
+    position, column_index = entry.split(':')
+    return GameEvent(seq, 'move', int(position), int(column_index))
+
+
+def _fields_from_reply(reply):
+    # Lua scripts return hashes as a flat [field, value, ...] list
+    return dict(zip(reply[::2], reply[1::2]))
+
+
+### Scripts ###
+#
+# Every mutation runs as one server-side script, so it's atomic and costs a single round trip. Scripts take the keys
+# from `game_keys()`, return nil when the game doesn't exist and bump `rev` whenever they change something.
+
+# Push back the expiry of the game's keys
+_REFRESH_EXPIRY = """
+for i = 1, #KEYS do
+    redis.call('EXPIRE', KEYS[i], %d)
+end
+""" % GAME_TTL
+
+# Bump the game's revision, announce it to every worker's game cache and push back the game's expiry
+_BUMP_REVISION = """
+local revision = redis.call('HINCRBY', KEYS[1], 'rev', 1)
+redis.call('PUBLISH', '%s', KEYS[1] .. ' ' .. revision)
+""" % GAME_UPDATES_CHANNEL + _REFRESH_EXPIRY
+
+add_connection_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local open_connections = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+""" + _BUMP_REVISION + """
+return open_connections
+""")
+
+remove_connection_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') < 1 then
+    return -1
+end
+local open_connections = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+""" + _BUMP_REVISION + """
+return open_connections
+""")
+
+# ARGV: position field, connections field, position field prefix. Returns the new position, -1 if the game is full or
+# -2 if the player already joined.
+add_player_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return -2
+end
+local fields = redis.call('HGETALL', KEYS[1])
+local positions = {}
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, #ARGV[3]) == ARGV[3] then
+        table.insert(positions, fields[i + 1])
+    end
+end
+if #positions >= 2 then
+    return -1
+end
+local position = 1
+if #positions == 1 and positions[1] == '1' then
+    position = 2
+end
+redis.call('HSET', KEYS[1], ARGV[1], position)
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+""" + _BUMP_REVISION + """
+return position
+""")
+
+# ARGV: position field, connections field. Returns 1, or -1 if the player isn't in the game.
+remove_player_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 or redis.call('HEXISTS', KEYS[1], ARGV[2]) == 0 then
+    return -1
+end
+redis.call('HDEL', KEYS[1], ARGV[1], ARGV[2])
+""" + _BUMP_REVISION + """
+return 1
+""")
+
+# ARGV: position field, connections field. Closes one of the player's connections and removes the player when it was
+# the last one. Returns the player's remaining connections, or -1 if the player isn't in the game.
+disconnect_player_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local open_connections = tonumber(redis.call('HGET', KEYS[1], ARGV[2]) or '0')
+if open_connections > 1 then
+    open_connections = redis.call('HINCRBY', KEYS[1], ARGV[2], -1)
+else
+    redis.call('HDEL', KEYS[1], ARGV[1], ARGV[2])
+    open_connections = 0
+end
+""" + _BUMP_REVISION + """
+return open_connections
+""")
+
+# KEYS: the game's keys, optionally followed by its new game marker. ARGV: field/value pairs. Writes a new game unless
+# a game with its id already exists or, given the marker, was created before. Returns 1 if the game was created,
+# otherwise 0.
+create_game_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if KEYS[4] and not redis.call('SET', KEYS[4], 1, 'NX') then
+    return 0
+end
+redis.call('HMSET', KEYS[1], unpack(ARGV))
+""" + _REFRESH_EXPIRY + """
+return 1
+""")
+
+# ARGV: restart event. Returns the game's fields, or an empty list if the game hasn't ended. An empty board of any
+# variant is all zero bytes, as long as the board it replaces.
+restart_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if redis.call('HGET', KEYS[1], 'winner') == '' then
+    return {}
+end
+local board = string.rep(string.char(0), #redis.call('HGET', KEYS[1], 'board'))
+redis.call('HMSET', KEYS[1], 'board', board, 'turn', 1, 'winner', '', 'last', '')
+redis.call('HINCRBY', KEYS[1], 'seq', 1)
+redis.call('RPUSH', KEYS[2], ARGV[1])
+""" + _BUMP_REVISION + """
+return redis.call('HGETALL', KEYS[1])
+""")
+
+# ARGV: expected revision, move log entry (empty for none), snapshot interval, then field/value pairs. Writes the
+# fields only if the revision still matches and returns the new revision, otherwise nil. A log entry is appended along
+# with the fields, and the board is snapshotted every interval changes.
+compare_and_set_script = redis_client.register_script("""
+if redis.call('HGET', KEYS[1], 'rev') ~= ARGV[1] then
+    return false
+end
+redis.call('HMSET', KEYS[1], unpack(ARGV, 4))
+if ARGV[2] ~= '' then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    local seq = redis.call('HGET', KEYS[1], 'seq')
+    if tonumber(seq) % tonumber(ARGV[3]) == 0 then
+        redis.call('HSET', KEYS[3], seq, redis.call('HGET', KEYS[1], 'board'))
+    end
+end
+""" + _BUMP_REVISION + """
+return revision
+""")
+
+# KEYS: the game's keys, then its legacy key. ARGV: field/value pairs. Writes the hash, snapshots its board as the
+# start of the move log and drops the legacy key, unless another client migrated the game first.
+migrate_game_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HMSET', KEYS[1], unpack(ARGV))
+redis.call('HSET', KEYS[3], redis.call('HGET', KEYS[1], 'seq'), redis.call('HGET', KEYS[1], 'board'))
+redis.call('DEL', KEYS[4])
+""" + _REFRESH_EXPIRY + """
+return 1
+""")
+
+# ARGV: game TTL, minimum idle seconds, connections field prefix, AI connections field. Deletes the game if none of
+# its human players has an open connection and it hasn't been written for the minimum idle time. Returns the
+# number of keys deleted and an estimate of the bytes of data they held: the hash is counted exactly, but the move log
+# and snapshots aren't read, only their lengths times the size of their newest entry and of the board.
+sweep_game_script = redis_client.register_script("""
+local fields = redis.call('HGETALL', KEYS[1])
+if #fields == 0 then
+    return {0, 0}
+end
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, #ARGV[3]) == ARGV[3] and fields[i] ~= ARGV[4] and tonumber(fields[i + 1]) > 0 then
+        return {0, 0}
+    end
+end
+local ttl = redis.call('TTL', KEYS[1])
+if ttl >= 0 and tonumber(ARGV[1]) - ttl < tonumber(ARGV[2]) then
+    return {0, 0}
+end
+local size = 0
+local board_size = 0
+for i = 1, #fields, 2 do
+    size = size + #fields[i] + #fields[i + 1]
+    if fields[i] == 'board' then
+        board_size = #fields[i + 1]
+    end
+end
+local newest = redis.call('LINDEX', KEYS[2], -1)
+if newest then
+    size = size + redis.call('LLEN', KEYS[2]) * #newest
+end
+size = size + redis.call('HLEN', KEYS[3]) * board_size
+-- Workers still caching the game drop it when they see a newer revision
+local revision = tonumber(redis.call('HGET', KEYS[1], 'rev') or '0') + 1
+redis.call('PUBLISH', '%s', KEYS[1] .. ' ' .. revision)
+return {redis.call('DEL', unpack(KEYS)), size}
+""" % GAME_UPDATES_CHANNEL)
 
 
 ### Exceptions ###
@@ -42,21 +488,275 @@ class OutOfTurnError(GameError):
     pass
 
 
+class GameNotFoundError(GameError):
+    pass
+
+
+class ConcurrentUpdateError(GameError):
+    pass
+
+
+class StaleMoveError(GameError):
+    pass
+
+
+def start_cache_invalidation_listener():
+    """Subscribe this worker's game cache to revision announcements in a background thread."""
+    return start_invalidation_listener(redis_client, GAME_UPDATES_CHANNEL, game_cache, key_prefix=GAME_KEY_PREFIX)
+
+
+@operation('load_game')
+def load_game(game_id, use_cache=True, migrate=True):
+    """Read and decode a game, migrating it from the legacy pickle format if needed.
+
+    Args:
+        game_id (str): uuid of the game
+        use_cache (bool): whether the game may come from this worker's game cache
+        migrate (bool): whether a game still in the legacy format is migrated. If False, it's treated as missing and
+            nothing is written.
+
+    Returns:
+        The game's data dictionary if it exists, otherwise None
+    """
+    if game_id is None:
+        return None
+
+    if use_cache:
+        game = game_cache.get(game_id)
+        if game is not None:
+            return game
+
+    fields = redis_client.hgetall(game_key(game_id))
+    if not fields and migrate and MIGRATE_LEGACY_GAMES:
+        fields = _migrate_legacy_game(game_id)
+    if not fields:
+        return None
+
+    game = decode_game(game_id, fields)
+    game_cache.put(game)
+
+    return game
+
+
+def _migrate_legacy_game(game_id):
+    pickled_game = redis_client.get(game_id)
+    if pickled_game is None:
+        return None
+
+    with serialize_seconds.time('unpickle_game'):
+        game = cPickle.loads(pickled_game)
+    migrate_game_script(keys=game_keys(game_id) + [game_id], args=_flatten(encode_game(game)))
+
+    return redis_client.hgetall(game_key(game_id))
+
+
+def _flatten(fields):
+    return [item for field_and_value in fields.iteritems() for item in field_and_value]
+
+
+def _check_found(game_id, result):
+    if result is None:
+        raise GameNotFoundError("Game %s doesn't exist" % game_id)
+
+    return result
+
+
+def update_game(game_id, update, game=None):
+    """Atomically read, modify and write a game's board, turn and winner.
+
+    The changed fields are written with a server-side compare-and-set on the game's revision, so they only land if
+    nobody else wrote the game since we read it. Otherwise `update` runs again on the latest state.
+
+    Args:
+        game_id (str): uuid of the game
+        update (function): called with the game data dictionary, which it mutates in place. Exceptions raised by
+            `update` abort the update without writing anything. If it returns a move log entry, the entry is
+            appended to the game's move log as part of the same write.
+        game (dict): the game's data dictionary if the caller already loaded it. The first attempt starts from it
+            instead of reading the game again.
+
+    Returns:
+        The latest game data dictionary
+
+    Raises:
+        GameNotFoundError: if the game doesn't exist
+        ConcurrentUpdateError: if the game kept changing under us for `MAX_UPDATE_ATTEMPTS` attempts
+    """
+    for attempt in xrange(MAX_UPDATE_ATTEMPTS):
+        # A cached or preloaded game may be stale; the compare-and-set catches that and we retry from Redis
+        if attempt == 0 and game is not None:
+            game = copy_game(game)
+        else:
+            game = _check_found(game_id, load_game(game_id, use_cache=attempt == 0))
+        log_entry = update(game)
+
+        fields = encode_game(game)
+        changed_fields = dict((field, fields[field]) for field in ('board', 'turn', 'winner', 'seq', 'last'))
+        revision = compare_and_set_script(
+            keys=game_keys(game_id),
+            args=[game["revision"], log_entry or '', SNAPSHOT_INTERVAL] + _flatten(changed_fields),
+        )
+        if revision is not None:
+            game["revision"] = revision
+            game_cache.put(game)
+            return game
+
+    raise ConcurrentUpdateError("Gave up updating game %s after %d attempts" % (game_id, MAX_UPDATE_ATTEMPTS))
+
+
+class GameUnitOfWork(object):
+    """Reads and writes against one game for the span of a request or socket event.
+
+    The game is loaded at most once, and queued writes go to Redis together in a single pipeline when `execute()` is
+    called, optionally followed by a read of the updated game in the same round trip.
+
+        work = GameUnitOfWork(game_id)
+        if work.game:
+            work.add_player_connection(player_id)
+            open_connections, = work.execute()
+    """
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self._game = None
+        self._loaded = False
+        self._commands = []
+
+    @property
+    def game(self):
+        """The game's data dictionary, or None if it doesn't exist."""
+        if not self._loaded:
+            self._game = load_game(self.game_id)
+            self._loaded = True
+
+        return self._game
+
+    def add_player(self, player_id):
+        def check(position):
+            assert position != -1, "This game is full"
+            assert position != -2, "This player has already joined the game"
+            return position
+
+        self._queue('add_player', add_player_script, [
+            PLAYER_POSITION_PREFIX + player_id, OPEN_CONNECTIONS_PREFIX + player_id, PLAYER_POSITION_PREFIX,
+        ], check)
+
+    def remove_player(self, player_id):
+        def check(result):
+            assert result != -1, "Player not in game"
+
+        self._queue('remove_player', remove_player_script, [
+            PLAYER_POSITION_PREFIX + player_id, OPEN_CONNECTIONS_PREFIX + player_id,
+        ], check)
+
+    def add_player_connection(self, player_id):
+        self._queue('add_player_connection', add_connection_script, [
+            OPEN_CONNECTIONS_PREFIX + player_id,
+        ], lambda open_connections: open_connections)
+
+    def remove_player_connection(self, player_id):
+        def check(open_connections):
+            assert open_connections != -1, "Player has no open connections"
+            return open_connections
+
+        self._queue('remove_player_connection', remove_connection_script, [OPEN_CONNECTIONS_PREFIX + player_id], check)
+
+    def disconnect_player(self, player_id):
+        def check(open_connections):
+            assert open_connections != -1, "Player not in game"
+            return open_connections
+
+        self._queue('disconnect_player', disconnect_player_script, [
+            PLAYER_POSITION_PREFIX + player_id, OPEN_CONNECTIONS_PREFIX + player_id,
+        ], check)
+
+    def restart(self):
+        def check(reply):
+            assert reply, "The game hasn't ended"
+            game = decode_game(self.game_id, _fields_from_reply(reply))
+            self._set_game(game)
+            return game
+
+        self._queue('restart', restart_script, [RESTART_EVENT], check)
+
+    def execute(self, reload=False):
+        """Send the queued writes to Redis in one round trip.
+
+        Args:
+            reload (bool): also read the updated game, which then becomes `game`
+
+        Returns:
+            the result of each queued write, in order
+
+        Raises:
+            GameNotFoundError: if the game doesn't exist
+        """
+        commands = self._commands
+        self._commands = []
+        key = game_key(self.game_id)
+
+        pipeline = redis_client.pipeline(transaction=False)
+        for _, script, keys, args, _ in commands:
+            pipeline.evalsha(script.sha, len(keys), *(keys + args))
+        if reload:
+            pipeline.hgetall(key)
+
+        # Redis traffic is attributed to the queued writes, e.g. "add_player" or "disconnect_player"
+        results = []
+        with operation('+'.join(command[0] for command in commands) or 'load_game'):
+            replies = pipeline.execute(raise_on_error=False)
+            for (_, script, keys, args, check), reply in zip(commands, replies):
+                if isinstance(reply, redis.exceptions.NoScriptError):
+                    # Redis lost its script cache (e.g. it restarted), so this command didn't run. Calling the script
+                    # directly loads it and runs it again.
+                    reply = script(keys=keys, args=args)
+                elif isinstance(reply, Exception):
+                    raise reply
+
+                results.append(check(_check_found(self.game_id, reply)))
+
+        if commands:
+            game_cache.invalidate(self.game_id)
+            self._loaded = False
+        if reload:
+            fields = replies[-1]
+            self._set_game(decode_game(self.game_id, fields) if fields else None)
+
+        return results
+
+    def _queue(self, name, script, args, check):
+        self._commands.append((name, script, game_keys(self.game_id), args, check))
+
+    def reset(self):
+        """Forget the loaded game so the next access to `game` reads it again."""
+        self._loaded = False
+
+    def _set_game(self, game):
+        self._game = game
+        self._loaded = True
+        if game is not None:
+            game_cache.put(game)
+
+
 class GameStore(object):
     # Getters
     @staticmethod
-    def get(game_id):
+    @operation('get')
+    def get(game_id, migrate=True):
         """Get data dictionary for a game.
 
         Args:
             game_id (str): uuid of the game
+            migrate (bool): whether a game still in the legacy format is migrated, see `load_game()`. Readers that
+                mustn't write, like spectators, pass False.
 
         Returns:
             The game's data dictionary if it exists, otherwise None
         """
-        return get_value(game_id)
+        return load_game(game_id, migrate=migrate)
 
     @staticmethod
+    @operation('get_players')
     def get_players(game_id):
         """Get a dictionary of player ids.
 
@@ -66,10 +766,11 @@ class GameStore(object):
         Returns:
             a map from player id to player position integer
         """
-        game = get_value(game_id)
+        game = load_game(game_id)
         return game["player_positions"]
 
     @staticmethod
+    @operation('get_open_connections')
     def get_open_connections(game_id, player_id):
         """Check how many socket connections the player has open.
 
@@ -80,32 +781,69 @@ class GameStore(object):
         Returns:
             an integer count of how many open socket connections the player has
         """
-        game = get_value(game_id)
-        return game["player_open_connections"].get(player_id)
+        open_connections = redis_client.hget(game_key(game_id), OPEN_CONNECTIONS_PREFIX + player_id)
+        return int(open_connections) if open_connections is not None else None
 
     # Setters
     @staticmethod
-    def create():
+    def new_game_id():
+        """Generate an id for a game that hasn't been created yet."""
+        return ShortUUID().random(length=12)
+
+    @staticmethod
+    @operation('create')
+    def create(ai_opponent=False, game_id=None, player_id=None, variant=STANDARD_VARIANT, once=False,
+               opponent_id=None, open_connections=1):
         """Create a new game.
 
+        Args:
+            ai_opponent (bool): if True, the server's AI joins the game as player 2
+            game_id (str): uuid for the game, from `new_game_id()`. If a game with this id already exists, it's left
+                as is.
+            player_id (str): if given, this player joins the game as player 1
+            variant (BoardVariant): the board's dimensions and how many discs in a row win
+            once (bool): if True, the game isn't created if a game was ever created with this id this way before,
+                even if that game has been deleted since. For ids handed out in new game tokens.
+            opponent_id (str): if given, this player joins the game as player 2, in the same write as player 1
+            open_connections (int): how many open connections `player_id` and `opponent_id` start with
+
         Returns:
-            The new game's data dictionary
+            The new game's id
         """
-        new_game_id = ShortUUID().random(length=12)
+        assert not ai_opponent or variant == STANDARD_VARIANT, "The AI only plays the standard board"
+        assert not (ai_opponent and opponent_id), "The AI is already player 2"
+
+        new_game_id = game_id or GameStore.new_game_id()
         new_game = {
             "game_id": new_game_id,
+            "variant": variant,
             "player_positions": {},
             "player_open_connections": {},
-            "grid": Board().grid,
+            "grid": Board(None, *variant).grid,
             "position_with_turn": 1,
             "winner": None,
+            "seq": 0,
+            "last_move": None,
         }
-        # TODO(nikrad): add locking
-        set_value(new_game_id, new_game)
+        if ai_opponent:
+            new_game["player_positions"][AI_PLAYER_ID] = 2
+            new_game["player_open_connections"][AI_PLAYER_ID] = 1
+        if player_id:
+            new_game["player_positions"][player_id] = 1
+            new_game["player_open_connections"][player_id] = open_connections
+        if opponent_id:
+            new_game["player_positions"][opponent_id] = 2
+            new_game["player_open_connections"][opponent_id] = open_connections
+
+        keys = game_keys(new_game_id)
+        if once:
+            keys.append(new_game_used_key(new_game_id))
+        create_game_script(keys=keys, args=_flatten(encode_game(new_game)))
 
         return new_game_id
 
     @staticmethod
+    @operation('restart')
     def restart(game_id):
         """Restart a game after it ends.
 
@@ -115,27 +853,24 @@ class GameStore(object):
         Returns:
             The latest game data dictionary
         """
-        game = get_value(game_id)
-        assert game
-        assert game["winner"] is not None
-
-        game["grid"] = Board().grid
-        game["position_with_turn"] = 1
-        game["winner"] = None
-
-        # TODO(nikrad): add locking
-        set_value(game["game_id"], game)
+        work = GameUnitOfWork(game_id)
+        work.restart()
+        game, = work.execute()
 
         return game
 
     @staticmethod
-    def play_turn(game_id, player_id, column_index):
+    @operation('play_turn')
+    def play_turn(game_id, player_id, column_index, game=None, seq=None):
         """Play a Connect Four turn.
 
         Args:
             game_id (str): uuid of the game
             player_id (str): uuid of the player
             column_index (int): index of the grid column in which to drop a disc
+            game (dict): the game's data dictionary, if the caller already loaded it
+            seq (int): if given, only play the disc on the board as it was after board change `seq`, e.g. because
+                the move was chosen for that board
 
         Returns:
             The latest game data dictionary
@@ -144,35 +879,115 @@ class GameStore(object):
             OutOfTurnError: if it's not the player's turn
             GridColumnFullError: if the chosen grid column is already full
             GameOverError: if the game has finished
+            StaleMoveError: if the board changed since board change `seq`
+            ConcurrentUpdateError: if the game kept changing under us and the move couldn't be saved
         """
-        # TODO(nikrad): add locking
-        game = get_value(game_id)
-        if game["winner"] is not None:
-            raise GameOverError("The game has ended")
-
-        position = game["player_positions"].get(player_id)
-        assert position
-
-        if position != game["position_with_turn"]:
-            raise OutOfTurnError("It's not player %d's turn." % position)
-
-        board = Board(game["grid"])
-        last_move_row_index, last_move_column_index = board.drop_disc(column_index, DiscType(position))
-        winner = board.is_winning_disc(last_move_row_index, last_move_column_index)
-        if winner:
-            game["winner"] = winner
-        else:
-            if board.is_full():
-                game["winner"] = 0
+        def play(game):
+            if seq is not None and game["seq"] != seq:
+                raise StaleMoveError("Game %s changed since board change %d" % (game_id, seq))
+
+            if game["winner"] is not None:
+                raise GameOverError("The game has ended")
+
+            position = game["player_positions"].get(player_id)
+            assert position
+
+            if position != game["position_with_turn"]:
+                raise OutOfTurnError("It's not player %d's turn." % position)
+
+            board = Board.from_trusted(game["grid"], *game["variant"])
+            last_move_row_index, last_move_column_index = board.drop_disc(column_index, DiscType(position))
+            game["grid"] = board.grid
+            game["last_move"] = (last_move_row_index, last_move_column_index)
+            game["seq"] += 1
+            winner = board.is_winning_disc(last_move_row_index, last_move_column_index)
+            if winner:
+                game["winner"] = winner
             else:
-                next_position = 2 if game["position_with_turn"] == 1 else 1
-                game["position_with_turn"] = next_position
+                if board.is_full():
+                    game["winner"] = 0
+                else:
+                    next_position = 2 if game["position_with_turn"] == 1 else 1
+                    game["position_with_turn"] = next_position
 
-        set_value(game["game_id"], game)
+            return encode_move(position, last_move_column_index)
 
-        return game
+        return update_game(game_id, play, game=game)
 
     @staticmethod
+    def history(game_id, start=1):
+        """Stream a game's move log, oldest first.
+
+        Entries are fetched `HISTORY_PAGE_SIZE` at a time as the generator is consumed, so long-running games never
+        have to fit in memory.
+
+        Args:
+            game_id (str): uuid of the game
+            start (int): seq of the first event to yield
+
+        Returns:
+            A generator of `GameEvent`s
+        """
+        key = move_log_key(game_id)
+        index = start - 1
+        while True:
+            # A generator's body runs as the caller consumes it, so it's labelled here rather than by a decorator
+            with operation('history'):
+                entries = redis_client.lrange(key, index, index + HISTORY_PAGE_SIZE - 1)
+            for entry in entries:
+                index += 1
+                yield decode_event(index, entry)
+
+            if len(entries) < HISTORY_PAGE_SIZE:
+                return
+
+    @staticmethod
+    @operation('replay')
+    def replay(game_id, upto=None):
+        """Rebuild a game's board as it was after a given board change.
+
+        Starts from the latest snapshot at or before `upto` and plays the logged moves after it.
+
+        Args:
+            game_id (str): uuid of the game
+            upto (int): seq of the last change to apply, defaults to the latest one
+
+        Returns:
+            Board
+
+        Raises:
+            GameNotFoundError: if the game doesn't exist
+        """
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.exists(game_key(game_id))
+        pipeline.hmget(game_key(game_id), 'width', 'height', 'connect')
+        pipeline.llen(move_log_key(game_id))
+        game_exists, variant_fields, latest_seq = pipeline.execute()
+        if not game_exists:
+            raise GameNotFoundError("Game %s not found" % game_id)
+        variant = _variant_from_fields(dict(zip(('width', 'height', 'connect'), variant_fields)))
+
+        if upto is None:
+            upto = latest_seq
+        assert 0 <= upto <= latest_seq, "Game %s has no board change %d" % (game_id, upto)
+
+        snapshot_seq = upto - upto % SNAPSHOT_INTERVAL
+        snapshot = redis_client.hget(snapshots_key(game_id), snapshot_seq)
+        board = decode_board(snapshot, variant) if snapshot else Board(None, *variant)
+
+        for event in GameStore.history(game_id, start=snapshot_seq + 1):
+            if event.seq > upto:
+                break
+
+            if event.kind == RESTART_EVENT:
+                board = Board(None, *variant)
+            else:
+                board.drop_disc(event.column_index, DiscType(event.position))
+
+        return board
+
+    @staticmethod
+    @operation('add_player_connection')
     def add_player_connection(game_id, player_id):
         """Increment a player's connection count.
 
@@ -183,17 +998,14 @@ class GameStore(object):
         Returns:
             the player's position integer
         """
-        # TODO(nikrad): add locking
-        game = get_value(game_id)
-        if player_id not in game["player_open_connections"]:
-            game["player_open_connections"][player_id] = 1
-        else:
-            game["player_open_connections"][player_id] += 1
-        set_value(game["game_id"], game)
+        work = GameUnitOfWork(game_id)
+        work.add_player_connection(player_id)
+        open_connections, = work.execute()
 
-        return game["player_open_connections"][player_id]
+        return open_connections
 
     @staticmethod
+    @operation('remove_player_connection')
     def remove_player_connection(game_id, player_id):
         """Decrement a player's connection count.
 
@@ -204,17 +1016,32 @@ class GameStore(object):
         Returns:
             the player's position integer
         """
-        # TODO(nikrad): add locking
-        game = get_value(game_id)
-        open_connections = game["player_open_connections"].get(player_id)
-        assert open_connections, "Player has no open connections"
+        work = GameUnitOfWork(game_id)
+        work.remove_player_connection(player_id)
+        open_connections, = work.execute()
+
+        return open_connections
 
-        game["player_open_connections"][player_id] -= 1
-        set_value(game["game_id"], game)
+    @staticmethod
+    @operation('disconnect_player')
+    def disconnect_player(game_id, player_id):
+        """Close one of a player's connections, removing the player from the game if it was the last one.
+
+        Args:
+            game_id (str): uuid of the game
+            player_id (str): uuid of the player
+
+        Returns:
+            the player's remaining connection count; 0 means the player left the game
+        """
+        work = GameUnitOfWork(game_id)
+        work.disconnect_player(player_id)
+        open_connections, = work.execute()
 
-        return game["player_open_connections"][player_id]
+        return open_connections
 
     @staticmethod
+    @operation('add_player')
     def add_player(game_id, player_id):
         """Add a player to the game.
 
@@ -225,23 +1052,14 @@ class GameStore(object):
         Returns:
             the player's position integer
         """
-        # TODO(nikrad): add locking
-        game = get_value(game_id)
-        assert len(game["player_positions"]) < 2, "This game is full"
-        assert player_id not in game["player_positions"], "This player has already joined the game"
-
-        position = 2 if game["player_positions"].values() == [1] else 1
-        game["player_positions"][player_id] = position
-        if player_id not in game["player_open_connections"]:
-            game["player_open_connections"][player_id] = 1
-        else:
-            game["player_open_connections"][player_id] += 1
-
-        set_value(game["game_id"], game)
+        work = GameUnitOfWork(game_id)
+        work.add_player(player_id)
+        position, = work.execute()
 
         return position
 
     @staticmethod
+    @operation('remove_player')
     def remove_player(game_id, player_id):
         """Remove a player from the game.
 
@@ -249,11 +1067,6 @@ class GameStore(object):
             game_id (str): uuid of the game
             player_id (str): uuid of the player
         """
-        game = get_value(game_id)
-        assert player_id in game["player_positions"], "Player not in game"
-        assert player_id in game["player_open_connections"], "Missing player connection"
-
-        del game["player_open_connections"][player_id]
-        del game["player_positions"][player_id]
-
-        set_value(game_id, game)
\ No newline at end of file
+        work = GameUnitOfWork(game_id)
+        work.remove_player(player_id)
+        work.execute()
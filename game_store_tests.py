@@ -0,0 +1,411 @@
+import cPickle
+import threading
+import time
+import unittest
+
+import redis
+
+import game_store
+from board_model import (
+    Board,
+    BoardVariant,
+    DiscType,
+    GridColumnFullError,
+)
+from game_store import (
+    ConcurrentUpdateError,
+    GAME_TTL,
+    GameNotFoundError,
+    GameOverError,
+    GameStore,
+    GameUnitOfWork,
+    MAX_UPDATE_ATTEMPTS,
+    OPEN_CONNECTIONS_PREFIX,
+    OutOfTurnError,
+    StaleMoveError,
+    add_connection_script,
+    decode_board,
+    encode_board,
+    game_cache,
+    game_key,
+    game_keys,
+    move_log_key,
+    new_game_used_key,
+    redis_client,
+    snapshots_key,
+    start_cache_invalidation_listener,
+    update_game,
+)
+from metrics import (
+    redis_commands,
+    redis_round_trips,
+    redis_sent_bytes,
+)
+
+
+class GameStoreTests(unittest.TestCase):
+    # These tests need the Redis server from `REDIS_CONNECTION_SETTINGS`
+    def setUp(self):
+        try:
+            redis_client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis isn't running")
+
+        self.game_id = GameStore.create()
+
+    def tearDown(self):
+        redis_client.delete(game_key(self.game_id), move_log_key(self.game_id), snapshots_key(self.game_id))
+
+    def test_play_turn(self):
+        self.assertEqual(GameStore.add_player(self.game_id, 'player-one'), 1)
+        self.assertEqual(GameStore.add_player(self.game_id, 'player-two'), 2)
+
+        game = GameStore.play_turn(self.game_id, 'player-one', 3)
+        self.assertEqual(game["grid"][5][3], 1)
+        self.assertEqual(game["position_with_turn"], 2)
+        self.assertEqual(GameStore.get(self.game_id), game)
+
+        with self.assertRaises(OutOfTurnError):
+            GameStore.play_turn(self.game_id, 'player-one', 3)
+
+        for column_index in (3, 3, 3, 3, 3):
+            player_id = 'player-two' if GameStore.get(self.game_id)["position_with_turn"] == 2 else 'player-one'
+            GameStore.play_turn(self.game_id, player_id, column_index)
+        with self.assertRaises(GridColumnFullError):
+            GameStore.play_turn(self.game_id, 'player-one', 3)
+
+        # Player 1 wins along the bottom row
+        for column_index in (0, 0, 1, 1, 2):
+            player_id = 'player-two' if GameStore.get(self.game_id)["position_with_turn"] == 2 else 'player-one'
+            game = GameStore.play_turn(self.game_id, player_id, column_index)
+        self.assertEqual(game["winner"], 1)
+        with self.assertRaises(GameOverError):
+            GameStore.play_turn(self.game_id, 'player-two', 4)
+
+        game = GameStore.restart(self.game_id)
+        self.assertIsNone(game["winner"])
+        self.assertEqual(game["position_with_turn"], 1)
+
+    def test_play_turn_for_board(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        GameStore.add_player(self.game_id, 'player-two')
+        GameStore.play_turn(self.game_id, 'player-one', 3)
+
+        # A move chosen for an earlier board isn't played
+        with self.assertRaises(StaleMoveError):
+            GameStore.play_turn(self.game_id, 'player-two', 4, seq=0)
+        self.assertEqual(GameStore.play_turn(self.game_id, 'player-two', 4, seq=1)["seq"], 2)
+
+    def test_missing_game(self):
+        with self.assertRaises(GameNotFoundError):
+            GameStore.add_player_connection('no-such-game', 'player-one')
+
+    def test_concurrent_updates(self):
+        GameStore.add_player(self.game_id, 'player-one')
+
+        def connect():
+            for _ in xrange(25):
+                GameStore.add_player_connection(self.game_id, 'player-one')
+
+        threads = [threading.Thread(target=connect) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # No increments were lost
+        self.assertEqual(GameStore.get_open_connections(self.game_id, 'player-one'), 101)
+
+    def test_update_conflicts(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        GameStore.add_player(self.game_id, 'player-two')
+        seen = []
+
+        def drop_in_column_4(game):
+            # Whoever's turn it is in the state `update_game` hands us drops a disc in column 4
+            seen.append(game["seq"])
+            board = Board.from_trusted(game["grid"], *game["variant"])
+            board.drop_disc(4, DiscType(game["position_with_turn"]))
+            game["grid"] = board.grid
+            game["seq"] += 1
+            game["position_with_turn"] = 3 - game["position_with_turn"]
+
+        # A move lands between our read and our write, so the write is refused and the update runs again on top of it
+        stale = GameStore.get(self.game_id)
+        GameStore.play_turn(self.game_id, 'player-one', 3)
+        game = update_game(self.game_id, drop_in_column_4, game=stale)
+        self.assertEqual(seen, [0, 1])
+        self.assertEqual(game["grid"][5][3], 1)
+        self.assertEqual(game["grid"][5][4], 2)
+        self.assertEqual(GameStore.get(self.game_id)["grid"], game["grid"])
+
+        # So does any other write, e.g. a connection count
+        del seen[:]
+        stale = GameStore.get(self.game_id)
+        GameStore.add_player_connection(self.game_id, 'player-one')
+        game = update_game(self.game_id, drop_in_column_4, game=stale)
+        self.assertEqual(seen, [2, 2])
+        self.assertEqual(game["grid"][4][4], 1)
+
+        # A game that changes under every attempt isn't written at all
+        del seen[:]
+
+        def drop_while_connecting(game):
+            drop_in_column_4(game)
+            GameStore.add_player_connection(self.game_id, 'player-two')
+
+        with self.assertRaises(ConcurrentUpdateError):
+            update_game(self.game_id, drop_while_connecting)
+        self.assertEqual(seen, [3] * MAX_UPDATE_ATTEMPTS)
+        self.assertEqual(GameStore.get(self.game_id)["grid"], game["grid"])
+
+    def test_field_level_storage(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        revision = GameStore.get(self.game_id)["revision"]
+
+        # Connection counts change in place and bump the revision
+        self.assertEqual(GameStore.add_player_connection(self.game_id, 'player-one'), 2)
+        self.assertEqual(redis_client.hget(game_key(self.game_id), 'conn:player-one'), '2')
+        self.assertEqual(GameStore.remove_player_connection(self.game_id, 'player-one'), 1)
+        self.assertEqual(GameStore.get(self.game_id)["revision"], revision + 2)
+
+        GameStore.remove_player(self.game_id, 'player-one')
+        game = GameStore.get(self.game_id)
+        self.assertEqual(game["player_positions"], {})
+        self.assertEqual(game["player_open_connections"], {})
+
+    def test_board_encoding(self):
+        board = Board()
+        for index, column_index in enumerate((3, 3, 4, 0, 6, 6, 6)):
+            board.drop_disc(column_index, DiscType.PLAYER_1 if index % 2 == 0 else DiscType.PLAYER_2)
+
+        data = encode_board(board)
+        self.assertEqual(len(data), 14)
+        self.assertEqual(decode_board(data).grid, board.grid)
+
+    def test_legacy_migration(self):
+        legacy_game_id = 'legacygame01'
+        grid = Board().grid
+        grid[5][3] = 1
+        redis_client.set(legacy_game_id, cPickle.dumps({
+            "game_id": legacy_game_id,
+            "player_positions": {'player-one': 1},
+            "player_open_connections": {'player-one': 2},
+            "grid": grid,
+            "position_with_turn": 2,
+            "winner": None,
+        }))
+
+        try:
+            # Readers that mustn't write see no game until it's migrated
+            self.assertIsNone(GameStore.get(legacy_game_id, migrate=False))
+            self.assertIsNotNone(redis_client.get(legacy_game_id))
+
+            game = GameStore.get(legacy_game_id)
+            self.assertEqual(game["grid"], grid)
+            self.assertEqual(game["player_positions"], {'player-one': 1})
+            self.assertEqual(game["player_open_connections"], {'player-one': 2})
+            self.assertEqual(game["position_with_turn"], 2)
+
+            # The pickled key is replaced by the hash
+            self.assertIsNone(redis_client.get(legacy_game_id))
+            self.assertEqual(GameStore.add_player_connection(legacy_game_id, 'player-one'), 3)
+            self.assertEqual(GameStore.replay(legacy_game_id).grid, grid)
+        finally:
+            redis_client.delete(legacy_game_id, game_key(legacy_game_id), snapshots_key(legacy_game_id))
+
+    def test_cache_invalidation(self):
+        start_cache_invalidation_listener()
+        for _ in xrange(50):
+            if game_cache.connected:
+                break
+            time.sleep(0.01)
+
+        GameStore.add_player(self.game_id, 'player-one')
+        GameStore.get(self.game_id)
+        hits = game_cache.stats()["hits"]
+        game = GameStore.get(self.game_id)
+        self.assertEqual(game_cache.stats()["hits"], hits + 1)
+
+        # A write from another worker reaches us over pub/sub
+        add_connection_script(keys=[game_key(self.game_id)], args=[OPEN_CONNECTIONS_PREFIX + 'player-one'])
+        for _ in xrange(50):
+            if game_cache.get(self.game_id) is None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(GameStore.get(self.game_id)["revision"], game["revision"] + 1)
+        self.assertEqual(GameStore.get(self.game_id)["player_open_connections"]['player-one'], 2)
+
+    def test_unit_of_work(self):
+        work = GameUnitOfWork(self.game_id)
+        self.assertEqual(work.game["player_positions"], {})
+
+        work.add_player('player-one')
+        work.add_player('player-two')
+        work.add_player_connection('player-one')
+        self.assertEqual(work.execute(reload=True), [1, 2, 2])
+        self.assertEqual(work.game["player_positions"], {'player-one': 1, 'player-two': 2})
+
+        # Disconnecting closes connections until the last one, which removes the player
+        work.disconnect_player('player-one')
+        work.disconnect_player('player-one')
+        self.assertEqual(work.execute(), [1, 0])
+        self.assertEqual(GameStore.get(self.game_id)["player_positions"], {'player-two': 2})
+
+        # Queued commands are resent if Redis forgot the scripts
+        redis_client.script_flush()
+        work.add_player_connection('player-two')
+        self.assertEqual(work.execute(), [2])
+
+        work = GameUnitOfWork('no-such-game')
+        self.assertIsNone(work.game)
+        work.add_player_connection('player-one')
+        with self.assertRaises(GameNotFoundError):
+            work.execute()
+
+    def test_move_sequence(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        GameStore.add_player(self.game_id, 'player-two')
+        self.assertEqual(GameStore.get(self.game_id)["seq"], 0)
+        self.assertIsNone(GameStore.get(self.game_id)["last_move"])
+
+        for seq, (player_id, column_index) in enumerate((('player-one', 3), ('player-two', 3)), 1):
+            game = GameStore.play_turn(self.game_id, player_id, column_index)
+            self.assertEqual(game["seq"], seq)
+        self.assertEqual(game["last_move"], (4, 3))
+        self.assertEqual(GameStore.get(self.game_id)["last_move"], (4, 3))
+
+        # Connection changes don't touch the sequence
+        GameStore.add_player_connection(self.game_id, 'player-one')
+        self.assertEqual(GameStore.get(self.game_id)["seq"], 2)
+
+        redis_client.hset(game_key(self.game_id), 'winner', 1)
+        game = GameStore.restart(self.game_id)
+        self.assertEqual(game["seq"], 3)
+        self.assertIsNone(game["last_move"])
+
+    def test_replay(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        GameStore.add_player(self.game_id, 'player-two')
+        grids = [Board().grid]
+        # Two games won along the bottom row with a restart in between, then three rows of a third one
+        columns = [0, 0, 1, 1, 2, 2, 3, None, 6, 6, 5, 5, 4, 4, 3, None] + [0, 1, 2, 3, 4, 5, 6] * 3
+        for column_index in columns:
+            if column_index is None:
+                game = GameStore.restart(self.game_id)
+            else:
+                player_id = 'player-one' if GameStore.get(self.game_id)["position_with_turn"] == 1 else 'player-two'
+                game = GameStore.play_turn(self.game_id, player_id, column_index)
+            grids.append(game["grid"])
+
+        self.assertEqual(game["seq"], len(columns))
+        # Change 16 is a restart, which needs no snapshot
+        self.assertEqual(redis_client.hkeys(snapshots_key(self.game_id)), ['32'])
+        for seq, grid in enumerate(grids):
+            self.assertEqual(GameStore.replay(self.game_id, upto=seq).grid, grid)
+        self.assertEqual(GameStore.replay(self.game_id).grid, grids[-1])
+
+        # History pages through the log
+        page_size = game_store.HISTORY_PAGE_SIZE
+        game_store.HISTORY_PAGE_SIZE = 5
+        try:
+            events = list(GameStore.history(self.game_id))
+        finally:
+            game_store.HISTORY_PAGE_SIZE = page_size
+        self.assertEqual([event.seq for event in events], range(1, len(columns) + 1))
+        self.assertEqual([event.column_index for event in events], columns)
+        self.assertEqual((events[0].kind, events[0].position), ('move', 1))
+        self.assertEqual(events[7].kind, 'restart')
+
+        with self.assertRaises(GameNotFoundError):
+            GameStore.replay('no-such-game')
+
+    def test_create_with_first_player(self):
+        game_id = GameStore.new_game_id()
+        self.assertIsNone(GameStore.get(game_id))
+        try:
+            self.assertEqual(GameStore.create(game_id=game_id, player_id='player-one'), game_id)
+            game = GameStore.get(game_id)
+            self.assertEqual(game["player_positions"], {'player-one': 1})
+            self.assertEqual(game["player_open_connections"], {'player-one': 1})
+
+            # Creating it again, e.g. from the player's second tab, leaves it alone
+            GameStore.add_player(game_id, 'player-two')
+            GameStore.create(game_id=game_id, player_id='player-one')
+            self.assertEqual(GameStore.get(game_id)["player_positions"], {'player-one': 1, 'player-two': 2})
+        finally:
+            redis_client.delete(game_key(game_id))
+
+    def test_create_once(self):
+        game_id = GameStore.new_game_id()
+        try:
+            GameStore.create(game_id=game_id, player_id='player-one', once=True)
+            self.assertTrue(0 < redis_client.ttl(new_game_used_key(game_id)) <= GAME_TTL)
+
+            # A second tab connecting while the game exists finds it as it is
+            GameStore.add_player(game_id, 'player-two')
+            GameStore.create(game_id=game_id, player_id='player-one', once=True)
+            self.assertEqual(GameStore.get(game_id)["player_positions"], {'player-one': 1, 'player-two': 2})
+
+            # Once the game is deleted, e.g. by the sweeper, the same id doesn't bring it back
+            redis_client.delete(*game_keys(game_id))
+            GameStore.create(game_id=game_id, player_id='player-one', once=True)
+            self.assertFalse(redis_client.exists(game_key(game_id)))
+        finally:
+            redis_client.delete(game_key(game_id), new_game_used_key(game_id))
+
+    def test_variant(self):
+        game_id = GameStore.create(variant=BoardVariant(9, 6, 5))
+        try:
+            GameStore.add_player(game_id, 'player-one')
+            GameStore.add_player(game_id, 'player-two')
+            game = GameStore.get(game_id)
+            self.assertEqual(game["variant"], BoardVariant(9, 6, 5))
+            self.assertEqual(len(game["grid"]), 6)
+            self.assertEqual(len(game["grid"][0]), 9)
+
+            # Player one lines up five along the bottom row; four aren't enough
+            for column_index in xrange(4):
+                game = GameStore.play_turn(game_id, 'player-one', column_index)
+                game = GameStore.play_turn(game_id, 'player-two', column_index)
+            self.assertIsNone(game["winner"])
+            game = GameStore.play_turn(game_id, 'player-one', 8)
+            game = GameStore.play_turn(game_id, 'player-two', 8)
+            self.assertIsNone(game["winner"])
+            game = GameStore.play_turn(game_id, 'player-one', 4)
+            self.assertEqual(game["winner"], 1)
+            self.assertEqual(GameStore.get(game_id), game)
+
+            board = GameStore.replay(game_id)
+            self.assertEqual(board.variant, BoardVariant(9, 6, 5))
+            self.assertEqual(board.grid, game["grid"])
+
+            # Restarting clears the board without changing its size
+            game = GameStore.restart(game_id)
+            self.assertEqual(game["grid"], Board(width=9, height=6, connect=5).grid)
+            self.assertEqual(GameStore.replay(game_id).grid, game["grid"])
+        finally:
+            redis_client.delete(game_key(game_id), move_log_key(game_id), snapshots_key(game_id))
+
+        # The AI only plays the standard board
+        with self.assertRaises(AssertionError):
+            GameStore.create(ai_opponent=True, variant=BoardVariant(8, 7, 4))
+
+    def test_redis_metrics(self):
+        GameStore.add_player(self.game_id, 'player-one')
+        round_trips = redis_round_trips.value(('play_turn',))
+        sent_bytes = redis_sent_bytes.value(('play_turn',))
+
+        GameStore.play_turn(self.game_id, 'player-one', 3)
+        self.assertGreaterEqual(redis_round_trips.value(('play_turn',)), round_trips + 1)
+        self.assertGreater(redis_sent_bytes.value(('play_turn',)), sent_bytes)
+
+        # A unit of work is attributed to its queued writes, and its pipeline is a single round trip
+        round_trips = redis_round_trips.value(('add_player+add_player_connection',))
+        commands = redis_commands.value(('add_player+add_player_connection',))
+        work = GameUnitOfWork(self.game_id)
+        work.add_player('player-two')
+        work.add_player_connection('player-one')
+        work.execute(reload=True)
+        self.assertEqual(redis_round_trips.value(('add_player+add_player_connection',)), round_trips + 1)
+        self.assertEqual(redis_commands.value(('add_player+add_player_connection',)), commands + 3)
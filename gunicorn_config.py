@@ -0,0 +1,23 @@
+"""Gunicorn settings for running the app as several processes.
+
+    gunicorn -c gunicorn_config.py --bind 127.0.0.1:5001 app:app
+
+A Socket.IO session lives in the process that accepted it, so each gunicorn instance runs a single gevent worker and
+the app scales out by running more instances, on more ports or hosts. Put them behind a load balancer that keeps
+each client on one instance (see nginx_sticky.conf). The instances share Redis for game state and for relaying room
+broadcasts, so players of the same game can be connected to different instances. `run_workers.sh` starts a few of
+them locally.
+"""
+import os
+
+
+# One worker per instance: gunicorn's own load balancing isn't sticky, and long-polling clients must keep talking to
+# the process that holds their session
+workers = 1
+worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+worker_connections = 1000
+
+# Relay room broadcasts between instances. Override to point at a shared Redis when instances run on several hosts.
+raw_env = [
+    'SOCKETIO_MESSAGE_QUEUE=%s' % os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0'),
+]
@@ -1,25 +1,266 @@
 import simplejson as json
 
-from game_store import GameStore
+from flask import (
+    current_app,
+    g,
+    url_for,
+)
+from itsdangerous import (
+    BadData,
+    URLSafeTimedSerializer,
+)
+
+from board_model import (
+    STANDARD_VARIANT,
+    Board,
+    BoardVariant,
+    DiscType,
+)
+from broadcast import GameStateCache
+from game_store import (
+    AI_PLAYER_ID,
+    GameStore,
+    GameUnitOfWork,
+)
+from metrics import serialize_seconds
+from opening_book import open_default_book
+from solver import (
+    WIN_THRESHOLD,
+    Solver,
+)
+
+
+# Time the AI may spend searching for a reply
+AI_TIME_BUDGET = 0.05
+
+# Time an AI reply may take, waiting for a job worker included
+AI_JOB_TIMEOUT = 2.0
+
+# Seconds a new game link stays valid before its first player connects
+NEW_GAME_TOKEN_MAX_AGE = 24 * 60 * 60
+
+# Seconds a matched player has to open their game. The sweeper reclaims games nobody opened after about as long.
+MATCH_TOKEN_MAX_AGE = 10 * 60
+
+# Searches run in job worker processes (see `jobs.py`), which inherit this solver when they're forked; each keeps its
+# copy's transposition table warm between moves. The opening book is optional; build it with `python opening_book.py`.
+ai_solver = Solver(book=open_default_book())
 
 
 def json_game_state(game):
     """Convert game dictionary to JSON object with game state to send to clients.
 
+    Each revision of a game is only encoded once, however many players and spectators it's sent to.
+
     Args:
         game (dict): the game data dictionary
 
     Returns:
         JSON object with game state for clients
     """
+    return game_states.encode(game)
+
+
+@serialize_seconds.timed('json_game_state')
+def _encode_game_state(game):
     return json.dumps(dict(
         grid=game["grid"],
         position_with_turn=game["position_with_turn"],
         player_count=len(game["player_positions"]),
         winner=game["winner"],
+        seq=game["seq"],
+        connect=game["variant"].connect,
     ))
 
 
+# Encoded states of recently sent games, by revision
+game_states = GameStateCache(_encode_game_state)
+
+
+@serialize_seconds.timed('json_move_delta')
+def json_move_delta(game):
+    """Convert a game that just had a disc played to the JSON move delta to send to clients.
+
+    Clients that are up to date with `seq - 1` apply the delta to their grid; anyone else asks for a snapshot.
+
+    Args:
+        game (dict): the game data dictionary returned by `GameStore.play_turn()`
+
+    Returns:
+        JSON object with the move and the resulting turn and winner
+    """
+    row_index, column_index = game["last_move"]
+    return json.dumps(dict(
+        seq=game["seq"],
+        row=row_index,
+        col=column_index,
+        disc=game["grid"][row_index][column_index],
+        turn=game["position_with_turn"],
+        winner=game["winner"],
+    ))
+
+
+def json_analysis(analysis, seq):
+    """Convert a position analysis to the JSON object sent to clients.
+
+    Args:
+        analysis (AnalysisResult): analysis of the game's board
+        seq (int): seq of the board change the analysis is for
+
+    Returns:
+        JSON object with a score and an outcome ("win", "loss" or null if it isn't proven) per column, null for full
+        columns, and the best column
+    """
+    scores = [analysis.scores.get(column_index) for column_index in xrange(Board.WIDTH)]
+    return json.dumps(dict(
+        seq=seq,
+        scores=scores,
+        outcomes=[
+            None if score is None or abs(score) <= WIN_THRESHOLD else 'win' if score > 0 else 'loss'
+            for score in scores
+        ],
+        best=analysis.best_column_index,
+        depth=analysis.depth,
+    ))
+
+
+def json_match_found(game_id, player_id):
+    """Build the JSON object that sends a matched player to their new game.
+
+    Args:
+        game_id (str): uuid of the game created for the match
+        player_id (str): uuid of the player the message is for
+
+    Returns:
+        JSON object with the URL of the game, signed with the player's seat
+    """
+    return json.dumps(dict(url=url_for('game_page', game_id=game_id, match=match_token(game_id, player_id))))
+
+
+def unit_of_work(game_id):
+    """Get the unit of work for a game, shared by everything that handles the current request or socket event.
+
+    Args:
+        game_id (str): uuid of the game
+
+    Returns:
+        GameUnitOfWork for the game
+    """
+    work = getattr(g, 'game_unit_of_work', None)
+    if work is None or work.game_id != game_id:
+        work = g.game_unit_of_work = GameUnitOfWork(game_id)
+
+    return work
+
+
+def _new_game_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='new-game')
+
+
+def new_game_token(game_id, ai_opponent=False, variant=STANDARD_VARIANT):
+    """Sign the details of a game that will be created when its first player connects.
+
+    Args:
+        game_id (str): uuid of the game, from `GameStore.new_game_id()`
+        ai_opponent (bool): whether the server's AI will be player 2
+        variant (BoardVariant): the game's board variant
+
+    Returns:
+        URL-safe token string
+    """
+    return _new_game_serializer().dumps([game_id, ai_opponent, list(variant)])
+
+
+def load_new_game_token(token, game_id):
+    """Check a token from `new_game_token()`.
+
+    Args:
+        token (str): the token
+        game_id (str): uuid of the game the token should be for
+
+    Returns:
+        The tuple (whether the game has an AI opponent, its `BoardVariant`), or None if the token isn't a valid,
+        current token for the game
+    """
+    try:
+        details = _new_game_serializer().loads(token, max_age=NEW_GAME_TOKEN_MAX_AGE)
+        token_game_id, ai_opponent = details[:2]
+        # Tokens handed out before variants existed are for standard games
+        variant = BoardVariant(*details[2]) if len(details) > 2 else STANDARD_VARIANT
+    except (BadData, TypeError, ValueError):
+        return None
+
+    if token_game_id != game_id:
+        return None
+
+    return bool(ai_opponent), variant
+
+
+def _match_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='match')
+
+
+def match_token(game_id, player_id):
+    """Sign the seat of a matched player in their new game.
+
+    Args:
+        game_id (str): uuid of the game created for the match
+        player_id (str): uuid of the player the seat is for
+
+    Returns:
+        URL-safe token string
+    """
+    return _match_serializer().dumps([game_id, player_id])
+
+
+def load_match_token(token, game_id):
+    """Check a token from `match_token()`.
+
+    Args:
+        token (str): the token
+        game_id (str): uuid of the game the token should be for
+
+    Returns:
+        The player id the token is for, or None if the token isn't a valid, current token for the game
+    """
+    try:
+        token_game_id, player_id = _match_serializer().loads(token, max_age=MATCH_TOKEN_MAX_AGE)
+    except (BadData, TypeError, ValueError):
+        return None
+
+    if token_game_id != game_id:
+        return None
+
+    return player_id
+
+
+def create_pending_game(session):
+    """Create the game that the session's player was handed a new game token for, with the player in it.
+
+    A token creates its game once: if the game is gone by the time the player reconnects, e.g. because the sweeper
+    deleted it, it isn't created again and the player is turned away.
+
+    Args:
+        session (session): Flask's session object
+
+    Returns:
+        Same as `authenticate()`
+    """
+    session_game_id = session.get('game_id')
+    session_player_id = session.get('player_id')
+    new_game = load_new_game_token(session.get('new_game_token'), session_game_id)
+    if new_game is None or not session_player_id:
+        return None, None
+
+    ai_opponent, variant = new_game
+    GameStore.create(
+        ai_opponent=ai_opponent, game_id=session_game_id, player_id=session_player_id, variant=variant, once=True,
+    )
+    unit_of_work(session_game_id).reset()
+
+    return authenticate(session)
+
+
 def authenticate(session):
     """Authenticate a WebSocket request.
 
@@ -33,11 +274,62 @@ def authenticate(session):
 
     session_game_id = session.get('game_id')
     session_player_id = session.get('player_id')
-    game = GameStore.get(session_game_id)
-    positions_by_player_id = game["player_positions"]
-    if not game or session_player_id not in positions_by_player_id:
+    if not session_game_id:
+        return None, None
+
+    game = unit_of_work(session_game_id).game
+    if not game or session_player_id not in game["player_positions"]:
         return None, None
 
     return game, session_player_id
 
 
+def ai_position_to_play(game):
+    """Check whether it's the AI's move.
+
+    Args:
+        game (dict): the game data dictionary
+
+    Returns:
+        The AI's position if the game has an AI opponent and it's the AI's move, otherwise None
+    """
+    ai_position = game["player_positions"].get(AI_PLAYER_ID)
+    if ai_position is None or game["winner"] is not None or game["position_with_turn"] != ai_position:
+        return None
+
+    return ai_position
+
+
+def search_ai_move(grid, ai_position):
+    """Search for the AI's reply. Runs in a job worker process.
+
+    Args:
+        grid (list): the game's grid, on the standard board
+        ai_position (int): the AI's position
+
+    Returns:
+        a `solver.SearchResult`
+    """
+    board = Board.from_trusted(grid)
+    return ai_solver.search(board, DiscType(ai_position), time_budget=AI_TIME_BUDGET)
+
+
+def play_ai_move(game, result):
+    """Play the move the AI found for a game.
+
+    Args:
+        game (dict): the game data dictionary the search was for
+        result (SearchResult): the result of `search_ai_move()`
+
+    Returns:
+        The latest game data dictionary
+
+    Raises:
+        StaleMoveError: if the board changed since the search started, e.g. because the game was restarted
+        Same as `GameStore.play_turn()`
+    """
+    print("AI played column %d in game %s (depth %d, %d nodes, %d nodes/sec)" % (
+        result.column_index, game["game_id"], result.depth, result.nodes, result.nodes_per_second)
+    )
+
+    return GameStore.play_turn(game["game_id"], AI_PLAYER_ID, result.column_index, seq=game["seq"])
@@ -0,0 +1,338 @@
+"""CPU-bound work for socket handlers, run in worker processes.
+
+Socket handlers run in greenlets of a single gevent event loop, so a handler that searches for an AI move or analyzes a
+position holds up every other connection of the process until it's done. Instead they submit a job to the
+`JobDispatcher`, which runs it in one of a few worker processes while the event loop keeps serving, and get the result
+back in a callback, or by waiting on the job cooperatively.
+
+Jobs queue for a free worker; when too many are already queued, new ones are rejected so handlers can tell the client
+to back off rather than letting the backlog grow. Each job has a deadline covering its time in the queue and in the
+worker, and jobs can be cancelled by owner, e.g. when the game they're for has no one left to see the result. A job
+that runs past its deadline or is cancelled mid-run costs its worker, which is replaced, since there's no way to stop
+a call halfway.
+"""
+import multiprocessing
+import signal
+import time
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue
+from gevent.socket import wait_read
+
+from metrics import (
+    job_run_seconds,
+    job_wait_seconds,
+    jobs_total,
+)
+
+
+# Worker processes per app process
+JOB_WORKERS = 2
+
+# Jobs that may wait for a worker before new ones are turned away
+MAX_QUEUED_JOBS = 64
+
+
+### Exceptions ###
+
+class JobError(Exception):
+    pass
+
+
+class QueueFullError(JobError):
+    pass
+
+
+class DeadlineExceededError(JobError):
+    pass
+
+
+class JobCancelledError(JobError):
+    pass
+
+
+class WorkerDiedError(JobError):
+    pass
+
+
+### Worker processes ###
+
+def _worker_main(calls, replies, parent_ends, initializer):
+    # Ctrl-C is for the parent; the workers go away when their pipe closes, which needs the parent's ends closed here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for connection in parent_ends:
+        connection.close()
+    if initializer is not None:
+        initializer()
+
+    while True:
+        try:
+            function, args = calls.recv()
+        except EOFError:
+            return
+
+        try:
+            reply = (True, function(*args))
+        except Exception as e:
+            reply = (False, e)
+        replies.send(reply)
+
+
+class WorkerPool(object):
+    """Fixed set of worker processes, each running one function call at a time.
+
+    Callers wait for their worker's reply with `wait_read()`, so other greenlets keep running in the meantime, and
+    for a free worker on a gevent queue. Workers are started on first use and replaced if they die.
+    """
+
+    def __init__(self, size, initializer=None):
+        self.size = size
+        self.initializer = initializer
+        self._idle = None
+
+    def apply(self, function, args=(), started=None):
+        """Call `function(*args)` in a worker process and return its result.
+
+        Both must be picklable, so `function` has to be defined at the top level of a module.
+
+        Args:
+            function (function): function to call
+            args (tuple): its arguments
+            started (function): called without arguments once a worker is free to make the call
+
+        Raises:
+            WorkerDiedError: if the worker exited before replying
+        """
+        if self._idle is None:
+            self._idle = Queue()
+            for _ in xrange(self.size):
+                self._idle.put(self._start_worker())
+
+        worker = self._idle.get()
+        if started is not None:
+            started()
+
+        process, calls, replies = worker
+        try:
+            calls.send((function, args))
+            wait_read(replies.fileno())
+            succeeded, value = replies.recv()
+        except (EOFError, IOError):
+            worker = self._replace_worker(worker)
+            raise WorkerDiedError("A worker process exited")
+        except BaseException:
+            # Interrupted, e.g. by a gevent timeout; the next caller would read this call's reply, so start afresh
+            worker = self._replace_worker(worker)
+            raise
+        finally:
+            self._idle.put(worker)
+
+        if not succeeded:
+            raise value
+        return value
+
+    def close(self):
+        if self._idle is None:
+            return
+
+        workers = []
+        while not self._idle.empty():
+            workers.append(self._idle.get())
+        self._idle = None
+
+        # Workers forked later hold copies of the earlier ones' pipes, so close them all before waiting for any
+        for process, calls, replies in workers:
+            calls.close()
+            replies.close()
+        for process, calls, replies in workers:
+            process.join(1)
+
+    def _replace_worker(self, worker):
+        process, calls, replies = worker
+        calls.close()
+        replies.close()
+        process.terminate()
+        process.join(1)
+        return self._start_worker()
+
+    def _start_worker(self):
+        # One-way pipes rather than a duplex one: that's a socket pair, which gevent's patched `socket` makes
+        # non-blocking in the worker too
+        worker_calls, calls = multiprocessing.Pipe(duplex=False)
+        replies, worker_replies = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_worker_main, args=(worker_calls, worker_replies, (calls, replies), self.initializer),
+        )
+        process.daemon = True
+        process.start()
+        worker_calls.close()
+        worker_replies.close()
+        return process, calls, replies
+
+
+### Jobs ###
+
+class Job(object):
+    """A function call waiting for, or running in, a worker process.
+
+    Attributes:
+        name (str): kind of job, e.g. 'ai_move', for metrics
+        owner: whatever the job was submitted for, used to cancel it
+        submitted (float): when the job was submitted
+        started (float): when a worker started running it, or None
+    """
+
+    def __init__(self, name, function, args, owner, timeout, callback):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.owner = owner
+        self.timeout = timeout
+        self.callback = callback
+        self.submitted = time.time()
+        self.started = None
+        self._stopped = False
+        self._result = AsyncResult()
+        self._greenlet = None
+
+    def get(self):
+        """Wait for the job to end and return its result.
+
+        Raises:
+            DeadlineExceededError: if the job didn't finish in time
+            JobCancelledError: if the job was cancelled
+            Whatever the job's function raised
+        """
+        return self._result.get()
+
+    def ready(self):
+        return self._result.ready()
+
+    def cancel(self):
+        """Stop the job, unless it has already ended."""
+        if not self.ready():
+            self._greenlet.kill(block=False)
+
+
+class JobDispatcher(object):
+    """Runs jobs in a pool of worker processes on behalf of the greenlets of one app process."""
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS):
+        self.pool = WorkerPool(workers)
+        self.max_queued = max_queued
+        self._queued = 0
+        self._running = 0
+        # Owner => its unfinished jobs
+        self._jobs_by_owner = {}
+
+    def submit(self, name, function, args=(), owner=None, timeout=None, callback=None):
+        """Queue `function(*args)` to run in a worker process.
+
+        Args:
+            name (str): kind of job, for metrics
+            function (function): function to call; it and `args` must be picklable
+            args (tuple): its arguments
+            owner: anything hashable to cancel the job by, see `cancel()`
+            timeout (float): seconds the job may take from now, queueing included
+            callback (function): called with the `Job` once it has finished, failed or run out of time, but not if it
+                was cancelled. It runs in a greenlet of its own, outside the request or socket event that submitted
+                the job.
+
+        Returns:
+            Job
+
+        Raises:
+            QueueFullError: if `max_queued` jobs are already waiting for a worker
+        """
+        if self._queued >= self.max_queued:
+            jobs_total.inc(labels=(name, 'rejected'))
+            raise QueueFullError("%d jobs are already waiting for a worker" % self._queued)
+
+        job = Job(name, function, args, owner, timeout, callback)
+        self._queued += 1
+        self._jobs_by_owner.setdefault(owner, set()).add(job)
+        job._greenlet = gevent.spawn(self._run, job)
+        # Runs however the greenlet ends, even if it's killed before it starts
+        job._greenlet.rawlink(lambda greenlet: self._finish(job))
+        return job
+
+    def cancel(self, owner):
+        """Cancel the unfinished jobs of an owner.
+
+        Returns:
+            the number of cancelled jobs
+        """
+        jobs = self._jobs_by_owner.pop(owner, ())
+        for job in jobs:
+            job.cancel()
+
+        return len(jobs)
+
+    def pending(self, owner):
+        """Return the number of unfinished jobs of an owner."""
+        return len(self._jobs_by_owner.get(owner, ()))
+
+    def stats(self):
+        return dict(queued=self._queued, running=self._running)
+
+    def close(self):
+        self.pool.close()
+
+    def _run(self, job):
+        outcome = 'done'
+        try:
+            with gevent.Timeout(job.timeout, DeadlineExceededError("Job %s took over %ss" % (job.name, job.timeout))):
+                try:
+                    value = self.pool.apply(job.function, job.args, started=lambda: self._start(job))
+                finally:
+                    self._stop(job)
+        except DeadlineExceededError as e:
+            outcome = 'expired'
+            job._result.set_exception(e)
+        except Exception as e:
+            outcome = 'failed'
+            job._result.set_exception(e)
+        else:
+            job._result.set(value)
+
+        jobs_total.inc(labels=(job.name, outcome))
+        # Past this point the job can't be cancelled, so the callback isn't killed halfway through, e.g. in the middle
+        # of a Redis call
+        self._disown(job)
+        if job.callback is not None:
+            job.callback(job)
+
+    def _start(self, job):
+        job.started = time.time()
+        self._queued -= 1
+        self._running += 1
+        job_wait_seconds.observe(job.started - job.submitted, (job.name,))
+
+    def _stop(self, job):
+        # Called once the job no longer needs a worker
+        if job._stopped:
+            return
+
+        job._stopped = True
+        if job.started is None:
+            self._queued -= 1
+        else:
+            self._running -= 1
+            job_run_seconds.observe(time.time() - job.started, (job.name,))
+
+    def _disown(self, job):
+        owner_jobs = self._jobs_by_owner.get(job.owner)
+        if owner_jobs is not None:
+            owner_jobs.discard(job)
+            if not owner_jobs:
+                del self._jobs_by_owner[job.owner]
+
+    def _finish(self, job):
+        # Called by the event loop once the job's greenlet is dead, however it ended
+        self._stop(job)
+        self._disown(job)
+        if not job.ready():
+            # The greenlet was killed
+            jobs_total.inc(labels=(job.name, 'cancelled'))
+            job._result.set_exception(JobCancelledError("Job %s was cancelled" % job.name))
@@ -0,0 +1,103 @@
+import os
+import time
+import unittest
+
+import gevent
+
+from jobs import (
+    DeadlineExceededError,
+    JobCancelledError,
+    JobDispatcher,
+    QueueFullError,
+    WorkerDiedError,
+    WorkerPool,
+)
+
+
+def _fail():
+    raise ValueError("No")
+
+
+def _exit():
+    os._exit(1)
+
+
+
+class WorkerPoolTests(unittest.TestCase):
+    def test_apply(self):
+        pool = WorkerPool(2)
+        try:
+            self.assertEqual(pool.apply(max, (3, 5)), 5)
+            self.assertRaises(ValueError, pool.apply, _fail)
+            # A dead worker is replaced
+            self.assertRaises(WorkerDiedError, pool.apply, _exit)
+            self.assertEqual([pool.apply(abs, (-column_index,)) for column_index in xrange(4)], [0, 1, 2, 3])
+
+            # A call cut short doesn't leave its reply for the next one
+            with self.assertRaises(gevent.Timeout):
+                with gevent.Timeout(0.1):
+                    pool.apply(time.sleep, (0.3,))
+            self.assertEqual(pool.apply(max, (1, 2)), 2)
+            self.assertEqual(pool.apply(max, (3, 4)), 4)
+        finally:
+            pool.close()
+
+
+class JobDispatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = JobDispatcher(workers=1, max_queued=2)
+
+    def tearDown(self):
+        self.dispatcher.close()
+
+    def test_submit(self):
+        finished = []
+        job = self.dispatcher.submit('test', max, (3, 5), callback=finished.append)
+        self.assertEqual(job.get(), 5)
+        gevent.sleep(0)
+        self.assertEqual(finished, [job])
+        self.assertIsNotNone(job.started)
+
+        self.assertRaises(ValueError, self.dispatcher.submit('test', _fail).get)
+        self.assertEqual(self.dispatcher.stats(), dict(queued=0, running=0))
+
+    def test_deadline(self):
+        finished = []
+        job = self.dispatcher.submit('test', time.sleep, (0.3,), timeout=0.1, callback=finished.append)
+        self.assertRaises(DeadlineExceededError, job.get)
+        gevent.sleep(0)
+        self.assertEqual(finished, [job])
+
+        # The worker that was cut short is replaced
+        self.assertEqual(self.dispatcher.submit('test', max, (1, 2)).get(), 2)
+
+    def test_queue_is_bounded(self):
+        running = self.dispatcher.submit('test', time.sleep, (0.2,))
+        gevent.sleep(0)
+        queued = [self.dispatcher.submit('test', max, (1, index)) for index in xrange(2)]
+        self.assertEqual(self.dispatcher.stats(), dict(queued=2, running=1))
+        self.assertRaises(QueueFullError, self.dispatcher.submit, 'test', max, (1, 2))
+
+        running.get()
+        self.assertEqual([job.get() for job in queued], [1, 1])
+        self.assertEqual(self.dispatcher.stats(), dict(queued=0, running=0))
+
+    def test_cancel(self):
+        finished = []
+        running = self.dispatcher.submit('test', time.sleep, (0.2,), owner='game', callback=finished.append)
+        gevent.sleep(0)
+        queued = self.dispatcher.submit('test', max, (1, 2), owner='game', callback=finished.append)
+        other = self.dispatcher.submit('test', max, (3, 4), owner='other game')
+        self.assertEqual(self.dispatcher.pending('game'), 2)
+
+        self.assertEqual(self.dispatcher.cancel('game'), 2)
+        self.assertRaises(JobCancelledError, running.get)
+        self.assertRaises(JobCancelledError, queued.get)
+        self.assertEqual(other.get(), 4)
+        self.assertEqual(finished, [])
+        self.assertEqual(self.dispatcher.pending('game'), 0)
+        self.assertEqual(self.dispatcher.stats(), dict(queued=0, running=0))
+
+        # Finished jobs are no longer the owner's
+        self.dispatcher.submit('test', max, (1, 2), owner='game').get()
+        self.assertEqual(self.dispatcher.cancel('game'), 0)
@@ -0,0 +1,494 @@
+"""Load generator that plays many concurrent games against a running server.
+
+Simulated players speak the real protocol: they load the game page over HTTP, connect over Socket.IO, play random
+legal moves, restart finished games and disconnect. Every player runs in its own greenlet, so one process can keep
+thousands of games going. Start the server, then:
+
+    python loadtest.py --games 200 --ramp-up 20 --duration 60
+
+The report covers the latency of each round trip (page load, socket connect, move, restart), alerts by message,
+errors, and the rate of moves and games. `--mistake-rate` makes players send illegal moves on purpose to exercise the
+error paths. `--ai` plays every game against the server's AI instead of pairing players up. `--spectators` has that many
+spectators watch every game; their `spectator move` latency runs from a player sending a move to it reaching them.
+
+Needs the packages in requirements-dev.txt.
+"""
+from gevent import monkey
+# Must run before anything else imports socket, so every player's network I/O yields to the others
+monkey.patch_all()
+
+import argparse
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from urlparse import urlparse
+
+import gevent
+import requests
+from socketIO_client import SocketIO, SocketIONamespace
+from socketIO_client.exceptions import SocketIOError
+
+from benchmarks import percentile
+
+
+DEFAULT_URL = 'http://localhost:5000'
+DEFAULT_GAMES = 50
+DEFAULT_RAMP_UP = 10.0
+DEFAULT_DURATION = 60.0
+
+# Seconds a player may wait for any event before it gives up on its game
+EVENT_TIMEOUT = 30.0
+
+PERCENTILES = (50, 90, 99)
+
+_POSITION_PATTERN = re.compile(r'new Game\((\d),')
+
+
+class LoadStats(object):
+    """Latencies and counters shared by every simulated player."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.active_games = 0
+        self.peak_active_games = 0
+
+    def record(self, name, seconds):
+        self.latencies[name].append(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def game_started(self):
+        self.active_games += 1
+        self.peak_active_games = max(self.peak_active_games, self.active_games)
+
+    def game_stopped(self):
+        self.active_games -= 1
+
+    def summary(self, elapsed):
+        """Summarize the run.
+
+        Args:
+            elapsed (float): seconds the load ran for
+
+        Returns:
+            dict with the latency distributions in milliseconds, the counters and the throughput
+        """
+        latencies = {}
+        for name, samples in self.latencies.iteritems():
+            samples = sorted(samples)
+            latencies[name] = dict(
+                count=len(samples),
+                mean_ms=sum(samples) / len(samples) * 1e3,
+                max_ms=samples[-1] * 1e3,
+            )
+            for percent in PERCENTILES:
+                latencies[name]['p%d_ms' % percent] = percentile(samples, percent) * 1e3
+
+        moves = self.counters['moves']
+        alerts = sum(count for name, count in self.counters.iteritems() if name.startswith('alert: '))
+        return dict(
+            elapsed=elapsed,
+            latencies=latencies,
+            counters=dict(self.counters),
+            peak_active_games=self.peak_active_games,
+            moves_per_sec=moves / elapsed if elapsed else 0.0,
+            games_per_sec=self.counters['games finished'] / elapsed if elapsed else 0.0,
+            alert_rate=alerts / float(moves + alerts) if moves + alerts else 0.0,
+        )
+
+
+class SimulatedPlayer(object):
+    """One browser tab playing a game.
+
+    Mirrors what static/js/game.js does: it keeps its own copy of the game from snapshots and move deltas, asks for a
+    snapshot when it misses a move, and plays whenever it's its turn.
+    """
+
+    def __init__(self, base_url, stats, rng, deadline, mistake_rate=0.0, restarts=True, transport='xhr-polling'):
+        self.base_url = base_url
+        self.stats = stats
+        self.rng = rng
+        self.deadline = deadline
+        self.mistake_rate = mistake_rate
+        self.restarts = restarts
+        self.transport = transport
+        self.http = requests.Session()
+        self.socket = None
+        self.game_url = None
+        self.position = None
+        self.grid = None
+        self.seq = None
+        self.turn = None
+        self.winner = None
+        self.player_count = 0
+        self.pending = None
+        self.done = False
+        self.last_event = None
+        # Whether this player counts the other side's moves too, because nobody else will
+        self.counts_opponent_moves = False
+        # Seq => when the move with that seq was sent, shared by everyone in the game
+        self.moves_sent = {}
+
+    def load_page(self, path):
+        """Load a game page, following the redirect `/` and `/ai` answer with."""
+        start = time.time()
+        response = self.http.get(self.base_url + path)
+        self.stats.record('page', time.time() - start)
+        response.raise_for_status()
+
+        match = _POSITION_PATTERN.search(response.text)
+        if not match:
+            raise ValueError("No player position on %s" % response.url)
+        self.position = int(match.group(1))
+        self.game_url = response.url.split('?')[0]
+
+    def connect(self):
+        url = urlparse(self.base_url)
+        self.pending = ('connect', time.time())
+        SocketIO(
+            url.hostname, url.port or 80,
+            Namespace=_player_namespace(self),
+            cookies=self.http.cookies.get_dict(),
+            transports=[self.transport],
+            wait_for_connection=False,
+        )
+
+    def run(self):
+        """Handle events until the deadline passes or the player runs out of things to do."""
+        self.last_event = time.time()
+        while not self.done and time.time() < self.deadline:
+            self.socket.wait(seconds=min(1.0, max(0.0, self.deadline - time.time())))
+            if time.time() - self.last_event > EVENT_TIMEOUT:
+                self.stats.count('timeouts')
+                break
+
+    def disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.disconnect()
+            except SocketIOError:
+                pass
+
+    ### Events ###
+
+    def on_game_state(self, json_data):
+        data = json.loads(json_data)
+        self._received()
+        if self.pending and self.pending[0] in ('connect', 'restart', 'sync'):
+            self.stats.record(self.pending[0], time.time() - self.pending[1])
+            self.pending = None
+
+        self.grid = data["grid"]
+        self.seq = data["seq"]
+        self.turn = data["position_with_turn"]
+        self.winner = data["winner"]
+        self.player_count = data["player_count"]
+        self._act()
+
+    def on_move(self, json_data):
+        move = json.loads(json_data)
+        self._received()
+        if self.seq is None or move["seq"] > self.seq + 1:
+            self.stats.count('syncs')
+            self.pending = ('sync', time.time())
+            self.socket.emit('sync')
+            return
+        if move["seq"] <= self.seq:
+            return
+
+        if self.pending and self.pending[0] == 'drop_disc' and move["disc"] == self.position:
+            self.stats.record('drop_disc', time.time() - self.pending[1])
+            self.pending = None
+        if move["disc"] == self.position or self.counts_opponent_moves:
+            self.stats.count('moves')
+
+        self.grid[move["row"]][move["col"]] = move["disc"]
+        self.seq = move["seq"]
+        self.turn = move["turn"]
+        self.winner = move["winner"]
+        self._act()
+
+    def on_alert(self, json_data):
+        self._received()
+        self.stats.count('alert: %s' % json.loads(json_data)["message"])
+        if self.pending and self.pending[0] == 'drop_disc':
+            self.pending = None
+        self._act()
+
+    ### Playing ###
+
+    def _received(self):
+        self.last_event = time.time()
+
+    def _act(self):
+        if self.pending or self.grid is None:
+            return
+
+        if self.winner is not None:
+            if self.position == 1:
+                self.stats.count('games finished')
+            # Player 1 starts the next game; everyone else waits for its snapshot
+            if self.restarts and self.position == 1 and time.time() < self.deadline:
+                self.pending = ('restart', time.time())
+                self.socket.emit('restart')
+            elif not self.restarts:
+                self.done = True
+            return
+
+        if self.player_count < 2 or self.turn != self.position:
+            return
+
+        # The top row tells which columns are full, whatever the board variant
+        open_columns = [column_index for column_index, disc in enumerate(self.grid[0]) if disc == 0]
+        full_columns = [column_index for column_index, disc in enumerate(self.grid[0]) if disc != 0]
+        if full_columns and self.rng.random() < self.mistake_rate:
+            column_index = self.rng.choice(full_columns)
+        else:
+            column_index = self.rng.choice(open_columns)
+
+        self.pending = ('drop_disc', time.time())
+        self.moves_sent[self.seq + 1] = self.pending[1]
+        self.socket.emit('drop_disc', json.dumps(dict(column_index=column_index)))
+        if self.rng.random() < self.mistake_rate:
+            # A second move straight after the first is out of turn
+            self.socket.emit('drop_disc', json.dumps(dict(column_index=self.rng.choice(open_columns))))
+
+
+class SimulatedSpectator(object):
+    """One browser tab watching a game, keeping up with its moves like a player does."""
+
+    def __init__(self, base_url, stats, deadline, moves_sent, transport='xhr-polling'):
+        self.base_url = base_url
+        self.stats = stats
+        self.deadline = deadline
+        self.moves_sent = moves_sent
+        self.transport = transport
+        self.http = requests.Session()
+        self.socket = None
+        self.seq = None
+        self.pending = None
+        self.done = False
+
+    def load_page(self, game_url):
+        start = time.time()
+        response = self.http.get(game_url + '/watch')
+        self.stats.record('watch page', time.time() - start)
+        response.raise_for_status()
+
+    def connect(self, game_url):
+        url = urlparse(self.base_url)
+        self.pending = ('watch', time.time())
+        self.socket = SocketIO(
+            url.hostname, url.port or 80,
+            params=dict(game_id=urlparse(game_url).path.strip('/')),
+            transports=[self.transport],
+            wait_for_connection=False,
+        )
+        self.socket.define(_spectator_namespace(self), '/watch')
+
+    def run(self):
+        """Handle events until the deadline passes or the game's players are done."""
+        while not self.done and time.time() < self.deadline:
+            self.socket.wait(seconds=min(1.0, max(0.0, self.deadline - time.time())))
+
+    def disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.disconnect()
+            except SocketIOError:
+                pass
+
+    ### Events ###
+
+    def on_game_state(self, json_data):
+        if self.pending:
+            self.stats.record(self.pending[0], time.time() - self.pending[1])
+            self.pending = None
+        self.seq = json.loads(json_data)["seq"]
+
+    def on_move(self, json_data):
+        move = json.loads(json_data)
+        if self.seq is None or move["seq"] > self.seq + 1:
+            self.stats.count('spectator syncs')
+            self.pending = ('sync', time.time())
+            self.socket.emit('sync', path='/watch')
+            return
+        if move["seq"] <= self.seq:
+            return
+
+        sent = self.moves_sent.get(move["seq"])
+        if sent is not None:
+            self.stats.record('spectator move', time.time() - sent)
+        self.seq = move["seq"]
+
+
+def _player_namespace(player):
+    """Build the Socket.IO namespace that hands a player its events.
+
+    The client handshakes inside its constructor, so the handlers have to be in place before the constructor returns.
+    """
+    class PlayerNamespace(SocketIONamespace):
+
+        def initialize(self):
+            player.socket = self._io
+
+        def on_connect(self):
+            # The snapshot the server sends on connect can arrive with the handshake, which socketIO-client drops
+            if player.grid is None:
+                self.emit('sync')
+
+        def on_game_state(self, json_data):
+            player.on_game_state(json_data)
+
+        def on_move(self, json_data):
+            player.on_move(json_data)
+
+        def on_alert(self, json_data):
+            player.on_alert(json_data)
+
+    return PlayerNamespace
+
+
+def _spectator_namespace(spectator):
+    """Build the Socket.IO namespace that hands a spectator its events."""
+    class SpectatorNamespace(SocketIONamespace):
+
+        def on_game_state(self, json_data):
+            spectator.on_game_state(json_data)
+
+        def on_move(self, json_data):
+            spectator.on_move(json_data)
+
+    return SpectatorNamespace
+
+
+def play_game(base_url, stats, rng, deadline, ai_opponent=False, variant=None, spectators=0, **player_options):
+    """Play one game, restarting it until the deadline. Player 2 joins through the game's URL like a real friend."""
+    players = []
+    watchers = []
+    stats.game_started()
+    try:
+        player = SimulatedPlayer(base_url, stats, random.Random(rng.random()), deadline, **player_options)
+        player.counts_opponent_moves = ai_opponent
+        players.append(player)
+        player.load_page('/ai' if ai_opponent else '/?variant=%s' % variant if variant else '/')
+        player.connect()
+        if not ai_opponent:
+            opponent = SimulatedPlayer(base_url, stats, random.Random(rng.random()), deadline, **player_options)
+            players.append(opponent)
+            opponent.load_page(urlparse(player.game_url).path)
+            opponent.connect()
+            opponent.moves_sent = player.moves_sent
+
+        playing = [gevent.spawn(client.run) for client in players]
+        # The game only exists once its first player has connected
+        while spectators and player.grid is None and not player.done and time.time() < deadline:
+            gevent.sleep(0.1)
+        for _ in xrange(spectators):
+            spectator = SimulatedSpectator(
+                base_url, stats, deadline, player.moves_sent, transport=player_options.get('transport', 'xhr-polling'),
+            )
+            watchers.append(spectator)
+            spectator.load_page(player.game_url)
+            spectator.connect(player.game_url)
+
+        watching = [gevent.spawn(spectator.run) for spectator in watchers]
+        gevent.joinall(playing)
+        for spectator in watchers:
+            spectator.done = True
+        gevent.joinall(watching)
+        stats.count('games played')
+    except Exception as error:
+        stats.count('error: %s' % type(error).__name__)
+    finally:
+        for client in players + watchers:
+            client.disconnect()
+        stats.game_stopped()
+
+
+def run_load(base_url, games, ramp_up, duration, seed=None, ai_opponent=False, variant=None, spectators=0,
+             **player_options):
+    """Start `games` games spread evenly over `ramp_up` seconds and play them for `duration` seconds.
+
+    Returns:
+        the summary from `LoadStats.summary()`
+    """
+    rng = random.Random(seed)
+    stats = LoadStats()
+    start = time.time()
+    deadline = start + duration
+    greenlets = []
+    for index in xrange(games):
+        start_at = start + ramp_up * index / games
+        gevent.sleep(max(0.0, start_at - time.time()))
+        greenlets.append(gevent.spawn(
+            play_game, base_url, stats, rng, deadline, ai_opponent=ai_opponent, variant=variant, spectators=spectators,
+            **player_options
+        ))
+
+    gevent.joinall(greenlets)
+    return stats.summary(time.time() - start)
+
+
+def _format_summary(summary):
+    lines = ['%-14s %8s %10s %10s %10s %10s %10s' % ('round trip', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms',
+                                                     'max ms')]
+    for name in sorted(summary["latencies"]):
+        latency = summary["latencies"][name]
+        lines.append('%-14s %8d %10.1f %10.1f %10.1f %10.1f %10.1f' % (
+            name, latency["count"], latency["mean_ms"], latency["p50_ms"], latency["p90_ms"], latency["p99_ms"],
+            latency["max_ms"],
+        ))
+
+    lines.append('')
+    for name in sorted(summary["counters"]):
+        lines.append('%-60s %8d' % (name, summary["counters"][name]))
+
+    lines.append('')
+    lines.append('%.1f moves/sec, %.2f games/sec, %.1f%% of moves alerted, peak %d concurrent games over %.0fs' % (
+        summary["moves_per_sec"], summary["games_per_sec"], summary["alert_rate"] * 100,
+        summary["peak_active_games"], summary["elapsed"],
+    ))
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many concurrent Connect Four games against a server.")
+    parser.add_argument('--url', default=DEFAULT_URL, help="server to load")
+    parser.add_argument('--games', type=int, default=DEFAULT_GAMES, help="number of concurrent games")
+    parser.add_argument('--ramp-up', type=float, default=DEFAULT_RAMP_UP, help="seconds over which games start")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="seconds to play for")
+    parser.add_argument('--ai', action='store_true', help="play every game against the server's AI")
+    parser.add_argument('--variant', help="board variant to play, e.g. 9x7 (see `VARIANTS` in app.py)")
+    parser.add_argument('--spectators', type=int, default=0, help="number of spectators watching every game")
+    parser.add_argument('--mistake-rate', type=float, default=0.0,
+                        help="chance of playing a full column or out of turn on each move")
+    parser.add_argument('--no-restart', action='store_true', help="disconnect after the first game ends")
+    parser.add_argument('--transport', choices=('xhr-polling', 'websocket'), default='xhr-polling')
+    parser.add_argument('--seed', type=int, help="seed for the players' moves")
+    parser.add_argument('--output', help="save the summary to this JSON file")
+    args = parser.parse_args(argv)
+
+    summary = run_load(
+        args.url.rstrip('/'), args.games, args.ramp_up, args.duration,
+        seed=args.seed,
+        ai_opponent=args.ai,
+        variant=args.variant,
+        spectators=args.spectators,
+        mistake_rate=args.mistake_rate,
+        restarts=not args.no_restart,
+        transport=args.transport,
+    )
+    print(_format_summary(summary))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(summary, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
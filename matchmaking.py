@@ -0,0 +1,138 @@
+"""Matchmaking: pair up players who are waiting for an opponent.
+
+Players waiting for a game queue in Redis, one list per bucket: a board variant, optionally narrowed to a skill
+level. Joining is a single script that pops the longest-waiting player of the bucket, or queues the new player when
+nobody is waiting, so pairing needs no locks however many processes take joins at once. The game is only created
+once a pair is formed, so a waiting player costs a list entry and a ticket key rather than a half-empty game.
+
+Each waiting player has a ticket key that expires after `MATCH_TICKET_TTL`. Claiming a waiting player deletes its
+ticket, and so does leaving the queue; whoever gets there first wins. Queue entries whose ticket is gone (the player
+left, was already matched or their process died) are skipped and dropped when they reach the front of the queue, so
+leaving costs a single DEL rather than a scan of the list.
+"""
+import time
+
+from game_store import (
+    GameStore,
+    redis_client,
+)
+from metrics import (
+    match_wait_seconds,
+    matchmaking_total,
+    operation,
+)
+
+
+MATCH_QUEUE_PREFIX = 'match:queue:'
+MATCH_TICKET_PREFIX = 'match:ticket:'
+
+# Seconds a player may wait for an opponent before their ticket expires and they have to join again
+MATCH_TICKET_TTL = 10 * 60
+
+
+def match_queue_key(bucket):
+    return MATCH_QUEUE_PREFIX + bucket
+
+
+def match_ticket_key(player_id):
+    return MATCH_TICKET_PREFIX + player_id
+
+
+### Scripts ###
+
+# KEYS: the bucket's queue, the joining player's ticket. ARGV: player id, ticket TTL, ticket key prefix, current time.
+# Returns the id of the claimed player and the time they joined, or nil if the joining player was queued instead.
+# Tickets of queued players are read by key name, so the queue and the tickets have to live on the same Redis server.
+join_queue_script = redis_client.register_script("""
+while true do
+    local waiting = redis.call('LPOP', KEYS[1])
+    if not waiting then
+        break
+    end
+    if waiting ~= ARGV[1] then
+        local ticket = ARGV[3] .. waiting
+        local joined = redis.call('GET', ticket)
+        if joined then
+            redis.call('DEL', ticket)
+            redis.call('DEL', KEYS[2])
+            return {waiting, joined}
+        end
+    end
+end
+redis.call('SET', KEYS[2], ARGV[4], 'EX', ARGV[2])
+redis.call('RPUSH', KEYS[1], ARGV[1])
+return false
+""")
+
+
+### Matchmaking ###
+
+class Matchmaker(object):
+    """Pairs each player who joins a bucket with the one waiting there, if any."""
+
+    @staticmethod
+    @operation('match_join')
+    def join(player_id, bucket):
+        """Pair a player with the player who has waited longest in a bucket, or queue them if nobody is waiting.
+
+        Args:
+            player_id (str): uuid of the joining player
+            bucket (str): the queue to join, see `match_bucket()`
+
+        Returns:
+            The id of the opponent, who has been taken off the queue, or None if the player is now waiting
+        """
+        now = time.time()
+        reply = join_queue_script(
+            keys=[match_queue_key(bucket), match_ticket_key(player_id)],
+            args=[player_id, MATCH_TICKET_TTL, MATCH_TICKET_PREFIX, repr(now)],
+        )
+        if reply is None:
+            matchmaking_total.inc(labels=('queued',))
+            return None
+
+        opponent_id, joined = reply
+        matchmaking_total.inc(labels=('matched',))
+        match_wait_seconds.observe(now - float(joined))
+        return opponent_id
+
+    @staticmethod
+    @operation('match_leave')
+    def leave(player_id):
+        """Take a player off the queue.
+
+        Args:
+            player_id (str): uuid of the player
+
+        Returns:
+            True if the player was still waiting, False if they had been matched already or their ticket expired
+        """
+        left = bool(redis_client.delete(match_ticket_key(player_id)))
+        if left:
+            matchmaking_total.inc(labels=('left',))
+
+        return left
+
+
+def match_bucket(variant_name, skill=None):
+    """Name the queue for players of a board variant and, optionally, a skill level."""
+    return variant_name if skill is None else '%s:%s' % (variant_name, skill)
+
+
+@operation('create_match_game')
+def create_match_game(player_1_id, player_2_id, variant):
+    """Create the game for a pair of matched players.
+
+    Both players are written in a single script call, so nobody ever sees the game with only one of them. Neither
+    player has the game open yet: their open connections start at zero and are counted by the game page when they
+    arrive, so if they never do, the sweeper reclaims the game like any other abandoned one.
+
+    Args:
+        player_1_id (str): uuid of the player who waited, who moves first
+        player_2_id (str): uuid of the player who joined them
+        variant (BoardVariant): the game's board variant
+
+    Returns:
+        The new game's id
+    """
+    return GameStore.create(player_id=player_1_id, opponent_id=player_2_id, open_connections=0, variant=variant)
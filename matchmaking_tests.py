@@ -0,0 +1,115 @@
+import threading
+import unittest
+
+import redis
+
+from board_model import BoardVariant
+from game_store import (
+    GameStore,
+    game_key,
+    move_log_key,
+    redis_client,
+    snapshots_key,
+)
+from matchmaking import (
+    Matchmaker,
+    create_match_game,
+    match_bucket,
+    match_queue_key,
+    match_ticket_key,
+)
+
+
+class MatchmakerTests(unittest.TestCase):
+    # These tests need the Redis server from `REDIS_CONNECTION_SETTINGS`
+    def setUp(self):
+        try:
+            redis_client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis isn't running")
+
+        self.bucket = match_bucket('test-%s' % GameStore.new_game_id())
+        self.player_ids = []
+        self.game_ids = []
+
+    def tearDown(self):
+        redis_client.delete(match_queue_key(self.bucket), match_queue_key(match_bucket(self.bucket, 'expert')))
+        for player_id in self.player_ids:
+            redis_client.delete(match_ticket_key(player_id))
+        for game_id in self.game_ids:
+            redis_client.delete(game_key(game_id), move_log_key(game_id), snapshots_key(game_id))
+
+    def join(self, player_id, bucket=None):
+        self.player_ids.append(player_id)
+        return Matchmaker.join(player_id, bucket or self.bucket)
+
+    def test_join(self):
+        self.assertIsNone(self.join('player-one'))
+        self.assertIsNone(self.join('player-two', match_bucket(self.bucket, 'expert')))
+        self.assertEqual(self.join('player-three'), 'player-one')
+        self.assertIsNone(redis_client.get(match_ticket_key('player-one')))
+
+        self.assertIsNone(self.join('player-four'))
+        self.assertEqual(self.join('player-five'), 'player-four')
+        self.assertEqual(redis_client.llen(match_queue_key(self.bucket)), 0)
+
+        # A player who joins twice isn't paired with themself
+        self.assertIsNone(self.join('player-eight'))
+        self.assertIsNone(self.join('player-eight'))
+        self.assertEqual(self.join('player-nine'), 'player-eight')
+        self.assertIsNone(self.join('player-ten'))
+        self.assertEqual(redis_client.lrange(match_queue_key(self.bucket), 0, -1), ['player-ten'])
+
+    def test_leave(self):
+        self.assertIsNone(self.join('player-one'))
+        self.assertIsNone(self.join('player-two', match_bucket(self.bucket, 'expert')))
+        self.assertTrue(Matchmaker.leave('player-one'))
+        self.assertFalse(Matchmaker.leave('player-one'))
+
+        # The queue entries of players who left are skipped, and dropped on the way
+        self.assertIsNone(self.join('player-three'))
+        self.assertEqual(redis_client.lrange(match_queue_key(self.bucket), 0, -1), ['player-three'])
+        self.assertEqual(self.join('player-four'), 'player-three')
+        self.assertFalse(Matchmaker.leave('player-three'))
+
+        # So are those of players whose ticket expired
+        self.assertIsNone(self.join('player-five'))
+        redis_client.delete(match_ticket_key('player-five'))
+        self.assertIsNone(self.join('player-six'))
+        self.assertEqual(redis_client.lrange(match_queue_key(self.bucket), 0, -1), ['player-six'])
+
+    def test_concurrent_joins(self):
+        # Every player ends up in exactly one pair, however the joins interleave
+        pairs = []
+
+        def join_all(prefix):
+            for index in xrange(200):
+                player_id = '%s-%d' % (prefix, index)
+                opponent_id = Matchmaker.join(player_id, self.bucket)
+                if opponent_id is not None:
+                    pairs.append((opponent_id, player_id))
+
+        prefixes = ['player-%d' % index for index in xrange(4)]
+        self.player_ids.extend('%s-%d' % (prefix, index) for prefix in prefixes for index in xrange(200))
+        threads = [threading.Thread(target=join_all, args=(prefix,)) for prefix in prefixes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(pairs), 400)
+        paired = [player_id for pair in pairs for player_id in pair]
+        self.assertEqual(sorted(paired), sorted(self.player_ids))
+        self.assertEqual(redis_client.llen(match_queue_key(self.bucket)), 0)
+
+    def test_create_match_game(self):
+        variant = BoardVariant(9, 7, 4)
+        game_id = create_match_game('player-one', 'player-two', variant)
+        self.game_ids.append(game_id)
+
+        game = GameStore.get(game_id)
+        self.assertEqual(game["player_positions"], {'player-one': 1, 'player-two': 2})
+        self.assertEqual(game["variant"], variant)
+        # Nobody has opened the game yet, so the sweeper can reclaim it if they never do
+        self.assertEqual(GameStore.get_open_connections(game_id, 'player-one'), 0)
+        self.assertEqual(GameStore.get_open_connections(game_id, 'player-two'), 0)
@@ -0,0 +1,300 @@
+"""Process-local metrics, rendered in the Prometheus text format by the `/metrics` route.
+
+Counters and fixed-bucket histograms live in plain dictionaries, so recording a sample is a bisect and a couple of
+additions under a lock; cheap enough to leave on around every socket event and Redis call. Each worker process keeps
+its own numbers, so scrape every process and let Prometheus add them up.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds, in seconds, of the buckets for work that takes about as long as a request
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+
+# Buckets for encoding or decoding a single game, which takes microseconds
+SERIALIZE_BUCKETS = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005)
+
+# Buckets for players waiting for an opponent, which takes seconds to minutes
+MATCH_WAIT_BUCKETS = (.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Operation that Redis calls made outside any `operation()` are attributed to
+DEFAULT_OPERATION = 'other'
+
+
+class Metric(object):
+    """A named family of samples, one per combination of label values."""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Yield a (name suffix, label pairs, value) tuple per sample."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        super(Counter, self).__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, labels=()):
+        """Add `amount` to the sample for the `labels` tuple of label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for labels, value in values:
+            yield '', zip(self.label_names, labels), value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per labels tuple: a count per bucket, one for values above the last bound, and the sum of all values
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    def count(self, labels=()):
+        return sum(self._counts.get(labels, ()))
+
+    def time(self, *label_values):
+        """Context manager that observes how long its block takes."""
+        return _Timer(self, label_values)
+
+    def timed(self, *label_values):
+        """Decorator that observes how long each call takes."""
+        def decorator(function):
+            @wraps(function)
+            def timed_function(*args, **kwargs):
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.time() - start, label_values)
+
+            return timed_function
+
+        return decorator
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts), self._sums[labels]) for labels, counts in self._counts.iteritems())
+
+        for labels, counts, total in values:
+            label_pairs = zip(self.label_names, labels)
+            cumulative_count = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative_count += count
+                yield '_bucket', label_pairs + [('le', bound)], cumulative_count
+            yield '_sum', label_pairs, total
+            yield '_count', label_pairs, cumulative_count
+
+
+class CallbackMetric(Metric):
+    """A metric read from elsewhere when it's scraped, like the size of a cache.
+
+    `function` returns the value, or a dictionary from tuples of label values to values.
+    """
+
+    def __init__(self, name, documentation, function, type_name='gauge', label_names=()):
+        super(CallbackMetric, self).__init__(name, documentation, label_names)
+        self.function = function
+        self.type_name = type_name
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        for labels, value in sorted(values.iteritems()):
+            yield '', zip(self.label_names, labels), value
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.time() - self.start, self.labels)
+
+
+class Registry(object):
+    """The metrics a process exposes, in the order they're rendered."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def register(self, metric):
+        assert metric.name not in self._metrics, "Metric %s is already registered" % metric.name
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def callback(self, name, documentation, function, type_name='gauge', label_names=()):
+        return self.register(CallbackMetric(name, documentation, function, type_name, label_names))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, _escape(metric.documentation)))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for suffix, label_pairs, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix, _format_labels(label_pairs), _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(text):
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _format_labels(label_pairs):
+    if not label_pairs:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, _escape(_format_value(value)).replace('"', r'\"')) for name, value in label_pairs
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+
+    return str(value)
+
+
+### Operations ###
+#
+# Lower layers label their metrics with the operation the current thread (or greenlet, once gevent has patched
+# `threading`) is performing, e.g. the `GameStore` method behind a Redis call. Nested operations keep the outermost
+# name, so a method built on other instrumented methods is counted as itself.
+
+class _OperationState(threading.local):
+    name = None
+
+
+_operation = _OperationState()
+
+
+def current_operation():
+    return _operation.name or DEFAULT_OPERATION
+
+
+class operation(object):
+    """Context manager, or decorator, that names the operation the code inside it is performing."""
+
+    def __init__(self, name):
+        self.name = name
+        self._outermost = False
+
+    def __enter__(self):
+        self._outermost = _operation.name is None
+        if self._outermost:
+            _operation.name = self.name
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outermost:
+            _operation.name = None
+
+    def __call__(self, function):
+        name = self.name
+
+        @wraps(function)
+        def function_in_operation(*args, **kwargs):
+            with operation(name):
+                return function(*args, **kwargs)
+
+        return function_in_operation
+
+
+### Metrics ###
+
+registry = Registry()
+
+socket_event_seconds = registry.histogram(
+    'connectfour_socket_event_seconds', "Time spent handling each Socket.IO event.", ['event'],
+)
+redis_round_trips = registry.counter(
+    'connectfour_redis_round_trips_total', "Requests sent to Redis; a pipeline is one.", ['operation'],
+)
+redis_commands = registry.counter(
+    'connectfour_redis_commands_total', "Redis commands executed, counting each command in a pipeline.", ['operation'],
+)
+redis_sent_bytes = registry.counter(
+    'connectfour_redis_sent_bytes_total', "Bytes of commands sent to Redis.", ['operation'],
+)
+redis_received_bytes = registry.counter(
+    'connectfour_redis_received_bytes_total', "Approximate bytes of replies from Redis, counting only their payload.",
+    ['operation'],
+)
+serialize_seconds = registry.histogram(
+    'connectfour_serialize_seconds', "Time spent encoding and decoding games.", ['step'], buckets=SERIALIZE_BUCKETS,
+)
+job_wait_seconds = registry.histogram(
+    'connectfour_job_wait_seconds', "Time jobs spent queued for a worker process.", ['job'],
+)
+job_run_seconds = registry.histogram(
+    'connectfour_job_run_seconds', "Time jobs spent running in a worker process.", ['job'],
+)
+jobs_total = registry.counter(
+    'connectfour_jobs_total', "Jobs by outcome: done, failed, expired, cancelled, or rejected as the queue was full.",
+    ['job', 'outcome'],
+)
+matchmaking_total = registry.counter(
+    'connectfour_matchmaking_total', "Players queued for an opponent, matched with one, or leaving the queue.",
+    ['event'],
+)
+match_wait_seconds = registry.histogram(
+    'connectfour_match_wait_seconds', "Time matched players spent waiting for an opponent.",
+    buckets=MATCH_WAIT_BUCKETS,
+)
@@ -0,0 +1,96 @@
+import unittest
+
+from metrics import (
+    DEFAULT_OPERATION,
+    Registry,
+    current_operation,
+    operation,
+)
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('requests_total', "Requests.", ['method'])
+        counter.inc(labels=('get',))
+        counter.inc(2, labels=('get',))
+        counter.inc(labels=('post',))
+        self.assertEqual(counter.value(('get',)), 3)
+
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{method="get"} 3',
+            'requests_total{method="post"} 1',
+        ]) + '\n')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3.0)
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.count(), 5)
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:5], [
+            'latency_seconds_bucket{le="0.1"} 3',
+            'latency_seconds_bucket{le="1.0"} 4',
+            'latency_seconds_bucket{le="+Inf"} 5',
+        ])
+        self.assertTrue(lines[5].startswith('latency_seconds_sum 3.65'))
+        self.assertEqual(lines[6], 'latency_seconds_count 5')
+
+        @histogram.timed()
+        def fail():
+            raise ValueError
+
+        # Failed calls are timed too
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(histogram.count(), 6)
+
+    def test_callback(self):
+        sizes = {}
+        self.registry.callback('cache_entries', "Cached entries.", lambda: len(sizes))
+        self.registry.callback(
+            'cache_events_total', "Cache events.", lambda: {('hits',): 4, ('misses',): 1},
+            type_name='counter', label_names=['event'],
+        )
+        sizes['a'] = 1
+
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP cache_entries Cached entries.',
+            '# TYPE cache_entries gauge',
+            'cache_entries 1',
+            '# HELP cache_events_total Cache events.',
+            '# TYPE cache_events_total counter',
+            'cache_events_total{event="hits"} 4',
+            'cache_events_total{event="misses"} 1',
+        ]) + '\n')
+
+        self.assertRaises(AssertionError, self.registry.callback, 'cache_entries', "Again.", lambda: 0)
+
+    def test_label_escaping(self):
+        counter = self.registry.counter('alerts_total', "Alerts.", ['message'])
+        counter.inc(labels=('Say "hi"\n',))
+        self.assertIn(r'alerts_total{message="Say \"hi\"\n"} 1', self.registry.render())
+
+
+class OperationTests(unittest.TestCase):
+    def test_operation(self):
+        self.assertEqual(current_operation(), DEFAULT_OPERATION)
+
+        @operation('inner')
+        def inner():
+            return current_operation()
+
+        self.assertEqual(inner(), 'inner')
+        with operation('outer'):
+            # The outermost operation wins
+            self.assertEqual(inner(), 'outer')
+            self.assertEqual(current_operation(), 'outer')
+        self.assertEqual(current_operation(), DEFAULT_OPERATION)
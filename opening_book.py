@@ -0,0 +1,212 @@
+"""Precomputed opening book for the solver.
+
+The book holds the value of every non-terminal position up to `max_ply` discs, computed by `Solver` with a fixed
+search depth. Mirror images share one entry. Records are fixed-size (key, value) pairs sorted by key, so lookups
+binary-search a read-only memory map of the file: nothing gets loaded onto the heap and every process that opens the
+book shares the same pages through the OS page cache.
+
+The solver only takes a book value in place of searching a position when its search wouldn't go deeper than the
+book's, or when the value is a proven win or loss.
+
+Build a book with:
+
+    python opening_book.py opening_book.bin --ply 6 --depth 8
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from solver import (
+    HEIGHT,
+    MAX_MOVES,
+    Solver,
+    WIDTH,
+    bottom_mask,
+    canonical_key,
+    has_alignment,
+    mirror_key,
+    position_key,
+    top_mask,
+)
+
+
+# Header: magic, format version, board width, board height, max ply, search depth, record count
+HEADER_FORMAT = '>4sHBBBBI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = 'C4OB'
+FORMAT_VERSION = 1
+
+# Record: canonical position key, position value for the player to move
+RECORD_FORMAT = '>Qh'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+DEFAULT_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.bin')
+
+
+### Exceptions ###
+
+class OpeningBookError(Exception):
+    pass
+
+
+class InvalidOpeningBookError(OpeningBookError):
+    pass
+
+
+class OpeningBook(object):
+    """Read-only view of an opening book file.
+
+    Attributes:
+        max_ply (int): positions with up to this many discs are in the book
+        depth (int): search depth used to compute the values
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as book_file:
+            # mmap can't map an empty file, so short files are turned away before mapping
+            if os.fstat(book_file.fileno()).st_size < HEADER_SIZE:
+                raise InvalidOpeningBookError("%s is too short to be an opening book" % path)
+            self._map = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, width, height, self.max_ply, self.depth, self._count = struct.unpack_from(
+            HEADER_FORMAT, self._map, 0
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise InvalidOpeningBookError("%s isn't a version %d opening book" % (path, FORMAT_VERSION))
+        if (width, height) != (WIDTH, HEIGHT):
+            raise InvalidOpeningBookError("%s was built for a %dx%d board" % (path, width, height))
+        if len(self._map) != HEADER_SIZE + self._count * RECORD_SIZE:
+            raise InvalidOpeningBookError("%s is truncated" % path)
+
+    @classmethod
+    def open_if_exists(cls, path=DEFAULT_BOOK_PATH):
+        """Open the book at `path`, or return None if there's no such file."""
+        if not os.path.exists(path):
+            return None
+
+        return cls(path)
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key):
+        """Look up a position's value.
+
+        Args:
+            key (int): canonical key of the position (see `solver.canonical_key()`)
+
+        Returns:
+            The position's value for the player to move, or None if it isn't in the book
+        """
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, value = struct.unpack_from(RECORD_FORMAT, self._map, HEADER_SIZE + middle * RECORD_SIZE)
+            if record_key < key:
+                low = middle + 1
+            elif record_key > key:
+                high = middle
+            else:
+                return value
+
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+def open_default_book(path=DEFAULT_BOOK_PATH):
+    """Open the book the app plays with, if there's a usable one.
+
+    Returns:
+        The `OpeningBook` at `path`, or None if there's no such file or it isn't a valid book, in which
+        case the solver searches every position itself
+    """
+    try:
+        return OpeningBook.open_if_exists(path)
+    except InvalidOpeningBookError as e:
+        sys.stderr.write("Not using the opening book: %s\n" % e)
+        return None
+
+
+def _canonical_positions(max_ply):
+    """Generate (position, mask, moves) for one representative of every non-terminal position up to `max_ply`."""
+    frontier = {position_key(0, 0): (0, 0)}
+    for moves in xrange(max_ply + 1):
+        next_frontier = {}
+        for position, mask in frontier.itervalues():
+            yield position, mask, moves
+            if moves == max_ply or moves == MAX_MOVES:
+                continue
+
+            for column_index in xrange(WIDTH):
+                if mask & top_mask(column_index):
+                    continue
+
+                new_mask = mask | (mask + bottom_mask(column_index))
+                if has_alignment(position | (new_mask ^ mask)):
+                    # The game is over, so there's nothing to look up
+                    continue
+
+                new_position = position ^ mask
+                key = position_key(new_position, new_mask)
+                if key in next_frontier or mirror_key(key) in next_frontier:
+                    continue
+                next_frontier[key] = (new_position, new_mask)
+
+        frontier = next_frontier
+
+
+def build_opening_book(path, max_ply, depth, log=None):
+    """Solve every position up to `max_ply` discs and write the book to `path`.
+
+    Args:
+        path (str): output file path
+        max_ply (int): largest number of discs on the board for positions in the book
+        depth (int): search depth for each position
+
+    Returns:
+        the number of positions in the book
+    """
+    solver = Solver()
+    records = []
+    start = time.time()
+    for position, mask, moves in _canonical_positions(max_ply):
+        result = solver.search_position(position, mask, max_depth=depth)
+        records.append((canonical_key(position, mask), result.score))
+        if log and len(records) % 1000 == 0:
+            log("%d positions solved (ply %d, %.1fs)" % (len(records), moves, time.time() - start))
+
+    records.sort()
+
+    # Write next to the destination and rename, so readers never see a half-written book
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as book_file:
+        book_file.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, WIDTH, HEIGHT, max_ply, depth, len(records)))
+        for key, value in records:
+            book_file.write(struct.pack(RECORD_FORMAT, key, value))
+    os.rename(temporary_path, path)
+
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a Connect Four opening book.")
+    parser.add_argument('path', nargs='?', default=DEFAULT_BOOK_PATH, help="output file")
+    parser.add_argument('--ply', type=int, default=6, help="include positions with up to this many discs")
+    parser.add_argument('--depth', type=int, default=8, help="search depth for each position")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+
+    count = build_opening_book(args.path, args.ply, args.depth, log=log)
+    log("Wrote %d positions to %s" % (count, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from board_model import (
+    Board,
+    DiscType,
+)
+from opening_book import (
+    InvalidOpeningBookError,
+    OpeningBook,
+    build_opening_book,
+    open_default_book,
+)
+from solver import (
+    Solver,
+    canonical_key,
+    mirror_key,
+    position_key,
+)
+
+
+class OpeningBookTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_and_lookup(self):
+        # 1 + 4 + 25 positions after folding mirror images
+        count = build_opening_book(self.path, max_ply=2, depth=3)
+        self.assertEqual(count, 30)
+
+        book = OpeningBook(self.path)
+        self.assertEqual(len(book), count)
+        self.assertEqual(book.max_ply, 2)
+        self.assertEqual(book.depth, 3)
+
+        board = Board()
+        board.drop_disc(1, DiscType.PLAYER_1)
+        player_1_bitboard, player_2_bitboard = board.bitboards
+        mask = player_1_bitboard | player_2_bitboard
+        value = book.get(canonical_key(player_2_bitboard, mask))
+        self.assertIsNotNone(value)
+
+        # Mirror images share their entry
+        key = position_key(player_2_bitboard, mask)
+        self.assertEqual(canonical_key(player_2_bitboard, mask), min(key, mirror_key(key)))
+        self.assertEqual(mirror_key(mirror_key(key)), key)
+
+        # Positions deeper than the book aren't in it
+        board.drop_disc(1, DiscType.PLAYER_2)
+        board.drop_disc(1, DiscType.PLAYER_1)
+        player_1_bitboard, player_2_bitboard = board.bitboards
+        self.assertIsNone(book.get(canonical_key(player_2_bitboard, player_1_bitboard | player_2_bitboard)))
+        book.close()
+
+    def test_solver_uses_book(self):
+        build_opening_book(self.path, max_ply=2, depth=3)
+        book = OpeningBook(self.path)
+
+        # A depth-3 book answers the root of a depth-4 search
+        result = Solver(book=book).search(Board(), max_depth=4)
+        self.assertEqual(result.nodes, 0)
+        self.assertEqual(result.depth, 4)
+        self.assertIn(result.column_index, xrange(Board.WIDTH))
+        book.close()
+
+    def test_solver_searches_past_shallow_book(self):
+        build_opening_book(self.path, max_ply=2, depth=1)
+        book = OpeningBook(self.path)
+        board = Board()
+        board.drop_disc(3, DiscType.PLAYER_1)
+
+        expected = Solver().search(board, max_depth=12)
+        result = Solver(book=book).search(board, max_depth=12)
+        self.assertEqual((result.column_index, result.score, result.depth), expected[:3])
+        self.assertGreater(result.nodes, 0)
+        book.close()
+
+    def test_invalid_book(self):
+        with open(self.path, 'wb') as book_file:
+            book_file.write('not a book at all')
+
+        with self.assertRaises(InvalidOpeningBookError):
+            OpeningBook(self.path)
+
+        # An empty file can't even be mapped
+        open(self.path, 'wb').close()
+        with self.assertRaises(InvalidOpeningBookError):
+            OpeningBook.open_if_exists(self.path)
+
+        # The app plays without a book rather than failing to start
+        self.assertIsNone(open_default_book(self.path))
+
+        self.assertIsNone(OpeningBook.open_if_exists(os.path.join(self.directory, 'missing.bin')))
@@ -0,0 +1,211 @@
+"""Perft: count the positions reachable at each ply, to check and time the board's move generation.
+
+Starting from a grid, every level of the game tree is generated with `Board.drop_disc()` and `Board.is_winning_disc()`
+breadth first. Positions reached by different move orders are counted once, so the counts are the number of distinct
+positions after each ply; games that are won, or boards that are full, are counted but not played on. Mirror images
+are stored as a single canonical position (weighing two, unless the position is symmetric), which halves the work;
+that's only sound when the starting position is its own mirror image, like the empty board, so other grids are
+searched without folding.
+
+Each level's positions are split into chunks that a pool of worker processes expands; the parent merges their
+children, which is where positions reached from different chunks get deduplicated. From the empty standard board the
+counts are checked against the known numbers of Connect Four positions (OEIS A212693).
+
+Count positions up to 8 plies with:
+
+    python perft.py --ply 8
+    python perft.py --ply 6 --grid '[[0, 0, 0, 0, 0, 0, 0], ..., [0, 0, 0, 1, 0, 0, 0]]'
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+from collections import namedtuple
+
+from board_model import STANDARD_VARIANT, Board, BoardException, DiscType
+
+
+# Distinct positions after each ply from the empty standard board
+KNOWN_POSITION_COUNTS = (
+    1, 7, 49, 238, 1120, 4263, 16422, 54859, 184275, 558186, 1662623, 4568683, 12236101,
+)
+
+# Fewest positions handed to a worker at once
+MIN_CHUNK_SIZE = 1000
+
+
+class PerftLevel(namedtuple('PerftLevel', ['ply', 'positions', 'canonical_positions', 'terminal_positions',
+                                           'nodes', 'elapsed'])):
+    """Counts for one level of the game tree.
+
+    Attributes:
+        ply (int): number of moves played from the starting grid
+        positions (int): distinct positions after `ply` moves
+        canonical_positions (int): positions actually stored; one per mirror image pair when they're folded
+        terminal_positions (int): positions where the game is over
+        nodes (int): moves generated to reach this level, duplicates included
+        elapsed (float): time spent on this level in seconds
+    """
+    __slots__ = ()
+
+    @property
+    def nodes_per_second(self):
+        if not self.elapsed:
+            return float(self.nodes)
+
+        return self.nodes / self.elapsed
+
+
+def mirror_bitboard(bitboard, variant):
+    """Mirror a bitboard left to right."""
+    column_bits = variant.height + 1
+    column_mask = (1 << column_bits) - 1
+    mirrored = 0
+    for _ in xrange(variant.width):
+        mirrored = (mirrored << column_bits) | (bitboard & column_mask)
+        bitboard >>= column_bits
+
+    return mirrored
+
+
+def _canonical(bitboards, variant):
+    """Return the canonical (player 1, player 2) bitboards of a position and how many positions it stands for."""
+    mirrored = (mirror_bitboard(bitboards[0], variant), mirror_bitboard(bitboards[1], variant))
+    if mirrored < bitboards:
+        return mirrored, 2
+
+    return bitboards, 1 if mirrored == bitboards else 2
+
+
+def _is_over(board):
+    """Check if a starting grid already holds a winning line."""
+    for row_index in xrange(board.height):
+        for column_index in xrange(board.width):
+            if board.is_winning_disc(row_index, column_index) is not None:
+                return True
+
+    return board.is_full()
+
+
+def _expand(task):
+    """Play every move from a chunk of positions.
+
+    Returns:
+        A (children, nodes) tuple: stored bitboards => (is terminal, positions they stand for) of the children, and
+        the number of moves played
+    """
+    positions, variant, disc_value, fold_mirrors = task
+    disc_type = DiscType(disc_value)
+    children = {}
+    nodes = 0
+    for player_1_bitboard, player_2_bitboard in positions:
+        board = Board.from_bitboards(player_1_bitboard, player_2_bitboard, *variant)
+        for column_index in board.playable_columns():
+            child = board.copy()
+            row_index, column_index = child.drop_disc(column_index, disc_type)
+            nodes += 1
+            if fold_mirrors:
+                key, weight = _canonical(child.bitboards, variant)
+            else:
+                key, weight = child.bitboards, 1
+            if key not in children:
+                children[key] = (child.is_winning_disc(row_index, column_index) is not None or child.is_full(),
+                                 weight)
+
+    return children, nodes
+
+
+def perft(board, max_ply, workers=1):
+    """Count the positions reachable from a board, level by level.
+
+    Args:
+        board (Board): starting position
+        max_ply (int): number of moves to look ahead
+        workers (int): number of worker processes; 1 expands positions in this process
+
+    Yields:
+        A `PerftLevel` per ply, from 0 (the starting position) to `max_ply` or the last ply with any positions
+    """
+    variant = board.variant
+    player_1_bitboard, player_2_bitboard = board.bitboards
+    disc_type = DiscType.PLAYER_1 if bin(player_1_bitboard).count('1') == bin(player_2_bitboard).count('1') \
+        else DiscType.PLAYER_2
+    fold_mirrors = _canonical(board.bitboards, variant) == (board.bitboards, 1)
+    frontier = [] if _is_over(board) else [board.bitboards]
+    yield PerftLevel(0, 1, 1, 1 - len(frontier), 0, 0.0)
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for ply in xrange(1, max_ply + 1):
+            if not frontier:
+                return
+
+            start = time.time()
+            chunk_size = max(MIN_CHUNK_SIZE, len(frontier) // (workers * 4) + 1)
+            tasks = [
+                (frontier[index:index + chunk_size], variant, disc_type.value, fold_mirrors)
+                for index in xrange(0, len(frontier), chunk_size)
+            ]
+            results = pool.imap_unordered(_expand, tasks) if pool else itertools.imap(_expand, tasks)
+
+            level = {}
+            nodes = 0
+            for children, chunk_nodes in results:
+                level.update(children)
+                nodes += chunk_nodes
+
+            positions = sum(weight for _, weight in level.itervalues())
+            frontier = [key for key, (terminal, _) in level.iteritems() if not terminal]
+            yield PerftLevel(ply, positions, len(level), len(level) - len(frontier), nodes, time.time() - start)
+            disc_type = DiscType.PLAYER_2 if disc_type == DiscType.PLAYER_1 else DiscType.PLAYER_1
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count the Connect Four positions reachable at each ply.")
+    parser.add_argument('--ply', type=int, default=8, help="number of moves to look ahead")
+    parser.add_argument('--grid', type=json.loads, help="starting grid as JSON, row 0 at the top (default: empty)")
+    parser.add_argument('--width', type=int, default=STANDARD_VARIANT.width, help="number of columns")
+    parser.add_argument('--height', type=int, default=STANDARD_VARIANT.height, help="number of rows")
+    parser.add_argument('--connect', type=int, default=STANDARD_VARIANT.connect, help="discs in a row that win")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    if args.grid is None:
+        board = Board(None, args.width, args.height, args.connect)
+    else:
+        try:
+            board = Board(args.grid, len(args.grid[0]), len(args.grid), args.connect)
+        except (BoardException, AssertionError, IndexError, TypeError) as e:
+            parser.error("Invalid grid: %s" % (e.message or type(e).__name__))
+
+    # Known counts only apply from the empty standard board
+    known_counts = KNOWN_POSITION_COUNTS if board.variant == STANDARD_VARIANT and not any(board.bitboards) else ()
+
+    print("%4s %12s %12s %12s %12s %12s" % ('ply', 'positions', 'canonical', 'terminal', 'nodes', 'nodes/sec'))
+    mismatches = 0
+    for level in perft(board, args.ply, workers=args.workers or multiprocessing.cpu_count()):
+        check = ''
+        if level.ply < len(known_counts):
+            if level.positions == known_counts[level.ply]:
+                check = 'ok'
+            else:
+                check = 'MISMATCH: expected %d' % known_counts[level.ply]
+                mismatches += 1
+
+        print("%4d %12d %12d %12d %12d %12.0f %s" % (
+            level.ply, level.positions, level.canonical_positions, level.terminal_positions, level.nodes,
+            level.nodes_per_second, check,
+        ))
+        sys.stdout.flush()
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import unittest
+
+from board_model import Board, DiscType
+from perft import KNOWN_POSITION_COUNTS, mirror_bitboard, perft
+
+
+def brute_force_counts(board, max_ply):
+    """Distinct positions per ply, found without folding mirror images."""
+    counts = [1]
+    frontier = {board.bitboards: board}
+    for ply in xrange(max_ply):
+        disc_type = DiscType.PLAYER_1 if ply % 2 == 0 else DiscType.PLAYER_2
+        level = {}
+        for position in frontier.itervalues():
+            for column_index in position.playable_columns():
+                child = position.copy()
+                child.drop_disc(column_index, disc_type)
+                level[child.bitboards] = child
+        counts.append(len(level))
+        frontier = dict(
+            (key, child) for key, child in level.iteritems()
+            if not child.is_full() and not any(
+                child.is_winning_disc(row_index, column_index) for row_index in xrange(child.height)
+                for column_index in xrange(child.width)
+            )
+        )
+
+    return counts
+
+
+class PerftTests(unittest.TestCase):
+    def test_known_counts(self):
+        levels = list(perft(Board(), 6))
+        self.assertEqual([level.positions for level in levels], list(KNOWN_POSITION_COUNTS[:7]))
+        self.assertEqual([level.canonical_positions for level in levels], [1, 4, 25, 121, 568, 2144, 8231])
+        self.assertEqual(levels[6].nodes, 15008)
+
+    def test_workers(self):
+        self.assertEqual(
+            [level[:5] for level in perft(Board(), 5, workers=2)],
+            [level[:5] for level in perft(Board(), 5)],
+        )
+
+    def test_small_board(self):
+        board = Board(width=4, height=4, connect=3)
+        levels = list(perft(board, 10))
+        self.assertEqual([level.positions for level in levels], brute_force_counts(board, 10))
+        self.assertTrue(any(level.terminal_positions for level in levels))
+
+        # Mirror images aren't folded from a lopsided start
+        board = Board([
+            [0, 0, 0, 0],
+            [0, 0, 0, 0],
+            [0, 0, 0, 0],
+            [2, 0, 0, 1],
+        ], width=4, height=4, connect=3)
+        levels = list(perft(board, 6))
+        self.assertEqual([level.positions for level in levels], brute_force_counts(board, 6))
+
+    def test_game_over(self):
+        board = Board([
+            [0, 0, 0, 0],
+            [1, 0, 0, 0],
+            [1, 2, 0, 0],
+            [1, 2, 2, 0],
+        ], width=4, height=4, connect=3)
+        levels = list(perft(board, 3))
+        self.assertEqual(len(levels), 1)
+        self.assertEqual(levels[0].terminal_positions, 1)
+
+    def test_mirror_bitboard(self):
+        board = Board()
+        board.drop_disc(0, DiscType.PLAYER_1)
+        board.drop_disc(0, DiscType.PLAYER_2)
+        mirrored = Board()
+        mirrored.drop_disc(6, DiscType.PLAYER_1)
+        mirrored.drop_disc(6, DiscType.PLAYER_2)
+        self.assertEqual(
+            tuple(mirror_bitboard(bitboard, board.variant) for bitboard in board.bitboards), mirrored.bitboards,
+        )
@@ -0,0 +1,22 @@
+#!/bin/sh
+# Run several app instances against the local Redis to try the multi-process setup.
+#
+#   ./run_workers.sh [instances] [first port]
+#
+# Each instance listens on its own port. Open a game on one port and join it from another to see moves relayed
+# between processes. Ctrl-C stops them all.
+
+INSTANCES=${1:-2}
+FIRST_PORT=${2:-5001}
+
+trap 'kill 0' INT TERM
+
+i=0
+while [ $i -lt $INSTANCES ]; do
+    port=$((FIRST_PORT + i))
+    echo "Starting instance on http://localhost:$port"
+    gunicorn -c gunicorn_config.py --bind 127.0.0.1:$port app:app &
+    i=$((i + 1))
+done
+
+wait
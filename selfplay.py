@@ -0,0 +1,505 @@
+"""Self-play: simulate games between two policies and record them.
+
+Games are spread over a process pool in fixed-size chunks. Each chunk has its own seed and its own policy instances,
+so a run's output only depends on its seed, whatever the number of workers, and workers share nothing but the chunk
+they're handed and the packed records they send back. The parent appends those records, in chunk order, to a record
+file and adds up the statistics.
+
+Record files are append-only: a header naming the board variant and the matchup, then one record per game holding
+the result, the move count and the columns played, packed 3 bits apiece (4 for boards wider than 8 columns). Running
+again with the same path, variant and matchup adds more games to the file.
+
+Simulate games and print first-player win rates with:
+
+    python selfplay.py games.bin --games 100000 --players greedy greedy
+    python selfplay.py games.bin --players solver:4 solver:4 --opening-plies 2
+
+and print the statistics of an existing file with:
+
+    python selfplay.py games.bin --summary
+"""
+import argparse
+import binascii
+import itertools
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from board_model import STANDARD_VARIANT, Board, BoardVariant, DiscType
+from solver import Solver
+
+
+# Header: magic, format version, board width, board height, discs to connect, bits per move, matchup length
+HEADER_FORMAT = '>4sHBBBBH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = 'C4SP'
+FORMAT_VERSION = 1
+
+# Record: result (0 for a draw, otherwise the winner's position), move count; followed by the packed moves
+RECORD_FORMAT = '>BH'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+DRAW = 0
+
+# Games per task handed to a worker; large enough that a task takes far longer than sending it back and forth
+DEFAULT_CHUNK_SIZE = 200
+
+
+### Exceptions ###
+
+class SelfPlayError(Exception):
+    pass
+
+
+class InvalidRecordFileError(SelfPlayError):
+    pass
+
+
+class UnknownPolicyError(SelfPlayError):
+    pass
+
+
+### Policies ###
+
+class Policy(object):
+    """Chooses the moves of one side of a game."""
+
+    def supports(self, variant):
+        return True
+
+    def choose_column(self, board, disc_type, rng):
+        """Pick a column to drop a disc in.
+
+        Args:
+            board (Board): current position, which mustn't be modified
+            disc_type (DiscType): player to move
+            rng (random.Random): the game's random number generator
+
+        Returns:
+            The index of a column that isn't full
+        """
+        raise NotImplementedError
+
+
+class RandomPolicy(Policy):
+    """Plays any column that isn't full."""
+
+    def choose_column(self, board, disc_type, rng):
+        return rng.choice(board.playable_columns())
+
+
+class GreedyPolicy(Policy):
+    """Wins if it can, otherwise blocks the opponent's win, otherwise plays a random move that doesn't set one up."""
+
+    def choose_column(self, board, disc_type, rng):
+        columns = board.playable_columns()
+        opponent = _opponent(disc_type)
+        for player in (disc_type, opponent):
+            for column_index in columns:
+                if board.is_winning_move(column_index, player):
+                    return column_index
+
+        safe_columns = [column_index for column_index in columns if not _sets_up(board, column_index, disc_type)]
+        return rng.choice(safe_columns or columns)
+
+
+class SolverPolicy(Policy):
+    """Plays the solver's move at a fixed search depth."""
+
+    def __init__(self, depth=4):
+        self.depth = depth
+        self.solver = Solver()
+
+    def supports(self, variant):
+        return variant == STANDARD_VARIANT
+
+    def choose_column(self, board, disc_type, rng):
+        return self.solver.search(board, disc_type, max_depth=self.depth).column_index
+
+
+# Policies by the name used on the command line; `name:argument` passes an integer argument, e.g. `solver:6`
+POLICIES = {
+    'random': RandomPolicy,
+    'greedy': GreedyPolicy,
+    'solver': SolverPolicy,
+}
+
+
+def make_policy(spec):
+    """Create a policy from its spec, e.g. 'random' or 'solver:4'.
+
+    Raises:
+        UnknownPolicyError: if there's no such policy or its argument isn't an integer
+    """
+    name, _, argument = spec.partition(':')
+    policy_class = POLICIES.get(name)
+    if policy_class is None:
+        raise UnknownPolicyError("Unknown policy %r; choose from %s" % (spec, ', '.join(sorted(POLICIES))))
+    if not argument:
+        return policy_class()
+
+    try:
+        return policy_class(int(argument))
+    except ValueError:
+        raise UnknownPolicyError("Policy %r takes an integer argument" % spec)
+
+
+def _opponent(disc_type):
+    return DiscType.PLAYER_2 if disc_type == DiscType.PLAYER_1 else DiscType.PLAYER_1
+
+
+def _sets_up(board, column_index, disc_type):
+    """Check if playing a column lets the opponent win by playing on top of it."""
+    board = board.copy()
+    board.drop_disc(column_index, disc_type)
+    return board.is_winning_move(column_index, _opponent(disc_type))
+
+
+### Records ###
+
+GameRecord = namedtuple('GameRecord', ['moves', 'result'])
+
+
+def bits_per_move(variant):
+    return max(3, (variant.width - 1).bit_length())
+
+
+def pack_moves(moves, bits):
+    """Pack column indices into a byte string, `bits` bits apiece, padding the last byte with zeros."""
+    value = 0
+    for column_index in moves:
+        value = (value << bits) | column_index
+
+    bit_count = len(moves) * bits
+    byte_count = (bit_count + 7) // 8
+    if not byte_count:
+        return ''
+
+    return binascii.unhexlify('%0*x' % (byte_count * 2, value << (byte_count * 8 - bit_count)))
+
+
+def unpack_moves(data, move_count, bits):
+    """Reverse `pack_moves()`."""
+    if not move_count:
+        return []
+
+    value = int(binascii.hexlify(data), 16) >> (len(data) * 8 - move_count * bits)
+    mask = (1 << bits) - 1
+    return [(value >> (bits * (move_count - 1 - index))) & mask for index in xrange(move_count)]
+
+
+def pack_record(moves, result, bits):
+    return struct.pack(RECORD_FORMAT, result, len(moves)) + pack_moves(moves, bits)
+
+
+class RecordReader(object):
+    """Iterates over the games in a record file.
+
+    A run that was killed can leave a partial record at the end of the file; iteration stops before it.
+
+    Attributes:
+        variant (BoardVariant): board variant the games were played on
+        matchup (str): policy specs of the first and second player, e.g. 'greedy vs solver:4'
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as record_file:
+            header = record_file.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise InvalidRecordFileError("%s is too short to be a self-play record file" % path)
+
+            magic, version, width, height, connect, self.bits_per_move, matchup_length = struct.unpack(
+                HEADER_FORMAT, header
+            )
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise InvalidRecordFileError("%s isn't a version %d self-play record file" % (path, FORMAT_VERSION))
+
+            self.matchup = record_file.read(matchup_length)
+            if len(self.matchup) < matchup_length:
+                raise InvalidRecordFileError("%s is truncated" % path)
+
+        self.variant = BoardVariant(width, height, connect)
+        self._data_offset = HEADER_SIZE + matchup_length
+
+    def __iter__(self):
+        for record, _ in self._scan():
+            yield record
+
+    def complete_length(self):
+        """Size of the file up to the end of its last complete record."""
+        end = self._data_offset
+        for _, end in self._scan():
+            pass
+
+        return end
+
+    def _scan(self):
+        """Yield a (record, offset of the record's end) tuple per complete record."""
+        bits = self.bits_per_move
+        with open(self.path, 'rb') as record_file:
+            record_file.seek(self._data_offset)
+            offset = self._data_offset
+            while True:
+                head = record_file.read(RECORD_SIZE)
+                if len(head) < RECORD_SIZE:
+                    return
+
+                result, move_count = struct.unpack(RECORD_FORMAT, head)
+                size = (move_count * bits + 7) // 8
+                data = record_file.read(size)
+                if len(data) < size:
+                    return
+
+                offset += RECORD_SIZE + size
+                yield GameRecord(unpack_moves(data, move_count, bits), result), offset
+
+
+class RecordWriter(object):
+    """Appends packed records to a record file, creating it if needed.
+
+    Raises:
+        InvalidRecordFileError: if the file already holds games of another variant or matchup
+    """
+
+    def __init__(self, path, variant, matchup):
+        self.bits_per_move = bits_per_move(variant)
+        if os.path.exists(path) and os.path.getsize(path):
+            reader = RecordReader(path)
+            if (reader.variant, reader.matchup) != (variant, matchup):
+                raise InvalidRecordFileError(
+                    "%s holds %s games on a %dx%d board (connect %d)" % ((path, reader.matchup) + reader.variant)
+                )
+
+            # Drop a partial record left by a killed run, so the new records line up
+            end = reader.complete_length()
+            self._file = open(path, 'r+b')
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(struct.pack(
+                HEADER_FORMAT, MAGIC, FORMAT_VERSION, variant.width, variant.height, variant.connect,
+                self.bits_per_move, len(matchup),
+            ) + matchup)
+
+    def write(self, data):
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+### Statistics ###
+
+class SelfPlayStats(object):
+    """Results of a set of games, overall and by the first player's opening column."""
+
+    def __init__(self):
+        self.games = 0
+        self.moves = 0
+        # Indexed by result: draws, player 1 wins, player 2 wins
+        self.results = [0, 0, 0]
+        # Opening column index => [games, player 1 wins]
+        self.openings = {}
+
+    def add(self, moves, result):
+        self.games += 1
+        self.moves += len(moves)
+        self.results[result] += 1
+        opening = self.openings.setdefault(moves[0], [0, 0])
+        opening[0] += 1
+        if result == DiscType.PLAYER_1.value:
+            opening[1] += 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.moves += other.moves
+        self.results = [count + other_count for count, other_count in zip(self.results, other.results)]
+        for column_index, (games, wins) in other.openings.iteritems():
+            opening = self.openings.setdefault(column_index, [0, 0])
+            opening[0] += games
+            opening[1] += wins
+
+    def first_player_win_rate(self):
+        return self.results[DiscType.PLAYER_1.value] / float(self.games) if self.games else 0.0
+
+    def format(self):
+        """Describe the statistics in a few lines of text."""
+        if not self.games:
+            return "No games"
+
+        draws, player_1_wins, player_2_wins = (count * 100.0 / self.games for count in self.results)
+        lines = [
+            "Games: %d, average length %.1f moves" % (self.games, self.moves / float(self.games)),
+            "Player 1 wins: %.2f%%, player 2 wins: %.2f%%, draws: %.2f%%" % (player_1_wins, player_2_wins, draws),
+            "Player 1 win rate by opening column:",
+        ]
+        for column_index, (games, wins) in sorted(self.openings.iteritems()):
+            lines.append("  %d: %.2f%% of %d games" % (column_index, wins * 100.0 / games, games))
+
+        return '\n'.join(lines)
+
+
+def summarize(path):
+    """Compute the statistics of the games in a record file."""
+    stats = SelfPlayStats()
+    for record in RecordReader(path):
+        stats.add(record.moves, record.result)
+
+    return stats
+
+
+### Simulation ###
+
+def play_game(policies, rng, variant=STANDARD_VARIANT, opening_plies=0):
+    """Play a game between two policies.
+
+    Args:
+        policies (tuple): policies of player 1 and player 2
+        rng (random.Random): random number generator for the policies and the opening
+        variant (BoardVariant): board to play on
+        opening_plies (int): number of random moves to start the game with, so deterministic policies play a
+            variety of games
+
+    Returns:
+        A (moves, result) tuple: the list of column indices played and 0 for a draw, otherwise the winner's position
+    """
+    board = Board(None, *variant)
+    disc_types = (DiscType.PLAYER_1, DiscType.PLAYER_2)
+    moves = []
+    while True:
+        player_index = len(moves) % 2
+        disc_type = disc_types[player_index]
+        if len(moves) < opening_plies:
+            column_index = rng.choice(board.playable_columns())
+        else:
+            column_index = policies[player_index].choose_column(board, disc_type, rng)
+
+        row_index, column_index = board.drop_disc(column_index, disc_type)
+        moves.append(column_index)
+        if board.is_winning_disc(row_index, column_index) is not None:
+            return moves, disc_type.value
+        if board.is_full():
+            return moves, DRAW
+
+
+def _play_chunk(task):
+    """Play a chunk of games in a worker; returns the packed records and their statistics."""
+    seed, game_count, policy_specs, variant, opening_plies = task
+    rng = random.Random(seed)
+    # Fresh policies per chunk, so results don't depend on which chunks a worker happened to play before
+    policies = [make_policy(spec) for spec in policy_specs]
+    bits = bits_per_move(variant)
+    stats = SelfPlayStats()
+    records = []
+    for _ in xrange(game_count):
+        moves, result = play_game(policies, rng, variant, opening_plies)
+        stats.add(moves, result)
+        records.append(pack_record(moves, result, bits))
+
+    return ''.join(records), stats
+
+
+def run_selfplay(path, games, policy_specs, variant=STANDARD_VARIANT, workers=None, seed=None, opening_plies=0,
+                 chunk_size=DEFAULT_CHUNK_SIZE, log=None):
+    """Play games between two policies and append them to a record file.
+
+    Args:
+        path (str): record file path
+        games (int): number of games to play
+        policy_specs (tuple): policy specs of player 1 and player 2, e.g. ('greedy', 'solver:4')
+        variant (BoardVariant): board to play on
+        workers (int): number of worker processes. Defaults to the number of CPUs; 1 plays in this process.
+        seed (int): seed for reproducible games
+        opening_plies (int): number of random moves each game starts with
+        chunk_size (int): games per task handed to a worker
+
+    Returns:
+        the `SelfPlayStats` of the games played
+
+    Raises:
+        UnknownPolicyError: if a policy spec is unknown
+        InvalidRecordFileError: if the file already holds games of another variant or matchup
+    """
+    for spec in policy_specs:
+        if not make_policy(spec).supports(variant):
+            raise UnknownPolicyError("Policy %r can't play a %dx%d board (connect %d)" % ((spec,) + variant))
+
+    workers = workers or multiprocessing.cpu_count()
+    seeds = random.Random(seed)
+    tasks = (
+        (seeds.getrandbits(64), min(chunk_size, games - start), tuple(policy_specs), variant, opening_plies)
+        for start in xrange(0, games, chunk_size)
+    )
+
+    stats = SelfPlayStats()
+    start = time.time()
+    with RecordWriter(path, variant, ' vs '.join(policy_specs)) as writer:
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            # `imap` hands back chunks in order, so the file doesn't depend on which worker finishes first
+            results = pool.imap(_play_chunk, tasks) if pool else itertools.imap(_play_chunk, tasks)
+            for data, chunk_stats in results:
+                writer.write(data)
+                stats.merge(chunk_stats)
+                if log:
+                    elapsed = time.time() - start
+                    log("%d games played (%.1fs, %.0f games/sec)" % (stats.games, elapsed, stats.games / elapsed))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Connect Four games between two policies.")
+    parser.add_argument('path', help="record file; new games are appended to it")
+    parser.add_argument('--games', type=int, default=1000, help="number of games to play")
+    parser.add_argument('--players', nargs=2, default=['random', 'random'], metavar=('FIRST', 'SECOND'),
+                        help="policies of the two players: %s, optionally with an integer argument like solver:4"
+                        % ', '.join(sorted(POLICIES)))
+    parser.add_argument('--width', type=int, default=STANDARD_VARIANT.width, help="number of columns")
+    parser.add_argument('--height', type=int, default=STANDARD_VARIANT.height, help="number of rows")
+    parser.add_argument('--connect', type=int, default=STANDARD_VARIANT.connect, help="discs in a row that win")
+    parser.add_argument('--opening-plies', type=int, default=0,
+                        help="random moves at the start of each game; use it when both policies are deterministic")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--seed', type=int, help="random seed, for reproducible games")
+    parser.add_argument('--summary', action='store_true', help="only print the statistics of the games in the file")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+
+    try:
+        if args.summary:
+            reader = RecordReader(args.path)
+            log("%s on a %dx%d board (connect %d)" % ((reader.matchup,) + reader.variant))
+            stats = summarize(args.path)
+        else:
+            stats = run_selfplay(
+                args.path, args.games, args.players, BoardVariant(args.width, args.height, args.connect),
+                workers=args.workers, seed=args.seed, opening_plies=args.opening_plies, log=log,
+            )
+    except SelfPlayError as e:
+        parser.error(str(e))
+
+    print(stats.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from board_model import STANDARD_VARIANT, Board, BoardVariant, DiscType
+from selfplay import (
+    GreedyPolicy,
+    InvalidRecordFileError,
+    RecordReader,
+    SelfPlayStats,
+    UnknownPolicyError,
+    pack_moves,
+    pack_record,
+    play_game,
+    run_selfplay,
+    summarize,
+    unpack_moves,
+)
+
+
+class SelfPlayTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pack_moves(self):
+        moves = [3, 3, 4, 2, 6, 0, 1, 5, 3]
+        data = pack_moves(moves, 3)
+        # 9 moves of 3 bits fit in 4 bytes
+        self.assertEqual(len(data), 4)
+        self.assertEqual(unpack_moves(data, len(moves), 3), moves)
+        self.assertEqual(unpack_moves(pack_moves(moves + [8], 4), len(moves) + 1, 4), moves + [8])
+        self.assertEqual(pack_moves([], 3), '')
+        self.assertEqual(unpack_moves('', 0, 3), [])
+
+    def test_greedy_policy(self):
+        policy = GreedyPolicy()
+        rng = random.Random(1)
+        board = Board()
+        for column_index in (0, 1, 2):
+            board.drop_disc(column_index, DiscType.PLAYER_1)
+            board.drop_disc(column_index, DiscType.PLAYER_2)
+
+        # Either player completes the bottom row
+        self.assertEqual(policy.choose_column(board, DiscType.PLAYER_1, rng), 3)
+        self.assertEqual(policy.choose_column(board, DiscType.PLAYER_2, rng), 3)
+        # The board isn't modified
+        self.assertEqual(board.playable_columns(), range(Board.WIDTH))
+
+    def test_play_game(self):
+        policies = (GreedyPolicy(), GreedyPolicy())
+        moves, result = play_game(policies, random.Random(7), opening_plies=4)
+        self.assertEqual(play_game(policies, random.Random(7), opening_plies=4), (moves, result))
+
+        board = Board()
+        for index, column_index in enumerate(moves):
+            last_disc = board.drop_disc(column_index, DiscType.PLAYER_1 if index % 2 == 0 else DiscType.PLAYER_2)
+        self.assertEqual(board.is_winning_disc(*last_disc) or 0, result)
+
+    def test_run_selfplay(self):
+        stats = run_selfplay(self.path, 25, ('random', 'greedy'), workers=1, seed=3, chunk_size=10)
+        self.assertEqual(stats.games, 25)
+        self.assertEqual(sum(stats.results), 25)
+
+        reader = RecordReader(self.path)
+        self.assertEqual(reader.variant, STANDARD_VARIANT)
+        self.assertEqual(reader.matchup, 'random vs greedy')
+        records = list(reader)
+        self.assertEqual(len(records), 25)
+        self.assertEqual(sum(len(record.moves) for record in records), stats.moves)
+        self.assertEqual(summarize(self.path).results, stats.results)
+
+        # The games only depend on the seed, not on the number of workers
+        other_path = os.path.join(self.directory, 'other.bin')
+        run_selfplay(other_path, 25, ('random', 'greedy'), workers=2, seed=3, chunk_size=10)
+        self.assertEqual(list(RecordReader(other_path)), records)
+
+        # Runs append to the file
+        run_selfplay(self.path, 5, ('random', 'greedy'), workers=1, seed=4)
+        self.assertEqual(summarize(self.path).games, 30)
+
+    def test_append(self):
+        run_selfplay(self.path, 3, ('random', 'random'), workers=1, seed=1)
+        with self.assertRaises(InvalidRecordFileError):
+            run_selfplay(self.path, 3, ('random', 'greedy'), workers=1)
+        with self.assertRaises(InvalidRecordFileError):
+            run_selfplay(self.path, 3, ('random', 'random'), BoardVariant(9, 7, 4), workers=1)
+
+        # A partial record left by a killed run is dropped before appending
+        with open(self.path, 'ab') as record_file:
+            record_file.write(pack_record([3, 3, 3, 3, 3], 0, 3)[:-1])
+        self.assertEqual(summarize(self.path).games, 3)
+        run_selfplay(self.path, 2, ('random', 'random'), workers=1, seed=2)
+        self.assertEqual(summarize(self.path).games, 5)
+
+    def test_variant(self):
+        variant = BoardVariant(9, 7, 4)
+        run_selfplay(self.path, 10, ('greedy', 'greedy'), variant, workers=1, seed=5)
+        reader = RecordReader(self.path)
+        self.assertEqual(reader.variant, variant)
+        self.assertEqual(reader.bits_per_move, 4)
+        self.assertEqual(len(list(reader)), 10)
+
+        with self.assertRaises(UnknownPolicyError):
+            run_selfplay(self.path, 1, ('solver:2', 'greedy'), variant, workers=1)
+        with self.assertRaises(UnknownPolicyError):
+            run_selfplay(self.path, 1, ('minimax', 'greedy'), workers=1)
+
+    def test_stats(self):
+        stats = SelfPlayStats()
+        stats.add([3, 3, 3, 3, 3, 3, 3], DiscType.PLAYER_1.value)
+        stats.add([3, 2], 0)
+        other = SelfPlayStats()
+        other.add([0, 1, 0, 1, 0, 1, 0], DiscType.PLAYER_1.value)
+        other.add([3, 4, 3, 4, 3, 4, 2, 4], DiscType.PLAYER_2.value)
+        stats.merge(other)
+
+        self.assertEqual(stats.games, 4)
+        self.assertEqual(stats.moves, 24)
+        self.assertEqual(stats.results, [1, 2, 1])
+        self.assertEqual(stats.openings, {0: [1, 1], 3: [3, 1]})
+        self.assertEqual(stats.first_player_win_rate(), 0.5)
@@ -0,0 +1,524 @@
+import time
+from collections import namedtuple
+
+from board_model import (
+    STANDARD_VARIANT,
+    Board,
+    DiscType,
+)
+
+
+WIDTH = Board.WIDTH
+HEIGHT = Board.HEIGHT
+MAX_MOVES = WIDTH * HEIGHT
+
+# Scores above `WIN_THRESHOLD` (or below its negation) are proven wins (losses). Quicker wins score higher.
+WIN_SCORE = 10000
+WIN_THRESHOLD = WIN_SCORE - MAX_MOVES - 1
+
+_BOTTOM_MASK = sum(1 << (column_index * (HEIGHT + 1)) for column_index in xrange(WIDTH))
+_BOARD_MASK = _BOTTOM_MASK * ((1 << HEIGHT) - 1)
+
+# Explore the center columns first: they take part in the most lines, so they tend to produce cutoffs early
+_COLUMN_ORDER = sorted(xrange(WIDTH), key=lambda column_index: abs(WIDTH // 2 - column_index))
+
+# Transposition table entry flags
+_EXACT = 0
+_LOWER_BOUND = 1
+_UPPER_BOUND = 2
+
+# How many nodes to search between two budget checks
+_BUDGET_CHECK_INTERVAL = 256
+
+
+### Exceptions ###
+
+class SolverError(Exception):
+    pass
+
+
+class NoLegalMoveError(SolverError):
+    pass
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+### Bitboard helpers ###
+#
+# The solver works on a (position, mask) pair: `position` has the discs of the player to move and `mask` has every
+# disc on the board, both in the `Board` bitboard layout. Playing a move is then `position ^ mask` (the opponent's
+# discs) with the new disc added to `mask`.
+
+def bottom_mask(column_index):
+    return 1 << (column_index * (HEIGHT + 1))
+
+
+def top_mask(column_index):
+    return 1 << (HEIGHT - 1 + column_index * (HEIGHT + 1))
+
+
+def _column_mask(column_index):
+    return ((1 << HEIGHT) - 1) << (column_index * (HEIGHT + 1))
+
+
+def has_alignment(position):
+    for shift in (1, HEIGHT + 1, HEIGHT, HEIGHT + 2):
+        pairs = position & (position >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+
+    return False
+
+
+def _winning_slots(position, mask):
+    """Bitmask of the empty slots that would complete four in a row for `position`."""
+    # Vertical
+    slots = (position << 1) & (position << 2) & (position << 3)
+
+    # Horizontal and both diagonals
+    for shift in (HEIGHT + 1, HEIGHT, HEIGHT + 2):
+        pairs = (position << shift) & (position << (2 * shift))
+        slots |= pairs & (position << (3 * shift))
+        slots |= pairs & (position >> shift)
+        pairs = (position >> shift) & (position >> (2 * shift))
+        slots |= pairs & (position << shift)
+        slots |= pairs & (position >> (3 * shift))
+
+    return slots & (_BOARD_MASK ^ mask)
+
+
+def _popcount(value):
+    return bin(value).count('1')
+
+
+def position_key(position, mask):
+    """Unique integer key for a (position, mask) pair.
+
+    Adding the mask sets the bit just above each column's top disc, which encodes both the column heights and, with
+    `position`, which player owns every disc.
+    """
+    return position + mask
+
+
+def mirror_key(key):
+    """Key of the left-right mirror image of the position with key `key`.
+
+    Each column's part of a key fits in its own `HEIGHT + 1` bits, so mirroring the key is the same as mirroring the
+    position.
+    """
+    column_bits = (1 << (HEIGHT + 1)) - 1
+    mirrored_key = 0
+    for column_index in xrange(WIDTH):
+        column = (key >> (column_index * (HEIGHT + 1))) & column_bits
+        mirrored_key |= column << ((WIDTH - 1 - column_index) * (HEIGHT + 1))
+
+    return mirrored_key
+
+
+def canonical_key(position, mask):
+    """Key shared by a position and its mirror image, which always have the same value."""
+    key = position_key(position, mask)
+    return min(key, mirror_key(key))
+
+
+class SearchResult(namedtuple('SearchResult', ['column_index', 'score', 'depth', 'nodes', 'elapsed'])):
+    """Outcome of a `Solver.search()` call.
+
+    Attributes:
+        column_index (int): best column found for the player to move
+        score (int): score of that move for the player to move; see `is_win()`/`is_loss()` for proven results
+        depth (int): deepest fully-searched iteration
+        nodes (int): number of positions visited
+        elapsed (float): search time in seconds
+    """
+    __slots__ = ()
+
+    @property
+    def nodes_per_second(self):
+        if not self.elapsed:
+            return float(self.nodes)
+
+        return self.nodes / self.elapsed
+
+    def is_win(self):
+        return self.score > WIN_THRESHOLD
+
+    def is_loss(self):
+        return self.score < -WIN_THRESHOLD
+
+
+class AnalysisResult(namedtuple('AnalysisResult', ['scores', 'depth', 'nodes', 'elapsed'])):
+    """Outcome of a `Solver.analyze()` call.
+
+    Attributes:
+        scores (dict): column index => score of playing that column, for the player to move, for every legal column.
+            Scores above `WIN_THRESHOLD` (below its negation) are proven wins (losses). Empty if the game is over.
+        depth (int): deepest fully-searched iteration
+        nodes (int): number of positions visited
+        elapsed (float): search time in seconds
+    """
+    __slots__ = ()
+
+    @property
+    def best_column_index(self):
+        """Highest scoring column, preferring central ones, or None if the game is over."""
+        columns = [column_index for column_index in _COLUMN_ORDER if column_index in self.scores]
+        if not columns:
+            return None
+
+        return max(columns, key=self.scores.get)
+
+    def mirrored(self):
+        """The analysis of the position's mirror image."""
+        return self._replace(scores=dict(
+            (WIDTH - 1 - column_index, score) for column_index, score in self.scores.iteritems()
+        ))
+
+
+def board_position(board, disc_type=None):
+    """Convert a standard board to the (position, mask) bitboard pair the search works on.
+
+    Args:
+        board (Board): the board
+        disc_type (DiscType): player to move. Defaults to player 1 if both players have the same number of discs,
+            otherwise player 2.
+
+    Returns:
+        A (position, mask) tuple: the discs of the player to move and all discs
+    """
+    assert board.variant == STANDARD_VARIANT, "The solver only plays the standard board"
+    player_1_bitboard, player_2_bitboard = board.bitboards
+    if disc_type is None:
+        disc_type = DiscType.PLAYER_1 if _popcount(player_1_bitboard) == _popcount(player_2_bitboard) \
+            else DiscType.PLAYER_2
+    position = player_1_bitboard if disc_type == DiscType.PLAYER_1 else player_2_bitboard
+
+    return position, player_1_bitboard | player_2_bitboard
+
+
+class TranspositionTable(object):
+    """Fixed-size, always-replace transposition table.
+
+    Entries are stored in a preallocated list indexed by `key % size`, so memory use is bounded regardless of how
+    many positions get searched. Each slot keeps the full key to detect index collisions.
+    """
+
+    def __init__(self, size=(1 << 18) + 3):
+        self.size = size
+        self._entries = [None] * size
+
+    def get(self, key):
+        entry = self._entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+
+        return None
+
+    def put(self, key, depth, flag, value, column_index):
+        self._entries[key % self.size] = (key, depth, flag, value, column_index)
+
+    def clear(self):
+        self._entries = [None] * self.size
+
+
+class Solver(object):
+    """Negamax search with alpha-beta pruning over `Board` positions.
+
+    The search deepens iteratively until it runs out of time or nodes (or reaches the end of the game) and keeps the
+    best move of the last completed iteration. A `Solver` keeps its transposition table between searches, so reusing
+    one instance for consecutive moves of a game is cheaper than creating a new one each time.
+    """
+
+    def __init__(self, table_size=(1 << 18) + 3, book=None):
+        self.table = TranspositionTable(table_size)
+        self.book = book
+        self._nodes = 0
+        self._node_limit = None
+        self._deadline = None
+        self._next_budget_check = 0
+
+    def search(self, board, disc_type=None, max_depth=None, time_budget=None, node_budget=None):
+        """Find the best move for a player.
+
+        Args:
+            board (Board): position to search
+            disc_type (DiscType): player to move. Defaults to player 1 if both players have the same number of discs,
+                otherwise player 2.
+            max_depth (int): maximum search depth in plies. Defaults to the number of empty slots.
+            time_budget (float): optional time limit in seconds
+            node_budget (int): optional limit on the number of visited positions
+
+        Returns:
+            a `SearchResult`
+
+        Raises:
+            NoLegalMoveError: if the board is full
+        """
+        position, mask = board_position(board, disc_type)
+        return self.search_position(position, mask, max_depth=max_depth, time_budget=time_budget,
+                                    node_budget=node_budget)
+
+    def search_position(self, position, mask, max_depth=None, time_budget=None, node_budget=None):
+        """Same as `search()`, for a position given as a (position, mask) bitboard pair.
+
+        Args:
+            position (int): bitboard of the discs of the player to move
+            mask (int): bitboard of all discs on the board
+
+        Returns:
+            a `SearchResult`
+        """
+        moves = _popcount(mask)
+        legal_columns = [column_index for column_index in _COLUMN_ORDER if not mask & top_mask(column_index)]
+        if not legal_columns:
+            raise NoLegalMoveError("The board is full")
+
+        max_depth = self._max_depth(max_depth, moves)
+        start = self._start(time_budget, node_budget)
+
+        book_move = self._probe_book_root(position, mask, moves, max_depth, legal_columns)
+        if book_move is not None:
+            column_index, score = book_move
+            return SearchResult(column_index, score, max_depth, self._nodes, time.time() - start)
+
+        # Fall back to the most central legal move if not even the first iteration completes
+        best = SearchResult(legal_columns[0], 0, 0, 0, 0.0)
+        for depth in xrange(1, max_depth + 1):
+            try:
+                column_index, score = self._search_root(position, mask, moves, depth, legal_columns)
+            except _BudgetExceeded:
+                break
+
+            best = SearchResult(column_index, score, depth, self._nodes, time.time() - start)
+            if abs(score) > WIN_THRESHOLD:
+                # The result is proven; searching deeper can't change it
+                break
+
+        return best._replace(nodes=self._nodes, elapsed=time.time() - start)
+
+    def analyze(self, board, disc_type=None, max_depth=None, time_budget=None, node_budget=None):
+        """Score every legal move of a player, e.g. to give a hint or review a game.
+
+        Unlike `search()`, each column gets an exact score at the searched depth rather than just a bound, which
+        costs a full-window search per column.
+
+        Args:
+            board (Board): position to analyze
+            disc_type (DiscType): player to move, defaulting as in `search()`
+            max_depth (int): maximum search depth in plies. Defaults to the number of empty slots.
+            time_budget (float): optional time limit in seconds
+            node_budget (int): optional limit on the number of visited positions
+
+        Returns:
+            an `AnalysisResult`
+        """
+        position, mask = board_position(board, disc_type)
+        return self.analyze_position(position, mask, max_depth=max_depth, time_budget=time_budget,
+                                     node_budget=node_budget)
+
+    def analyze_position(self, position, mask, max_depth=None, time_budget=None, node_budget=None):
+        """Same as `analyze()`, for a position given as a (position, mask) bitboard pair.
+
+        Args:
+            position (int): bitboard of the discs of the player to move
+            mask (int): bitboard of all discs on the board
+
+        Returns:
+            an `AnalysisResult`
+        """
+        moves = _popcount(mask)
+        legal_columns = [column_index for column_index in _COLUMN_ORDER if not mask & top_mask(column_index)]
+        if not legal_columns or has_alignment(position ^ mask):
+            # The board is full or the opponent has won
+            return AnalysisResult({}, 0, 0, 0.0)
+
+        max_depth = self._max_depth(max_depth, moves)
+        start = self._start(time_budget, node_budget)
+
+        # The first iteration only visits one node per column, so it always completes
+        scores = {}
+        depth = 0
+        for iteration_depth in xrange(1, max_depth + 1):
+            try:
+                scores = self._score_columns(position, mask, moves, iteration_depth, legal_columns)
+            except _BudgetExceeded:
+                break
+
+            depth = iteration_depth
+            if all(abs(score) > WIN_THRESHOLD for score in scores.itervalues()):
+                break
+
+        return AnalysisResult(scores, depth, self._nodes, time.time() - start)
+
+    def _max_depth(self, max_depth, moves):
+        if max_depth is None:
+            max_depth = MAX_MOVES - moves
+        return max(1, min(max_depth, MAX_MOVES - moves))
+
+    def _start(self, time_budget, node_budget):
+        """Reset the node count and budgets for a new search; returns its start time."""
+        start = time.time()
+        self._nodes = 0
+        self._node_limit = node_budget
+        self._deadline = start + time_budget if time_budget is not None else None
+        self._next_budget_check = _BUDGET_CHECK_INTERVAL
+        return start
+
+    def _probe_book_root(self, position, mask, moves, depth, legal_columns):
+        # Every move's resulting position has to be in the book, with a value at least as good as searching it to
+        # `depth - 1`, otherwise we don't know the best one
+        if self.book is None or moves + 1 > self.book.max_ply:
+            return None
+
+        best = None
+        for column_index in legal_columns:
+            new_mask = mask | (mask + bottom_mask(column_index))
+            if has_alignment(position | (new_mask ^ mask)):
+                return column_index, WIN_SCORE - moves - 1
+
+            value = self._probe_book(position ^ mask, new_mask, depth - 1)
+            if value is None:
+                return None
+
+            if best is None or -value > best[1]:
+                best = (column_index, -value)
+
+        return best
+
+    def _probe_book(self, position, mask, depth):
+        # Book values come from a search to `book.depth`: they stand in for a deeper search only once proven
+        value = self.book.get(canonical_key(position, mask))
+        if value is None or (depth > self.book.depth and abs(value) <= WIN_THRESHOLD):
+            return None
+        return value
+
+    def _search_root(self, position, mask, moves, depth, legal_columns):
+        # Try the previous iteration's best move first
+        entry = self.table.get(position_key(position, mask))
+        columns = list(legal_columns)
+        if entry is not None and entry[4] in columns:
+            columns.remove(entry[4])
+            columns.insert(0, entry[4])
+
+        alpha = -WIN_SCORE
+        beta = WIN_SCORE
+        best_column_index = columns[0]
+        for column_index in columns:
+            new_mask = mask | (mask + bottom_mask(column_index))
+            if has_alignment(position | (new_mask ^ mask)):
+                return column_index, WIN_SCORE - moves - 1
+
+            score = -self._negamax(position ^ mask, new_mask, moves + 1, depth - 1, -beta, -alpha)
+            if score > alpha:
+                alpha = score
+                best_column_index = column_index
+
+        self.table.put(position_key(position, mask), depth, _EXACT, alpha, best_column_index)
+        return best_column_index, alpha
+
+    def _score_columns(self, position, mask, moves, depth, legal_columns):
+        scores = {}
+        for column_index in legal_columns:
+            new_mask = mask | (mask + bottom_mask(column_index))
+            if has_alignment(position | (new_mask ^ mask)):
+                scores[column_index] = WIN_SCORE - moves - 1
+            else:
+                scores[column_index] = -self._negamax(
+                    position ^ mask, new_mask, moves + 1, depth - 1, -WIN_SCORE, WIN_SCORE
+                )
+
+        return scores
+
+    def _negamax(self, position, mask, moves, depth, alpha, beta):
+        self._nodes += 1
+        if self._nodes >= self._next_budget_check:
+            self._check_budget()
+
+        if moves == MAX_MOVES:
+            return 0
+
+        possible = (mask + _BOTTOM_MASK) & _BOARD_MASK
+        own_winning_slots = _winning_slots(position, mask)
+        if own_winning_slots & possible:
+            return WIN_SCORE - moves - 1
+
+        opponent_winning_slots = _winning_slots(position ^ mask, mask)
+        forced = possible & opponent_winning_slots
+        if forced:
+            if forced & (forced - 1):
+                # The opponent has two immediate threats; we can only block one
+                return -(WIN_SCORE - moves - 2)
+            possible = forced
+
+        # Never play directly below an opponent's winning slot
+        possible &= ~(opponent_winning_slots >> 1)
+        if not possible:
+            return -(WIN_SCORE - moves - 2)
+
+        if self.book is not None and moves <= self.book.max_ply:
+            value = self._probe_book(position, mask, depth)
+            if value is not None:
+                return value
+
+        if depth == 0:
+            return _popcount(own_winning_slots) - _popcount(opponent_winning_slots)
+
+        original_alpha = alpha
+        key = position_key(position, mask)
+        entry = self.table.get(key)
+        hash_column_index = None
+        if entry is not None:
+            hash_column_index = entry[4]
+            if entry[1] >= depth:
+                flag = entry[2]
+                value = entry[3]
+                if flag == _EXACT:
+                    return value
+                elif flag == _LOWER_BOUND:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+
+                if alpha >= beta:
+                    return value
+
+        columns = _COLUMN_ORDER
+        if hash_column_index is not None:
+            columns = [hash_column_index] + [column_index for column_index in _COLUMN_ORDER
+                                             if column_index != hash_column_index]
+
+        best_value = -WIN_SCORE
+        best_column_index = None
+        opponent_position = position ^ mask
+        for column_index in columns:
+            move = possible & _column_mask(column_index)
+            if not move:
+                continue
+
+            value = -self._negamax(opponent_position, mask | move, moves + 1, depth - 1, -beta, -alpha)
+            if value > best_value:
+                best_value = value
+                best_column_index = column_index
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+
+        if best_value <= original_alpha:
+            flag = _UPPER_BOUND
+        elif best_value >= beta:
+            flag = _LOWER_BOUND
+        else:
+            flag = _EXACT
+        self.table.put(key, depth, flag, best_value, best_column_index)
+
+        return best_value
+
+    def _check_budget(self):
+        self._next_budget_check = self._nodes + _BUDGET_CHECK_INTERVAL
+        if self._node_limit is not None and self._nodes >= self._node_limit:
+            raise _BudgetExceeded()
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise _BudgetExceeded()
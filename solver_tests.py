@@ -0,0 +1,127 @@
+import unittest
+
+from board_model import (
+    Board,
+    DiscType,
+)
+from solver import (
+    NoLegalMoveError,
+    Solver,
+    TranspositionTable,
+    WIN_THRESHOLD,
+)
+
+
+def _played(board, column_index, disc_type):
+    board = board.copy()
+    board.drop_disc(column_index, disc_type)
+    return board
+
+
+class SolverTests(unittest.TestCase):
+    def test_takes_immediate_win(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 2, 2, 2, 0, 0, 0],
+            [0, 1, 1, 1, 0, 0, 1],
+        ]
+        result = Solver().search(Board(grid), DiscType.PLAYER_1, max_depth=4)
+        self.assertIn(result.column_index, (0, 4))
+        self.assertTrue(result.is_win())
+
+    def test_blocks_immediate_threat(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 2],
+            [0, 0, 0, 0, 0, 1, 2],
+            [0, 0, 0, 1, 0, 1, 2],
+        ]
+        result = Solver().search(Board(grid), DiscType.PLAYER_1, max_depth=4)
+        self.assertEqual(result.column_index, 6)
+
+    def test_finds_forced_win(self):
+        # Player 1 can open both ends of a row of three
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 2, 2, 0, 0, 0],
+            [0, 0, 1, 1, 0, 0, 0],
+        ]
+        result = Solver().search(Board(grid), DiscType.PLAYER_1, max_depth=6)
+        self.assertIn(result.column_index, (1, 4))
+        self.assertTrue(result.is_win())
+
+        # The opponent sees the loss coming
+        board = Board(grid)
+        board.drop_disc(result.column_index, DiscType.PLAYER_1)
+        result = Solver().search(board, DiscType.PLAYER_2, max_depth=6)
+        self.assertTrue(result.is_loss())
+
+    def test_analyze(self):
+        grid = [
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0],
+            [0, 0, 2, 2, 0, 0, 0],
+            [0, 0, 1, 1, 0, 0, 0],
+        ]
+        board = Board(grid)
+        analysis = Solver().analyze(board, DiscType.PLAYER_1, max_depth=6)
+        self.assertEqual(sorted(analysis.scores), range(Board.WIDTH))
+        self.assertIn(analysis.best_column_index, (1, 4))
+        self.assertGreater(analysis.scores[analysis.best_column_index], WIN_THRESHOLD)
+        self.assertEqual(analysis.depth, 6)
+        # Every column gets an exact score, not just the best one
+        self.assertEqual(
+            analysis.scores[0], -Solver().search(_played(board, 0, DiscType.PLAYER_1), max_depth=5).score,
+        )
+
+        mirrored = analysis.mirrored()
+        self.assertEqual(mirrored.scores[6], analysis.scores[0])
+        self.assertEqual(mirrored.mirrored(), analysis)
+
+        # Nothing to score once the game is over
+        board.drop_disc(4, DiscType.PLAYER_1)
+        board.drop_disc(0, DiscType.PLAYER_2)
+        board.drop_disc(1, DiscType.PLAYER_1)
+        analysis = Solver().analyze(board)
+        self.assertEqual(analysis.scores, {})
+        self.assertIsNone(analysis.best_column_index)
+
+    def test_budgets(self):
+        solver = Solver()
+        result = solver.search(Board(), node_budget=2000)
+        self.assertLess(result.nodes, 2000 + 256)
+        self.assertGreater(result.depth, 0)
+        self.assertIn(result.column_index, xrange(Board.WIDTH))
+        self.assertGreater(result.nodes_per_second, 0)
+
+        result = solver.search(Board(), time_budget=0.05)
+        self.assertLess(result.elapsed, 0.5)
+
+    def test_full_board(self):
+        board = Board()
+        for column_index in xrange(Board.WIDTH):
+            for i in xrange(Board.HEIGHT):
+                disc_type = DiscType.PLAYER_1 if (column_index // 2 + i) % 2 == 0 else DiscType.PLAYER_2
+                board.drop_disc(column_index, disc_type)
+
+        with self.assertRaises(NoLegalMoveError):
+            Solver().search(board)
+
+    def test_transposition_table_is_bounded(self):
+        table = TranspositionTable(size=11)
+        for key in xrange(100):
+            table.put(key, 1, 0, key, 3)
+
+        self.assertEqual(len(table._entries), 11)
+        self.assertEqual(table.get(99)[3], 99)
+        self.assertIsNone(table.get(88))
@@ -1,19 +1,34 @@
 'use strict';
 
+// Position of spectators, who watch a game without playing in it
+var SPECTATOR_POSITION = 0;
 
 // TODO(nikrad): Move components into separate files and explicitly declare dependencies via CommonJS or Require JS
 
 class GameState {
-    constructor (grid, playerCount, positionWithTurn, winner) {
+    constructor (grid, playerCount, positionWithTurn, winner, seq, connect) {
+        // The grid's size follows the game's board variant; `connect` is how many discs in a row win
         this.grid = grid;
         this.playerCount = playerCount;
         this.positionWithTurn = positionWithTurn;
         this.winner = winner;
+        this.seq = seq;
+        this.connect = connect;
     }
 
     static fromJSON(jsonString) {
         var data = JSON.parse(jsonString);
-        return new GameState(data.grid, data.player_count, data.position_with_turn, data.winner);
+        return new GameState(
+            data.grid, data.player_count, data.position_with_turn, data.winner, data.seq, data.connect
+        );
+    }
+
+    applyMove(move) {
+        // Only the changed row gets copied, so cells in the other rows keep their props and skip rendering
+        var grid = this.grid.slice();
+        grid[move.row] = grid[move.row].slice();
+        grid[move.row][move.col] = move.disc;
+        return new GameState(grid, this.playerCount, move.turn, move.winner, move.seq, this.connect);
     }
 }
 
@@ -29,6 +44,11 @@ var BoardCell = React.createClass({
         playerPosition: React.PropTypes.number.isRequired
     },
 
+    shouldComponentUpdate: function (nextProps) {
+        // The game state is only read when the cell is clicked, and React hands us the new props either way
+        return nextProps.discType !== this.props.discType || nextProps.playerPosition !== this.props.playerPosition;
+    },
+
     render: function () {
         var discClass = classNames({
             cell_dimension: true,
@@ -43,7 +63,9 @@ var BoardCell = React.createClass({
     },
 
     onClick: function () {
-        if (this.props.gameState.winner !== null) {
+        if (this.props.playerPosition === SPECTATOR_POSITION) {
+            alert("You're watching this game.");
+        } else if (this.props.gameState.winner !== null) {
             alert('The game is over!');
         } else {
             if (this.props.gameState.playerCount === 2) {
@@ -102,11 +124,18 @@ var WelcomeBar = React.createClass({
     displayName: 'WelcomeBar',
 
     propTypes: {
-        playerColor: React.PropTypes.string.isRequired
+        connect: React.PropTypes.number,
+        playerColor: React.PropTypes.string
     },
 
     render: function () {
-        return React.createElement('p', {}, `Welcome! Your color is ${this.props.playerColor}.`)
+        var message = this.props.playerColor ? `Welcome! Your color is ${this.props.playerColor}.` :
+            "Welcome! You're watching this game.";
+        if (this.props.connect && this.props.connect !== 4) {
+            message += ` Line up ${this.props.connect} discs to win.`;
+        }
+
+        return React.createElement('p', {}, message)
     }
 });
 
@@ -126,6 +155,10 @@ var StatusBar = React.createClass({
     },
 
     render: function () {
+        if (this.props.playerPosition === SPECTATOR_POSITION) {
+            return this.renderForSpectator();
+        }
+
         var message, restart;
         if (this.props.gameState.winner !== null) {
             // The game is over
@@ -157,6 +190,22 @@ var StatusBar = React.createClass({
         var messageSpan = React.createElement('span', {}, message);
 
         return React.createElement('p', {className: 'status_bar'}, [messageSpan, restart]);
+    },
+
+    renderForSpectator: function () {
+        var colors = {1: 'Yellow', 2: 'Red'};
+        var message;
+        if (this.props.gameState.winner === 0) {
+            message = 'The game ended with no winner.';
+        } else if (this.props.gameState.winner !== null) {
+            message = `${colors[this.props.gameState.winner]} won!`;
+        } else if (this.props.gameState.playerCount === 2) {
+            message = `${colors[this.props.gameState.positionWithTurn]} to move.`;
+        } else {
+            message = 'Waiting for another player to join.';
+        }
+
+        return React.createElement('p', {className: 'status_bar'}, React.createElement('span', {}, message));
     }
 });
 
@@ -168,7 +217,7 @@ var GameView = React.createClass({
         gameState: React.PropTypes.instanceOf(GameState),
         onClickCell: React.PropTypes.func.isRequired,
         onClickRestart: React.PropTypes.func.isRequired,
-        playerColor: React.PropTypes.string.isRequired,
+        playerColor: React.PropTypes.string,
         playerPosition: React.PropTypes.number.isRequired
     },
 
@@ -176,6 +225,7 @@ var GameView = React.createClass({
         return React.createElement('div', {}, [
             React.createElement(WelcomeBar, {
                 key: 'welcome-bar',
+                connect: this.props.gameState.connect,
                 playerColor: this.props.playerColor
             }),
             React.createElement(StatusBar, {
@@ -196,11 +246,18 @@ var GameView = React.createClass({
 
 
 class Game {
-    constructor (playerPosition) {
+    constructor (playerPosition, gameId) {
         this.playerPosition = playerPosition;
-        this.playerColor = this.playerPosition === 1 ? 'yellow' : 'red';
+        this.gameState = null;
 
-        this.socket = io();
+        if (this.playerPosition === SPECTATOR_POSITION) {
+            // Spectators get the game's broadcasts on a namespace of their own
+            this.playerColor = null;
+            this.socket = io('/watch?game_id=' + encodeURIComponent(gameId));
+        } else {
+            this.playerColor = this.playerPosition === 1 ? 'yellow' : 'red';
+            this.socket = io();
+        }
         this.socket.on('connect', this.handleConnect.bind(this));
     }
 
@@ -211,6 +268,7 @@ class Game {
 
     listen () {
         this.socket.on('game_state', this.handleGameState.bind(this));
+        this.socket.on('move', this.handleMove.bind(this));
         this.socket.on('alert', this.handlerAlert);
     }
 
@@ -220,12 +278,27 @@ class Game {
     }
 
     handleGameState (jsonString) {
-        var gameState = GameState.fromJSON(jsonString);
-        console.log(gameState);
+        this.gameState = GameState.fromJSON(jsonString);
+        console.log(this.gameState);
+        this.render();
+    }
+
+    handleMove (jsonString) {
+        var move = JSON.parse(jsonString);
+        if (this.gameState === null || move.seq > this.gameState.seq + 1) {
+            // We missed something, so ask for the whole game
+            console.log('Missed moves before ' + move.seq + ', syncing');
+            this.socket.emit('sync');
+        } else if (move.seq === this.gameState.seq + 1) {
+            this.gameState = this.gameState.applyMove(move);
+            this.render();
+        }
+    }
 
+    render () {
         ReactDOM.render(
             React.createElement(GameView, {
-                gameState: gameState,
+                gameState: this.gameState,
                 onClickCell: this.dropDisc.bind(this),
                 onClickRestart: this.restart.bind(this),
                 playerColor: this.playerColor,
@@ -0,0 +1,195 @@
+"""Background sweeper that deletes abandoned games.
+
+Games expire on their own a day after their last write (`GAME_TTL`), but most games are abandoned long before that:
+crawlers hitting `/`, tabs closed before a second player joined. The sweeper walks the keyspace with SCAN in small
+batches, so Redis never blocks on it, and deletes every game whose human players have all disconnected and that
+nobody has written for `min_idle` seconds. The grace period covers the gap between creating a game and its first
+player joining.
+
+Every app process can run the sweeper in the background (see `RUN_SWEEPER` in app.py), but only one pass runs per
+`SWEEP_INTERVAL` across all of them: before each pass a process takes a Redis lease that lasts the whole interval,
+and the processes that don't get it skip the pass. Run a single pass by hand, lease or not, with:
+
+    python sweeper.py --once
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+from game_store import (
+    AI_PLAYER_ID,
+    GAME_KEY_PREFIX,
+    GAME_TTL,
+    OPEN_CONNECTIONS_PREFIX,
+    game_keys,
+    redis_client,
+    sweep_game_script,
+)
+from metrics import operation
+
+
+# Keys SCAN looks at per call, which bounds how long each call and each batch of deletions holds up Redis
+SWEEP_BATCH_SIZE = 100
+
+# Seconds to wait between batches
+SWEEP_BATCH_PAUSE = 0.01
+
+# Seconds a game without connected players is kept after its last write
+SWEEP_MIN_IDLE = 10 * 60
+
+# Seconds between passes when sweeping in the background
+SWEEP_INTERVAL = 10 * 60
+
+# Key of the lease that lets one process sweep per interval
+SWEEP_LEASE_KEY = 'sweeper-lock'
+
+SWEEP_SUMMARY = "Swept %(games_scanned)d games: deleted %(games_deleted)d games, %(keys_deleted)d keys, " \
+    "%(bytes_reclaimed)d bytes"
+
+
+class GameSweeper(object):
+    """Deletes abandoned games and keeps running totals of what it reclaimed."""
+
+    def __init__(self, batch_size=SWEEP_BATCH_SIZE, batch_pause=SWEEP_BATCH_PAUSE, min_idle=SWEEP_MIN_IDLE,
+                 game_id_prefix=''):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.min_idle = min_idle
+        # Only games whose id starts with this are swept
+        self.game_id_prefix = game_id_prefix
+        self.passes = 0
+        self.games_scanned = 0
+        self.games_deleted = 0
+        self.keys_deleted = 0
+        self.bytes_reclaimed = 0
+
+    @operation('sweep')
+    def sweep(self):
+        """Make one pass over every game.
+
+        Returns:
+            dict with the number of games scanned and deleted, keys deleted and bytes reclaimed during this pass
+        """
+        totals = dict(games_scanned=0, games_deleted=0, keys_deleted=0, bytes_reclaimed=0)
+        cursor = 0
+        while True:
+            cursor, keys = redis_client.scan(
+                cursor, match=GAME_KEY_PREFIX + self.game_id_prefix + '*', count=self.batch_size,
+            )
+            if keys:
+                self._sweep_batch(keys, totals)
+
+            if cursor == 0:
+                break
+            time.sleep(self.batch_pause)
+
+        self.passes += 1
+        self.games_scanned += totals["games_scanned"]
+        self.games_deleted += totals["games_deleted"]
+        self.keys_deleted += totals["keys_deleted"]
+        self.bytes_reclaimed += totals["bytes_reclaimed"]
+
+        return totals
+
+    def _sweep_batch(self, keys, totals):
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in keys:
+            sweep_game_script(
+                keys=game_keys(key[len(GAME_KEY_PREFIX):]),
+                args=[GAME_TTL, self.min_idle, OPEN_CONNECTIONS_PREFIX, OPEN_CONNECTIONS_PREFIX + AI_PLAYER_ID],
+                client=pipeline,
+            )
+
+        for keys_deleted, size in pipeline.execute():
+            totals["games_scanned"] += 1
+            if keys_deleted:
+                totals["games_deleted"] += 1
+                totals["keys_deleted"] += keys_deleted
+                totals["bytes_reclaimed"] += size
+
+    def stats(self):
+        return dict(
+            passes=self.passes,
+            games_scanned=self.games_scanned,
+            games_deleted=self.games_deleted,
+            keys_deleted=self.keys_deleted,
+            bytes_reclaimed=self.bytes_reclaimed,
+        )
+
+
+def acquire_sweep_lease(interval=SWEEP_INTERVAL):
+    """Claim the next sweep for this process.
+
+    The lease isn't released after the pass: it expires after `interval`, so however many processes ask, one pass runs
+    per interval, and another process takes over if the one sweeping dies.
+
+    Returns:
+        True if this process should sweep now, False if another one already is or did during this interval
+    """
+    owner = '%s:%d' % (socket.gethostname(), os.getpid())
+    return bool(redis_client.set(SWEEP_LEASE_KEY, owner, nx=True, ex=max(1, int(interval))))
+
+
+def run_sweeper(sweeper, interval=SWEEP_INTERVAL, log=None):
+    """Sweep every `interval` seconds whenever this process holds the sweep lease. Runs forever."""
+    while True:
+        start = time.time()
+        try:
+            if acquire_sweep_lease(interval):
+                totals = sweeper.sweep()
+                if log:
+                    log(SWEEP_SUMMARY % totals)
+        except Exception as error:
+            # Keep sweeping after Redis hiccups
+            if log:
+                log("Sweep failed: %s" % error)
+
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    """Run `run_sweeper()` in a daemon thread.
+
+    Returns:
+        The `GameSweeper`, whose `stats()` keep growing as it runs
+    """
+    def log(message):
+        print(message)
+
+    sweeper = GameSweeper()
+    thread = threading.Thread(
+        target=run_sweeper,
+        args=(sweeper,),
+        kwargs=dict(interval=interval, log=log),
+        name='game-sweeper',
+    )
+    thread.daemon = True
+    thread.start()
+    return sweeper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete abandoned Connect Four games.")
+    parser.add_argument('--once', action='store_true', help="make one pass and exit")
+    parser.add_argument('--interval', type=float, default=SWEEP_INTERVAL, help="seconds between passes")
+    parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE, help="keys to scan per batch")
+    parser.add_argument('--min-idle', type=int, default=SWEEP_MIN_IDLE,
+                        help="seconds an abandoned game is kept after its last write")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+
+    sweeper = GameSweeper(batch_size=args.batch_size, min_idle=args.min_idle)
+    if args.once:
+        totals = sweeper.sweep()
+        log(SWEEP_SUMMARY % totals)
+    else:
+        run_sweeper(sweeper, interval=args.interval, log=log)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import unittest
+
+import redis
+
+from game_store import (
+    GAME_TTL,
+    GameStore,
+    game_key,
+    move_log_key,
+    redis_client,
+    snapshots_key,
+)
+from sweeper import (
+    SWEEP_LEASE_KEY,
+    GameSweeper,
+    acquire_sweep_lease,
+)
+
+
+class GameSweeperTests(unittest.TestCase):
+    # These tests need the Redis server from `REDIS_CONNECTION_SETTINGS`
+    def setUp(self):
+        try:
+            redis_client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis isn't running")
+
+        # Games get ids of their own, so the sweeper leaves any other games in this Redis alone
+        self.game_id_prefix = 'sweeper-test-%s-' % GameStore.new_game_id()
+        self.game_ids = []
+
+    def tearDown(self):
+        for game_id in self.game_ids:
+            redis_client.delete(game_key(game_id), move_log_key(game_id), snapshots_key(game_id))
+
+    def create_game(self, ai_opponent=False, idle=0):
+        game_id = GameStore.create(ai_opponent=ai_opponent, game_id=self.game_id_prefix + GameStore.new_game_id())
+        self.game_ids.append(game_id)
+        redis_client.expire(game_key(game_id), GAME_TTL - idle)
+        return game_id
+
+    def test_sweep(self):
+        abandoned_game_id = self.create_game(idle=120)
+        abandoned_ai_game_id = self.create_game(ai_opponent=True, idle=120)
+        new_game_id = self.create_game(idle=10)
+        active_game_id = self.create_game()
+        GameStore.add_player(active_game_id, 'player-one')
+        redis_client.expire(game_key(active_game_id), GAME_TTL - 120)
+
+        # A left game that played moves has a move log too
+        left_game_id = self.create_game()
+        GameStore.add_player(left_game_id, 'player-one')
+        GameStore.add_player(left_game_id, 'player-two')
+        GameStore.play_turn(left_game_id, 'player-one', 3)
+        GameStore.disconnect_player(left_game_id, 'player-one')
+        GameStore.disconnect_player(left_game_id, 'player-two')
+        self.assertEqual(redis_client.ttl(move_log_key(left_game_id)), GAME_TTL)
+        for key in (game_key(left_game_id), move_log_key(left_game_id)):
+            redis_client.expire(key, GAME_TTL - 120)
+
+        sweeper = GameSweeper(batch_size=10, batch_pause=0, min_idle=60, game_id_prefix=self.game_id_prefix)
+        totals = sweeper.sweep()
+        self.assertEqual(totals["games_scanned"], 5)
+        # The AI alone doesn't keep a game alive
+        self.assertFalse(redis_client.exists(game_key(abandoned_game_id)))
+        self.assertFalse(redis_client.exists(game_key(abandoned_ai_game_id)))
+        self.assertFalse(redis_client.exists(game_key(left_game_id)))
+        self.assertFalse(redis_client.exists(move_log_key(left_game_id)))
+        self.assertTrue(redis_client.exists(game_key(new_game_id)))
+        self.assertTrue(redis_client.exists(game_key(active_game_id)))
+        self.assertEqual(totals["games_deleted"], 3)
+        self.assertEqual(totals["keys_deleted"], 4)
+        self.assertGreater(totals["bytes_reclaimed"], 0)
+        self.assertEqual(sweeper.stats()["passes"], 1)
+        self.assertEqual(sweeper.stats()["games_deleted"], totals["games_deleted"])
+
+    def test_sweep_lease(self):
+        redis_client.delete(SWEEP_LEASE_KEY)
+        try:
+            # One process gets each interval's pass
+            self.assertTrue(acquire_sweep_lease(interval=30))
+            self.assertFalse(acquire_sweep_lease(interval=30))
+            self.assertLessEqual(redis_client.ttl(SWEEP_LEASE_KEY), 30)
+
+            # Whoever asks once it expires sweeps next
+            redis_client.delete(SWEEP_LEASE_KEY)
+            self.assertTrue(acquire_sweep_lease(interval=30))
+        finally:
+            redis_client.delete(SWEEP_LEASE_KEY)